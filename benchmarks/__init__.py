@@ -0,0 +1 @@
+# Benchmarks of the city search pipeline, see run_benchmarks.py
@@ -0,0 +1,409 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+# Benchmarks of the whole pipeline (load, enrich, index, query), on synthetic data of several sizes,
+# without the network: the weather comes from benchmarks.synthetic.FixtureWeatherSource,
+# and the crime data from the local mock of the crime API (mock_crime_api.py).
+#
+# Run from the project folder:
+#     python -m benchmarks.run_benchmarks --cities 1000 10000 --zips 100000 --output before.json
+#     ... change something ...
+#     python -m benchmarks.run_benchmarks --cities 1000 10000 --zips 100000 --output after.json
+#     python -m benchmarks.run_benchmarks --compare before.json after.json
+#
+# Every stage reports its time, and (unless --no-memory) the peak memory it allocated (tracemalloc, which also makes
+# the stages a little slower, so only compare runs made with the same options).
+#
+# The start of the web app with the data already cached is also measured, in a new Python process: how long
+# importing the app, loading the data (dataset.load_dataset(), which opens the snapshot) and creating the app take,
+# and whether any of the data-acquisition or plotting libraries got imported on the way. A run over the budget
+# (--startup-budget) exits with an error.
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from werkzeug.datastructures import MultiDict
+
+import zipcode_index as zi
+import weather_data as wd
+import get_crime_data as gcr
+import get_house_prices as ghp
+import join_data as jd
+import city_table as ct
+import city_index as ci
+import search_functions as sf
+import search_api as sa
+import index_snapshot as snap
+import dataset as ds
+import config as cfg
+import similarity as sim
+import ranking as rk
+import price_trends as pt
+import mock_crime_api as mca
+from benchmarks import synthetic
+
+DEFAULT_CITIES = [1000, 10000]
+DEFAULT_ZIPS = 100000
+# a stage counts as slower (or faster) when its time changed by more than this fraction
+DEFAULT_THRESHOLD = 0.1
+# seconds the web app may take to import and start, with the data already cached
+DEFAULT_STARTUP_BUDGET = 0.75
+# libraries only needed to fetch the data or to draw plots, which the start of the web app should not import
+HEAVY_MODULES = ['pandas', 'plotly', 'geonamescache', 'zipcodes', 'meteostat', 'requests']
+
+# run in a new process (so nothing is imported yet): import the app, load the data the way the app does
+# (from the snapshot in the cache folder, which must match the sources), and create the app with it
+STARTUP_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import hardikm_final_proj_v1 as proj
+import config as cfg
+import dataset as ds
+imported = time.perf_counter()
+config = cfg.get_config(json.loads(sys.argv[1]))
+dataset = ds.load_dataset(config)
+if dataset.build_report is not None:
+    sys.exit('the data was built again instead of being loaded from the snapshot')
+loaded = time.perf_counter()
+app = proj.create_app(config, dataset)
+ready = time.perf_counter()
+print(json.dumps({'import_seconds': imported - start, 'load_dataset_seconds': loaded - imported, 'create_app_seconds': ready - loaded,
+                  'heavy_modules': [name for name in sys.argv[2].split(',') if name in sys.modules]}))
+'''
+
+
+class Recorder:
+    '''
+    This class runs the stages of a benchmark and keeps their results.
+    '''
+    def __init__(self, measure_memory=True, verbose=False):
+        self.measure_memory = measure_memory
+        self.verbose = verbose
+        self.results = {}
+
+    def stage(self, name, function, operations=None):
+        '''
+        This function runs one stage and records how long it took (and its peak memory).
+
+        Parameters:
+        name (str): name of the stage
+        function (function): called without arguments, runs the stage, and returns its result
+        operations (int): how many operations the stage does (e.g. queries), to report the time per operation
+
+        Returns:
+        result: whatever function returned
+        '''
+        if self.measure_memory:
+            tracemalloc.start()
+        output = io.StringIO()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stdout if self.verbose else output):
+            result = function()
+        seconds = time.perf_counter() - start
+        record = {'seconds': round(seconds, 6)}
+        if self.measure_memory:
+            record['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 3)
+            tracemalloc.stop()
+        if operations:
+            record['operations'] = operations
+            record['ms_per_operation'] = round(seconds * 1000 / operations, 6)
+        self.results[name] = record
+        print('  ' + name.ljust(40) + ('%.4f s' % seconds).rjust(12) + ('  %.1f MB' % record['peak_mb'] if 'peak_mb' in record else ''))
+        return result
+
+    def record(self, name, seconds):
+        '''
+        This function records a stage that was timed somewhere else (e.g. in another process).
+        '''
+        self.results[name] = {'seconds': round(seconds, 6)}
+        print('  ' + name.ljust(40) + ('%.4f s' % seconds).rjust(12))
+
+
+def measure_startup(recorder, config, budget=DEFAULT_STARTUP_BUDGET):
+    '''
+    This function starts the web app in a new process, with the snapshot of the table and index in its cache folder
+    (like when every cache is warm), and checks that it starts within the budget without importing any of the heavy libraries.
+
+    Parameters:
+    config (dict): the settings of the app (at least CACHE_DIR and DATA_DIR)
+
+    Returns:
+    problems (list): what went over the budget (empty if nothing did)
+    '''
+    completed = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, json.dumps(config), ','.join(HEAVY_MODULES)],
+                               cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    startup = json.loads(completed.stdout.strip().splitlines()[-1])
+    recorder.record('startup_import', startup['import_seconds'])
+    recorder.record('startup_load_dataset', startup['load_dataset_seconds'])
+    recorder.record('startup_create_app', startup['create_app_seconds'])
+    problems = []
+    total = startup['import_seconds'] + startup['load_dataset_seconds'] + startup['create_app_seconds']
+    if total > budget:
+        problems.append('the web app took %.3f s to start (budget %.3f s)' % (total, budget))
+    if startup['heavy_modules']:
+        problems.append('the start of the web app imported ' + ', '.join(startup['heavy_modules']))
+    for problem in problems:
+        print('  over budget: ' + problem)
+    return problems
+
+
+def random_ranges(rng):
+    '''
+    This function returns a random search, like the ones made on the search form or the json API.
+    '''
+    ranges = {}
+    if rng.random() < 0.8:
+        low = rng.choice([None, 100000, 200000, 300000, 400000])
+        ranges['price'] = (low, None if low is None else low + rng.choice([100000, 200000, 500000]))
+    if rng.random() < 0.5:
+        ranges['crime_rate'] = (None, rng.uniform(0.01, 0.04))
+    if rng.random() < 0.5:
+        low = rng.uniform(75, 100)
+        ranges['summer_high'] = (low, low + 10)
+    if rng.random() < 0.3:
+        ranges['winter_low'] = (rng.uniform(0, 40), None)
+    return ranges
+
+
+def run_size(recorder, n_cities, zip_index, crime_rows, work_dir, seed=0, startup_budget=DEFAULT_STARTUP_BUDGET):
+    '''
+    This function runs every stage that depends on the number of cities.
+
+    Returns:
+    problems (list): what went over the startup budget, see measure_startup()
+    '''
+    rng = random.Random(seed)
+    geonames = synthetic.make_geonames_cities(n_cities, seed)
+
+    # location: every city to its closest zipcode
+    matches = recorder.stage('zip_lookup', lambda: zip_index.lookup_many([c['latitude'] for c in geonames],
+                                                                         [c['longitude'] for c in geonames]), n_cities)
+    for city, match in zip(geonames, matches):
+        city['county'], city['state'], city['example_zipcode'] = match if match is not None else (None, None, None)
+
+    # weather: stations, monthly data (cold, then from the cache on disk), seasonal averages
+    weather_dir = os.path.join(work_dir, 'weather_' + str(n_cities))
+    start, end = datetime(2018, 1, 1), datetime(2022, 12, 31)
+    source = synthetic.FixtureWeatherSource()
+    recorder.stage('weather_fetch_cold', lambda: wd.fetch_weather(geonames, start, end, source, cache_dir=weather_dir), n_cities)
+    city_stations, station_data = recorder.stage('weather_fetch_cached', lambda: wd.fetch_weather(geonames, start, end, source, cache_dir=weather_dir), n_cities)
+    recorder.stage('weather_seasonal_params', lambda: wd.seasonal_params(wd.to_long_format(station_data)), len(station_data))
+
+    # house prices: parse the csv file, write the binary snapshot, read it back
+    city_rows = synthetic.make_city_rows(n_cities, seed)
+    prices_file = synthetic.write_house_prices_csv(os.path.join(work_dir, 'prices_' + str(n_cities) + '.csv'), city_rows, seed=seed)
+    snapshot_file = os.path.join(work_dir, 'prices_' + str(n_cities) + '.npy')
+    meta_file = os.path.join(work_dir, 'prices_' + str(n_cities) + '_meta.json')
+    price_rows = recorder.stage('house_prices_csv', lambda: list(ghp.iter_prices(ghp.DEFAULT_MONTH, 1, prices_file)))
+    recorder.stage('house_prices_snapshot_write', lambda: ghp.write_price_snapshot(prices_file, snapshot_file, meta_file))
+    recorder.stage('house_prices_snapshot_read', lambda: list(ghp.iter_prices_from_snapshot(ghp.DEFAULT_MONTH, 1, snapshot_file, meta_file)))
+    price_matrix = ghp.load_price_snapshot(snapshot_file, meta_file)[0]
+    recorder.stage('price_trends', lambda: pt.compute_trends(price_matrix), len(price_matrix))
+
+    # join, table and index
+    states_file = os.path.join(REPO_DIR, jd.STATES_FILE)
+    cities = recorder.stage('make_cities', lambda: ds.make_cities(city_rows), n_cities)
+    recorder.stage('join', lambda: jd.enrich_cities(cities, crime_rows, price_rows, states_file=states_file), n_cities)
+    cities = [city for city in cities if city.house_price is not None and city.crime_rate is not None]
+    table = recorder.stage('table_build', lambda: ct.CityTable.from_cities(cities), len(cities))
+    index = recorder.stage('index_build', lambda: ci.CityIndex(table), len(cities))
+
+    def build_legacy_tree():
+        search_tree = sf.make_search_tree({})
+        for city in cities:
+            sf.add_city_to_search_tree(city, search_tree)
+        return search_tree
+    recorder.stage('legacy_tree_build', build_legacy_tree, len(cities))
+
+    # snapshot of the table and index, in the cache folder of the app, for the sources of that folder
+    # (so that dataset.load_dataset() opens it when the app starts)
+    app_config = {'CACHE_DIR': work_dir, 'DATA_DIR': REPO_DIR}
+    table_snapshot = os.path.join(work_dir, snap.SNAPSHOT_FILE)
+    checksum = snap.sources_checksum(ds.dataset_sources(cfg.get_config(app_config)))
+    recorder.stage('snapshot_write', lambda: snap.write_snapshot(table_snapshot, table, index, checksum))
+    recorder.stage('snapshot_load', lambda: snap.load_snapshot(table_snapshot, checksum))
+    problems = measure_startup(recorder, app_config, startup_budget)
+
+    # queries
+    labels = [[p, c, s, w] for p in ['price below 200k', 'price 200-400k', 'price 400-600k', 'price above 600k']
+              for c in ['crime rare', 'crime medium', 'crime frequent']
+              for s in ['summer temp below 90', 'summer temp 90-100', 'summer temp above 100']
+              for w in ['winter temp below 40', 'winter temp 40-50', 'winter temp above 50']]
+    recorder.stage('bucket_queries', lambda: [sf.search_buckets(index, bucket_labels) for bucket_labels in labels], len(labels))
+    searches = [(random_ranges(rng), rng.choice([None, 'price', 'population']), rng.random() < 0.5) for _ in range(1000)]
+    recorder.stage('range_queries_top20', lambda: [index.query_positions(r, s, d, 20) for r, s, d in searches], len(searches))
+    places = [(rng.uniform(*synthetic.LAT_RANGE), rng.uniform(*synthetic.LONG_RANGE), random_ranges(rng)) for _ in range(1000)]
+    recorder.stage('geo_index_build', lambda: index.geo())
+    recorder.stage('radius_queries_100mi', lambda: [index.near_positions(lat, long, 160.9, None, r) for lat, long, r in places], len(places))
+    recorder.stage('nearest_queries_k10', lambda: [index.near_positions(lat, long, None, 10, r) for lat, long, r in places], len(places))
+    matrix = recorder.stage('similarity_matrix', lambda: sim.standardize(table), len(table))
+    picks = [rng.randrange(len(table)) for _ in range(1000)]
+    recorder.stage('similar_queries_k10', lambda: [sim.similar_positions(matrix, position, 10) for position in picks], len(picks))
+    ranking_stats = recorder.stage('ranking_stats', lambda: rk.attribute_stats(index))
+    criteria = [{attribute: (rng.choice([0, 1, 2, 3]), ideal) for attribute, ideal in rk.DEFAULT_IDEALS.items()} for _ in range(1000)]
+    recorder.stage('ranked_queries_top20', lambda: [rk.rank_positions(index, c, r, {'price': (None, 400000)}, 20, ranking_stats)
+                                                    for c, (r, _, _) in zip(criteria, searches)], len(criteria))
+    api_args = [MultiDict({'min_price': str(rng.choice([100000, 200000, 300000])), 'sort': rng.choice(['-population', 'price']),
+                           'limit': '50'}) for _ in range(200)]
+    recorder.stage('api_search_page', lambda: [sa.search_page(index, args) for args in api_args], len(api_args))
+
+    # the search form, through the flask app (with the result cache cold, then warm)
+    import hardikm_final_proj_v1 as proj
+    app = recorder.stage('create_app', lambda: proj.create_app(app_config, ds.Dataset(table, index)))
+    client = app.test_client()
+    forms = [{'price': p, 'Crime Rate': c, 'summer_temp': s, 'winter_temp': w} for p, c, s, w in labels]
+    recorder.stage('handle_search_cold', lambda: [client.post('/handle_search', data=form) for form in forms], len(forms))
+    recorder.stage('handle_search_cached', lambda: [client.post('/handle_search', data=form) for form in forms], len(forms))
+    return problems
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def run(args):
+    '''
+    This function runs the benchmarks and returns the results (see the notes at the top).
+    '''
+    import numpy
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+            'machine': platform.machine(),
+            'cities': args.cities,
+            'zips': args.zips,
+            'memory': not args.no_memory,
+            'startup_budget': args.startup_budget,
+        },
+        'stages': {},
+        'startup_problems': [],
+    }
+    with tempfile.TemporaryDirectory() as work_dir:
+        recorder = Recorder(measure_memory=not args.no_memory, verbose=args.verbose)
+        print('\nzipcodes: ' + str(args.zips))
+        zipcodes = synthetic.make_zipcodes(args.zips, args.seed)
+        zip_index = recorder.stage('zip_index_build', lambda: zi.build_zipcode_index(zipcodes), args.zips)
+        zip_file = os.path.join(work_dir, zi.INDEX_FILE)
+        recorder.stage('zip_index_save', lambda: zip_index.save(zip_file))
+        recorder.stage('zip_index_load', lambda: zi.load_zipcode_index(zip_file))
+
+        # the crime API, with a little latency per request like the real one
+        server, base_url = mca.start_mock_server(latency=args.api_latency)
+        try:
+            client = gcr.CrimeClient(base_url=base_url, api_key='benchmark', cache_dir=None)
+            states = gcr.load_states(os.path.join(REPO_DIR, gcr.STATES_FILE))
+            recorder.stage('crime_fetch', lambda: gcr.get_data(client, states), len(states))
+        finally:
+            server.shutdown()
+        crime_rows = synthetic.make_crime_rows(args.seed)
+        # the web app also needs the snapshot of the real house prices (for the price trends) in its cache folder
+        with contextlib.redirect_stdout(io.StringIO()):
+            pt.load_price_matrix(REPO_DIR, work_dir)
+        results['stages']['zips=' + str(args.zips)] = recorder.results
+
+        for n_cities in args.cities:
+            print('\ncities: ' + str(n_cities))
+            recorder = Recorder(measure_memory=not args.no_memory, verbose=args.verbose)
+            problems = run_size(recorder, n_cities, zip_index, crime_rows, work_dir, args.seed, args.startup_budget)
+            results['startup_problems'] += ['cities=' + str(n_cities) + ': ' + problem for problem in problems]
+            results['stages']['cities=' + str(n_cities)] = recorder.results
+    return results
+
+
+def compare(base, new, threshold=DEFAULT_THRESHOLD):
+    '''
+    This function compares two benchmark results, stage by stage.
+
+    Parameters:
+    base (dict): the results to compare against
+    new (dict): the newer results
+    threshold (float): relative change in time under which a stage counts as unchanged
+
+    Returns:
+    comparison (dict): the change of every stage found in both results, and the lists of slower and faster stages
+    '''
+    comparison = {'base': base['meta'], 'new': new['meta'], 'threshold': threshold, 'stages': {}, 'slower': [], 'faster': []}
+    for group, stages in new['stages'].items():
+        for name, record in stages.items():
+            old = base['stages'].get(group, {}).get(name)
+            if old is None:
+                continue
+            key = group + '/' + name
+            ratio = record['seconds'] / old['seconds'] if old['seconds'] else None
+            entry = {'base_seconds': old['seconds'], 'new_seconds': record['seconds'],
+                     'ratio': None if ratio is None else round(ratio, 4)}
+            if 'peak_mb' in old and 'peak_mb' in record:
+                entry['base_peak_mb'], entry['new_peak_mb'] = old['peak_mb'], record['peak_mb']
+            comparison['stages'][key] = entry
+            if ratio is not None and ratio > 1 + threshold:
+                comparison['slower'].append(key)
+            elif ratio is not None and ratio < 1 - threshold:
+                comparison['faster'].append(key)
+    return comparison
+
+
+def print_comparison(comparison):
+    if comparison['base'].get('memory') != comparison['new'].get('memory'):
+        print('Note: only one of the two runs measured memory, which slows the stages down, so the times are not comparable.\n')
+    for key, entry in comparison['stages'].items():
+        flag = ' slower' if key in comparison['slower'] else ' faster' if key in comparison['faster'] else ''
+        ratio = '-' if entry['ratio'] is None else '%.2fx' % entry['ratio']
+        print(key.ljust(52) + ('%.4f' % entry['base_seconds']).rjust(10) + ('%.4f' % entry['new_seconds']).rjust(10) + ratio.rjust(9) + flag)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the city search pipeline')
+    parser.add_argument('--cities', type=int, nargs='+', default=DEFAULT_CITIES, help='numbers of cities to run with (e.g. 1000 10000 100000 1000000)')
+    parser.add_argument('--zips', type=int, default=DEFAULT_ZIPS, help='number of zipcodes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--api-latency', type=float, default=0.02, help='seconds the mock crime API takes per request')
+    parser.add_argument('--no-memory', action='store_true', help='do not measure the peak memory (faster, more precise times)')
+    parser.add_argument('--verbose', action='store_true', help='show the output of the stages')
+    parser.add_argument('--output', help='write the results (or the comparison) to this json file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='compare two result files instead of running')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--startup-budget', type=float, default=DEFAULT_STARTUP_BUDGET,
+                        help='seconds the web app may take to import and start with the data cached')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0], 'r', encoding='utf-8') as file_obj:
+            base = json.load(file_obj)
+        with open(args.compare[1], 'r', encoding='utf-8') as file_obj:
+            new = json.load(file_obj)
+        results = compare(base, new, args.threshold)
+        print_comparison(results)
+    else:
+        results = run(args)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file_obj:
+            json.dump(results, file_obj, indent=2)
+        print('\nWrote ' + args.output)
+    # a comparison with slower stages exits with an error, so it can fail a CI job
+    if args.compare and results['slower']:
+        sys.exit(1)
+    # and so does a run where the web app started too slowly
+    if not args.compare and results['startup_problems']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import csv
+import os
+import random
+import zlib
+import numpy as np
+import pandas as pd
+
+# Synthetic data for the benchmarks, shaped like the real sources but of any size, and the same for the same seed.
+# Cities and zipcodes are scattered over the continental US, and only use the real state codes from state_list.csv,
+# so that they join with the crime data like the real ones do.
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LAT_RANGE = (25.0, 49.0)
+LONG_RANGE = (-124.0, -67.0)
+
+# size of the grid of made-up weather stations (one station per cell, in degrees)
+STATION_CELL_DEGREES = 0.5
+
+
+def state_codes(states_file=os.path.join(REPO_DIR, 'state_list.csv')):
+    '''
+    This function returns the two letter codes of the states, from the list of states.
+    '''
+    with open(states_file, 'r', encoding='utf-8-sig') as file_obj:
+        return [row[0] for row in csv.reader(file_obj)]
+
+
+def make_zipcodes(n, seed=0):
+    '''
+    This function returns n zipcode dictionaries, with the same keys the Python Zipcodes library uses.
+    '''
+    rng = np.random.default_rng(seed)
+    states = state_codes()
+    lats = rng.uniform(*LAT_RANGE, n)
+    longs = rng.uniform(*LONG_RANGE, n)
+    state_of = rng.integers(0, len(states), n)
+    return [{'zip_code': '%05d' % i, 'lat': '%.4f' % lats[i], 'long': '%.4f' % longs[i],
+             'county': 'County ' + str(i % 3000), 'state': states[state_of[i]]} for i in range(n)]
+
+
+def make_geonames_cities(n, seed=0):
+    '''
+    This function returns n city dictionaries like get_cities_v2.list_cities() makes (name, coordinates, population).
+    '''
+    rng = np.random.default_rng(seed + 1)
+    lats = rng.uniform(*LAT_RANGE, n)
+    longs = rng.uniform(*LONG_RANGE, n)
+    populations = (15000 + rng.pareto(1.2, n) * 20000).astype(np.int64)
+    return [{'name': 'City ' + str(i), 'latitude': float(lats[i]), 'longitude': float(longs[i]),
+             'population': int(populations[i]), 'countrycode': 'US'} for i in range(n)]
+
+
+def make_city_rows(n, seed=0):
+    '''
+    This function returns n rows of the cities cache (every column as a string, like when read from the csv file).
+    '''
+    rng = np.random.default_rng(seed + 2)
+    states = state_codes()
+    rows = []
+    summer = rng.uniform(70, 110, n)
+    winter = rng.uniform(0, 65, n)
+    for i, city in enumerate(make_geonames_cities(n, seed)):
+        rows.append({
+            'name': city['name'], 'latitude': str(city['latitude']), 'longitude': str(city['longitude']),
+            'population': str(city['population']), 'countrycode': 'US',
+            'county': 'County ' + str(i % 3000), 'state': states[i % len(states)], 'example_zipcode': '%05d' % i,
+            'summer_high_temp': str(round(summer[i], 2)), 'winter_low_temp': str(round(winter[i], 2)),
+        })
+    return rows
+
+
+def make_crime_rows(seed=0):
+    '''
+    This function returns rows of the crime cache, one per state.
+    '''
+    rng = random.Random(seed)
+    rows = []
+    with open(os.path.join(REPO_DIR, 'state_list.csv'), 'r', encoding='utf-8-sig') as file_obj:
+        for state, full_name, population in csv.reader(file_obj):
+            rows.append({'state': state, 'full_name': full_name, 'population': population,
+                         'crime rate': str(round(rng.uniform(0.005, 0.04), 4))})
+    return rows
+
+
+def write_house_prices_csv(file_name, city_rows, match_fraction=0.7, first_year=2008, last_year=2023, seed=0):
+    '''
+    This function writes a csv file shaped like Sale_Prices_City.csv, with a price for some of the cities
+    (match_fraction of them) for every month from first_year to last_year.
+
+    Returns:
+    file_name (str): the file written
+    '''
+    rng = np.random.default_rng(seed + 3)
+    months = [str(year) + '-' + '%02d' % month for year in range(first_year, last_year + 1) for month in range(1, 13)]
+    chosen = [row for row in city_rows if rng.random() < match_fraction]
+    with open(file_name, 'w', encoding='utf-8', newline='') as file_obj:
+        writer = csv.writer(file_obj)
+        writer.writerow(['', 'RegionID', 'RegionName', 'StateName', 'SizeRank'] + months)
+        for rank, row in enumerate(chosen):
+            base = rng.uniform(80000, 1500000)
+            growth = np.cumprod(1 + rng.normal(0.003, 0.01, len(months)))
+            prices = ['' if rng.random() < 0.02 else str(int(base * g)) for g in growth]
+            writer.writerow([rank, 100000 + rank, row['name'], row['state'], rank] + prices)
+    return file_name
+
+
+class FixtureWeatherSource:
+    '''
+    This class is an offline stand-in for weather_data.MeteostatSource: stations are the cells of a grid,
+    and their monthly temperatures are made up from the latitude (warmer in the south), the same every time.
+    '''
+    def __init__(self, cell_degrees=STATION_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+
+    def nearby_station(self, lat, long):
+        return str(int(float(lat) // self.cell_degrees)) + '_' + str(int(float(long) // self.cell_degrees))
+
+    def monthly(self, station_id, start, end):
+        lat_cell = int(station_id.split('_')[0])
+        rng = np.random.default_rng(zlib.crc32(station_id.encode('utf-8')))
+        index = pd.date_range(start, end, freq='MS')
+        season = np.cos((index.month.to_numpy() - 7) / 12 * 2 * np.pi)
+        base = 35 - lat_cell * self.cell_degrees * 0.5
+        return pd.DataFrame({'tmax': base + 10 * season + rng.normal(0, 1, len(index)),
+                             'tmin': base - 10 + 10 * season + rng.normal(0, 1, len(index))}, index=index)
@@ -0,0 +1,300 @@
+import multiprocessing
+import os
+import pickle
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import cache_store as cs
+from instrumentation import record_span
+
+# Notes on the approach
+# Building the data is a handful of stages, and most of them do not need each other: the crime data and the
+# house prices do not depend on the cities at all, and the weather of the cities does not depend on their zipcodes.
+# So the build is described as a graph of stages (each one names the stages whose outputs it takes), and every stage
+# starts as soon as the stages it needs are done:
+# - stages that mostly wait on the network or the disk run on a pool of threads
+# - stages that mostly compute in python (e.g. mapping the cities to zipcodes) run on a pool of processes,
+#   so they do not hold the other stages back (a process stage must be a top level function, and its inputs and output
+#   are pickled on the way in and out)
+# - stages that only glue the others together run on the calling thread
+# The output of every stage is checkpointed (pickled in CHECKPOINT_DIR) as soon as it is done, with a key that
+# describes the sources of the build. If the build fails half way (e.g. the crime API is down), the next run with the
+# same key takes the finished stages from their checkpoints and only runs the rest. The checkpoints are removed
+# once the whole build has succeeded.
+# Every stage is timed, and the report gives the critical path: the chain of stages, one waiting on the next,
+# that took the longest, which is how long the build takes however many workers it has.
+
+CHECKPOINT_DIR = 'build_checkpoints'
+
+# how many stages run at once
+DEFAULT_WORKERS = 4
+
+EXECUTORS = ('thread', 'process', 'inline')
+
+
+class Stage:
+    '''
+    This class describes one stage of a build.
+
+    Parameters:
+    name (str): name of the stage (also the name of its span and of its checkpoint)
+    function (function): called with args, then the output of every stage in deps (in that order), and kwargs
+    args (tuple): the first arguments of function
+    kwargs (dict): keyword arguments of function
+    deps (tuple): names of the stages whose outputs the function takes
+    executor (str): 'thread', 'process' or 'inline' (see the notes above)
+    checkpoint (bool): whether the output of the stage is checkpointed
+    '''
+    def __init__(self, name, function, args=(), deps=(), executor='thread', checkpoint=True, kwargs=None):
+        if executor not in EXECUTORS:
+            raise ValueError('unknown executor ' + str(executor))
+        self.name = name
+        self.function = function
+        self.args = tuple(args)
+        self.kwargs = kwargs or {}
+        self.deps = tuple(deps)
+        self.executor = executor
+        self.checkpoint = checkpoint
+
+
+def topological_order(stages):
+    '''
+    This function puts the stages in an order where every stage comes after the stages it needs.
+
+    Parameters:
+    stages (list): list of Stage objects
+
+    Returns:
+    order (list): the same stages, in order
+    '''
+    by_name = {stage.name: stage for stage in stages}
+    order, state = [], {}
+
+    def visit(stage, path):
+        if state.get(stage.name) == 'done':
+            return
+        if state.get(stage.name) == 'visiting':
+            raise ValueError('the stages depend on each other in a cycle: ' + ' -> '.join(path + [stage.name]))
+        state[stage.name] = 'visiting'
+        for dep in stage.deps:
+            if dep not in by_name:
+                raise ValueError('stage ' + stage.name + ' needs the unknown stage ' + dep)
+            visit(by_name[dep], path + [stage.name])
+        state[stage.name] = 'done'
+        order.append(stage)
+
+    for stage in stages:
+        visit(stage, [])
+    return order
+
+
+def critical_path(stages, seconds):
+    '''
+    This function finds the chain of stages that took the longest from the start of the build.
+
+    Parameters:
+    stages (list): list of Stage objects
+    seconds (dict): {stage name: how long it ran}
+
+    Returns:
+    path (list): names of the stages on the critical path, first to last
+    total (float): how long they took together
+    '''
+    finish, previous = {}, {}
+    for stage in topological_order(stages):
+        before = max(stage.deps, key=lambda dep: finish[dep], default=None)
+        finish[stage.name] = seconds.get(stage.name, 0.0) + (finish[before] if before is not None else 0.0)
+        previous[stage.name] = before
+    if not finish:
+        return [], 0.0
+    name = max(finish, key=finish.get)
+    total = finish[name]
+    path = []
+    while name is not None:
+        path.append(name)
+        name = previous[name]
+    return path[::-1], total
+
+
+class BuildPipeline:
+    '''
+    This class runs a graph of stages (see Stage), every stage as soon as the ones it needs are done,
+    and checkpoints their outputs in a folder so that a failed build can resume.
+    '''
+    def __init__(self, stages, checkpoint_dir=None, key='', max_workers=DEFAULT_WORKERS):
+        self.stages = topological_order(stages)
+        self.checkpoint_dir = checkpoint_dir
+        self.key = key
+        self.max_workers = max_workers
+
+    def checkpoint_file(self, stage):
+        return os.path.join(self.checkpoint_dir, stage.name + '.pkl')
+
+    def load_checkpoint(self, stage):
+        '''
+        This function returns (True, output) if the stage has a checkpoint for the same key, or (False, None).
+        '''
+        if self.checkpoint_dir is None or not stage.checkpoint:
+            return False, None
+        try:
+            with open(self.checkpoint_file(stage), 'rb') as file_obj:
+                key, output = pickle.load(file_obj)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+            return False, None
+        if key != self.key:
+            return False, None
+        return True, output
+
+    def write_checkpoint(self, stage, output):
+        if self.checkpoint_dir is None or not stage.checkpoint:
+            return
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        cs.atomic_write(self.checkpoint_file(stage), lambda file_obj: pickle.dump((self.key, output), file_obj, protocol=pickle.HIGHEST_PROTOCOL), mode='wb')
+
+    def clear_checkpoints(self):
+        '''
+        This function removes the checkpoints of every stage.
+        '''
+        if self.checkpoint_dir is None:
+            return
+        for stage in self.stages:
+            try:
+                os.remove(self.checkpoint_file(stage))
+            except FileNotFoundError:
+                pass
+
+    def run(self):
+        '''
+        This function runs every stage, and removes the checkpoints once they have all succeeded.
+        If a stage fails, the stages already running are left to finish (and checkpoint), and the error is raised again.
+
+        Returns:
+        outputs (dict): {stage name: output of the stage}
+        report (dict): how long every stage took, the wall time, and the critical path (see critical_path())
+        '''
+        start = time.perf_counter()
+        outputs, timings, resumed = {}, {}, []
+        pending = []
+        for stage in self.stages:
+            found, output = self.load_checkpoint(stage)
+            if found:
+                outputs[stage.name] = output
+                timings[stage.name] = {'start': 0.0, 'seconds': 0.0, 'executor': 'checkpoint'}
+                resumed.append(stage.name)
+            else:
+                pending.append(stage)
+        if resumed:
+            print('Resuming the build from the checkpoints of: ' + ', '.join(resumed) + '.')
+
+        if self.max_workers > 0:
+            self.run_concurrently(pending, outputs, timings, start)
+        else:
+            # everything on this thread, in order (easier to debug)
+            for stage in pending:
+                try:
+                    output = self.call(stage, outputs, timings, start)
+                except Exception as stage_error:
+                    self.fail(stage, stage_error, timings, start)
+                    raise
+                self.finish(stage, output, outputs, timings, start)
+
+        self.clear_checkpoints()
+        report = self.report(timings, time.perf_counter() - start, resumed)
+        print_report(report)
+        return outputs, report
+
+    def call(self, stage, outputs, timings, start):
+        timings[stage.name] = {'start': time.perf_counter() - start, 'seconds': None, 'executor': stage.executor}
+        return stage.function(*stage.args, *[outputs[dep] for dep in stage.deps], **stage.kwargs)
+
+    def finish(self, stage, output, outputs, timings, start):
+        timing = timings[stage.name]
+        timing['seconds'] = time.perf_counter() - start - timing['start']
+        record_span(stage.name, timing['seconds'], executor=stage.executor)
+        self.write_checkpoint(stage, output)
+        outputs[stage.name] = output
+
+    def fail(self, stage, stage_error, timings, start):
+        print('\nThe build stage ' + stage.name + ' failed: ' + repr(stage_error))
+        record_span(stage.name, time.perf_counter() - start - timings[stage.name]['start'], executor=stage.executor, status='error')
+
+    def run_concurrently(self, pending, outputs, timings, start):
+        threads = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='build')
+        processes = None
+        running = {}
+        error = None
+        try:
+            while pending or running:
+                # start every stage whose inputs are all there (none once a stage has failed)
+                ready = [stage for stage in pending if error is None and all(dep in outputs for dep in stage.deps)]
+                for stage in ready:
+                    if error is not None:
+                        # an inline stage just failed: the rest stay pending, and are never started
+                        break
+                    pending.remove(stage)
+                    if stage.executor == 'inline':
+                        # like a stage on a pool, a failure is recorded, and the stages already running finish first
+                        try:
+                            output = self.call(stage, outputs, timings, start)
+                        except Exception as stage_error:
+                            self.fail(stage, stage_error, timings, start)
+                            error = stage_error
+                            continue
+                        self.finish(stage, output, outputs, timings, start)
+                        continue
+                    if stage.executor == 'process':
+                        if processes is None:
+                            # spawn rather than fork: the web app may already be running threads
+                            processes = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+                        pool = processes
+                    else:
+                        pool = threads
+                    timings[stage.name] = {'start': time.perf_counter() - start, 'seconds': None, 'executor': stage.executor}
+                    running[pool.submit(stage.function, *stage.args, *[outputs[dep] for dep in stage.deps], **stage.kwargs)] = stage
+                if error is None and any(stage.executor == 'inline' for stage in ready):
+                    # an inline stage may have made more stages ready
+                    continue
+                if not running:
+                    if pending and error is None:
+                        raise ValueError('the stages ' + ', '.join(stage.name for stage in pending) + ' can never start')
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    try:
+                        output = future.result()
+                    except Exception as stage_error:
+                        self.fail(stage, stage_error, timings, start)
+                        error = error or stage_error
+                        continue
+                    self.finish(stage, output, outputs, timings, start)
+        finally:
+            threads.shutdown(wait=True)
+            if processes is not None:
+                processes.shutdown(wait=True)
+        if error is not None:
+            raise error
+
+    def report(self, timings, wall_seconds, resumed):
+        seconds = {name: timing['seconds'] for name, timing in timings.items()}
+        path, path_seconds = critical_path(self.stages, seconds)
+        return {
+            'stages': {name: {'start': round(timing['start'], 3), 'seconds': round(timing['seconds'], 3), 'executor': timing['executor']}
+                       for name, timing in timings.items()},
+            'resumed': resumed,
+            'wall_seconds': round(wall_seconds, 3),
+            'stage_seconds': round(sum(seconds.values()), 3),
+            'critical_path': path,
+            'critical_path_seconds': round(path_seconds, 3),
+        }
+
+
+def print_report(report):
+    '''
+    This function prints how long every stage of a build took, and its critical path.
+    '''
+    print('\nBuild stages (start and duration in seconds):')
+    for name, timing in sorted(report['stages'].items(), key=lambda item: item[1]['start']):
+        print('   {:<20} {:>8.3f} {:>8.3f}  {}'.format(name, timing['start'], timing['seconds'], timing['executor']))
+    print('The build took ' + str(report['wall_seconds']) + ' seconds (' + str(report['stage_seconds']) + ' seconds of stages).')
+    print('Critical path: ' + ' -> '.join(report['critical_path']) + ' (' + str(report['critical_path_seconds']) + ' seconds)')
@@ -0,0 +1,180 @@
+import csv
+import hashlib
+import json
+import os
+import tempfile
+
+# Notes on the approach
+# Every cache file (a csv file) has a small json file next to it, with:
+# - the schema version of the cache (bump SCHEMA_VERSION when the columns or their meaning change)
+# - a description of the sources it was built from (hashes of source files, versions of libraries, settings)
+# - the hash of the cache file itself, so a cache file that was cut short or edited is noticed
+# A cache is only used if all three still match. Files are written to a temporary file first and then renamed,
+# so a crash in the middle of a write leaves the old file (or no file) in place, never half a file.
+
+SCHEMA_VERSION = 1
+
+
+def meta_file_name(file_name):
+    '''
+    This function returns the name of the json file that describes a cache file.
+    '''
+    return file_name + '.meta.json'
+
+
+def file_hash(file_name):
+    '''
+    This function returns the sha256 hash of a file.
+    '''
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as file_obj:
+        for chunk in iter(lambda: file_obj.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def package_version(package):
+    '''
+    This function returns the installed version of a python package (without importing it), or 'unknown'.
+    '''
+    from importlib import metadata
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+def recorded_hash(file_name):
+    '''
+    This function returns the hash of a cache file as recorded in its json description when it was written,
+    or None if there is no description.
+    '''
+    try:
+        with open(meta_file_name(file_name), 'r', encoding = 'utf-8') as file_obj:
+            return json.load(file_obj).get('file_hash')
+    except (OSError, ValueError):
+        return None
+
+
+def atomic_write(file_name, write_function, mode='w'):
+    '''
+    This function writes a file through a temporary file in the same folder, which is renamed once it is complete.
+    The temporary file gets a unique name, so several processes writing the same file never write into each other's
+    temporary file (the last rename wins, and every version of the file is complete).
+
+    Parameters:
+    file_name (str): the file to write
+    write_function (function): called with the open file object, writes the content
+    mode (str): 'w' for text, 'wb' for binary
+
+    Returns:
+    None
+    '''
+    folder, base_name = os.path.split(file_name)
+    handle, temp_file_name = tempfile.mkstemp(prefix=base_name + '.', suffix='.tmp', dir=folder or '.')
+    encoding = None if 'b' in mode else 'utf-8'
+    newline = None if 'b' in mode else ''
+    try:
+        with os.fdopen(handle, mode, encoding=encoding, newline=newline) as file_obj:
+            write_function(file_obj)
+            file_obj.flush()
+            os.fsync(file_obj.fileno())
+        # mkstemp makes the file readable by its owner only, the cache files are read like any other file
+        os.chmod(temp_file_name, 0o644)
+        os.replace(temp_file_name, file_name)
+    except Exception:
+        try:
+            os.remove(temp_file_name)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def write_csv_cache(file_name, rows, sources=None, columns=None):
+    '''
+    This function writes a list of dictionaries to a csv cache file, and the json file that describes it.
+
+    Parameters:
+    file_name (str): the cache file
+    rows (list): list of dictionaries, all with the same keys (can be empty)
+    sources (dict): what the cache was built from (see the notes at the top)
+    columns (list): the columns of the cache (the keys of the first row if not given, and none if there are no rows)
+
+    Returns:
+    None
+    '''
+    if columns is None:
+        columns = list(rows[0].keys()) if rows else []
+
+    def write_rows(file_obj):
+        writer = csv.DictWriter(file_obj, fieldnames=columns)
+        writer.writeheader() # first row
+        writer.writerows(rows)
+
+    atomic_write(file_name, write_rows)
+    meta = {'schema_version': SCHEMA_VERSION, 'sources': sources or {}, 'rows': len(rows), 'file_hash': file_hash(file_name)}
+    atomic_write(meta_file_name(file_name), lambda file_obj: json.dump(meta, file_obj, indent=4))
+
+
+def read_csv_cache(file_name, sources=None):
+    '''
+    This function reads a csv cache file, if it exists and is still valid.
+
+    Parameters:
+    file_name (str): the cache file
+    sources (dict): what the cache should have been built from
+
+    Returns:
+    rows (list): list of dictionaries, or None if the cache is missing or no longer valid
+    '''
+    if not os.path.exists(file_name):
+        return None
+    reason = cache_problem(file_name, sources)
+    if reason is not None:
+        print('Ignoring the cache file ' + file_name + ': ' + reason + '.')
+        return None
+    with open(file_name, 'r', encoding = 'utf-8') as file_obj:
+        return list(csv.DictReader(file_obj, delimiter=','))
+
+
+def read_previous_cache(file_name):
+    '''
+    This function reads a csv cache file whatever it was built from, as long as the file itself is complete
+    (e.g. to compare it with newer data).
+
+    Returns:
+    rows (list): list of dictionaries, or None if there is no usable cache file
+    sources (dict): what the cache was built from, or None
+    '''
+    if not os.path.exists(file_name):
+        return None, None
+    try:
+        with open(meta_file_name(file_name), 'r', encoding = 'utf-8') as file_obj:
+            meta = json.load(file_obj)
+    except (OSError, ValueError):
+        return None, None
+    if meta.get('schema_version') != SCHEMA_VERSION or meta.get('file_hash') != file_hash(file_name):
+        return None, None
+    with open(file_name, 'r', encoding = 'utf-8') as file_obj:
+        return list(csv.DictReader(file_obj, delimiter=',')), meta.get('sources', {})
+
+
+def cache_problem(file_name, sources=None):
+    '''
+    This function checks a cache file against its json description.
+
+    Returns:
+    reason (str): why the cache cannot be used, or None if it is valid
+    '''
+    try:
+        with open(meta_file_name(file_name), 'r', encoding = 'utf-8') as file_obj:
+            meta = json.load(file_obj)
+    except (OSError, ValueError):
+        return 'its description is missing or unreadable'
+    if meta.get('schema_version') != SCHEMA_VERSION:
+        return 'it was written with schema version ' + str(meta.get('schema_version'))
+    if meta.get('sources') != (sources or {}):
+        return 'the source data has changed'
+    if meta.get('file_hash') != file_hash(file_name):
+        return 'the file is incomplete or was changed'
+    return None
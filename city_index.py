@@ -0,0 +1,248 @@
+import numpy as np
+
+import geo_index as gi
+
+# Notes on the approach
+# For every numeric attribute we keep the cities sorted by that attribute (an argsort of the values).
+# A range like 'price between 250k and 350k' is then two binary searches (np.searchsorted) in the sorted values,
+# which gives the slice of cities in that range. With several ranges, we start from the smallest slice
+# and only check the other ranges on the cities in it.
+# Searches by distance (near_positions) use a GeoIndex over the coordinates of the cities, built the first time
+# one is made. With other ranges as well, the ranges are applied first: when they leave only a few cities,
+# their distances are all computed directly, otherwise the GeoIndex only looks at the cities they left.
+
+# the attributes that can be searched on, and the CityTable column each one comes from
+ATTRIBUTES = {
+    'price': 'house_price',
+    'crime_rate': 'crime_rate',
+    'summer_high': 'summer_high_temp',
+    'winter_low': 'winter_low_temp',
+    'population': 'population',
+}
+
+# when the ranges of a search by distance leave at most this many cities, their distances are all computed directly
+GEO_SCAN_LIMIT = 2048
+
+
+class CityIndex:
+    '''
+    This class is a multi-attribute range index over the cities in a CityTable.
+    It answers queries with any combination of numeric ranges on the ATTRIBUTES, with optional ordering and top-k.
+    '''
+    def __init__(self, table):
+        self.table = table
+        self.values = {}
+        self.order = {}
+        self.sorted_values = {}
+        for attribute, column in ATTRIBUTES.items():
+            values = table.column(column).astype(np.float64)
+            order = np.argsort(values, kind='stable')
+            self.values[attribute] = values
+            self.order[attribute] = order
+            self.sorted_values[attribute] = values[order]
+        self.geo_index = None
+
+    @classmethod
+    def from_arrays(cls, table, values, order, sorted_values):
+        '''
+        This function rebuilds an index from its arrays (e.g. read from a snapshot file), without sorting anything again.
+
+        Parameters:
+        table (CityTable): the table the index was built over
+        values, order, sorted_values (dict): {attribute: np.ndarray}, as in the attributes of an index
+
+        Returns:
+        index (CityIndex): the index
+        '''
+        index = cls.__new__(cls)
+        index.table = table
+        index.values = values
+        index.order = order
+        index.sorted_values = sorted_values
+        index.geo_index = None
+        return index
+
+    def apply_changes(self, table, position_map, changed):
+        '''
+        This function returns the index of a table made with CityTable.apply_changes() from the table of this index,
+        without sorting everything again: the rows that did not change keep their order, and only the changed rows
+        are sorted and merged in (with binary searches).
+
+        Parameters:
+        table (CityTable): the new table
+        position_map (np.ndarray): new position of every row of the old table (-1 for the deleted ones)
+        changed (np.ndarray): positions in the new table of the changed and the added rows
+
+        Returns:
+        index (CityIndex): the index over the new table
+        '''
+        changed = np.asarray(changed, dtype=np.int64)
+        is_changed = np.zeros(len(table), dtype=bool)
+        is_changed[changed] = True
+        values, order, sorted_values = {}, {}, {}
+        for attribute, column in ATTRIBUTES.items():
+            values[attribute] = table.column(column).astype(np.float64)
+
+            # the rows that are still there and did not change, in the order they already had
+            mapped = position_map[self.order[attribute]]
+            keep = mapped >= 0
+            keep[keep] = ~is_changed[mapped[keep]]
+            base_order = mapped[keep]
+            base_values = self.sorted_values[attribute][keep]
+
+            # merge in the changed rows
+            changed_values = values[attribute][changed]
+            changed_order = np.argsort(changed_values, kind='stable')
+            at = np.searchsorted(base_values, changed_values[changed_order], side='right')
+            order[attribute] = np.insert(base_order, at, changed[changed_order])
+            sorted_values[attribute] = np.insert(base_values, at, changed_values[changed_order])
+        return CityIndex.from_arrays(table, values, order, sorted_values)
+
+    def with_attributes(self, extra):
+        '''
+        This function returns an index over the same table that can also be searched on more attributes
+        (e.g. the price trends of price_trends.py), sharing the arrays of this index for the attributes it already has.
+
+        Parameters:
+        extra (dict): {attribute: np.ndarray of one value per city, in the order of the table (NaN for unknown)}
+
+        Returns:
+        index (CityIndex): the index
+        '''
+        values, order, sorted_values = dict(self.values), dict(self.order), dict(self.sorted_values)
+        for attribute, attribute_values in extra.items():
+            attribute_values = np.asarray(attribute_values, dtype=np.float64)
+            values[attribute] = attribute_values
+            order[attribute] = np.argsort(attribute_values, kind='stable')
+            sorted_values[attribute] = attribute_values[order[attribute]]
+        index = CityIndex.from_arrays(self.table, values, order, sorted_values)
+        index.geo_index = self.geo_index
+        return index
+
+    def __len__(self):
+        return len(self.table)
+
+    def range_positions(self, attribute, low=None, high=None):
+        '''
+        This function returns the positions of the cities with low <= value < high for one attribute.
+
+        Parameters:
+        attribute (str): one of the ATTRIBUTES
+        low (float): lower bound, inclusive (None for no lower bound)
+        high (float): upper bound, exclusive (None for no upper bound)
+
+        Returns:
+        positions (np.ndarray): row positions in the table, in the order of the attribute
+        (never the cities without a value: NaN is in no range)
+        '''
+        sorted_values = self.sorted_values[attribute]
+        start = 0 if low is None else np.searchsorted(sorted_values, low, side='left')
+        # the sort puts the NaN values last, so without an upper bound the slice stops before them
+        end = np.searchsorted(sorted_values, np.inf, side='right') if high is None else np.searchsorted(sorted_values, high, side='left')
+        return self.order[attribute][start:end]
+
+    def query_positions(self, ranges=None, sort_by=None, descending=False, limit=None):
+        '''
+        This function returns the positions of the cities that match all the ranges.
+
+        Parameters:
+        ranges (dict): {attribute: (low, high)}, see range_positions()
+        sort_by (str): attribute to order the results by (optional)
+        descending (bool): order from highest to lowest
+        limit (int): only return this many results (optional)
+
+        Returns:
+        positions (np.ndarray): row positions in the table
+        '''
+        ranges = {attribute: bounds for attribute, bounds in (ranges or {}).items() if bounds is not None}
+        if ranges:
+            # start with the range that matches the fewest cities
+            slices = {attribute: self.range_positions(attribute, *bounds) for attribute, bounds in ranges.items()}
+            first = min(slices, key=lambda attribute: len(slices[attribute]))
+            positions = np.sort(slices[first])
+            for attribute, (low, high) in ranges.items():
+                if attribute == first or len(positions) == 0:
+                    continue
+                values = self.values[attribute][positions]
+                # like range_positions(), a city without a value does not match
+                keep = ~np.isnan(values)
+                if low is not None:
+                    keep &= values >= low
+                if high is not None:
+                    keep &= values < high
+                positions = positions[keep]
+        else:
+            positions = np.arange(len(self.table))
+
+        if sort_by is not None:
+            keys = self.values[sort_by][positions]
+            if descending:
+                keys = -keys
+            if limit is not None and limit < len(positions):
+                # only the top 'limit' results need to be sorted
+                top = np.argpartition(keys, limit - 1)[:limit]
+                positions = positions[top[np.argsort(keys[top], kind='stable')]]
+            else:
+                positions = positions[np.argsort(keys, kind='stable')]
+        if limit is not None:
+            positions = positions[:limit]
+        return positions
+
+    def geo(self):
+        '''
+        This function returns the GeoIndex over the coordinates of the cities, built the first time it is needed.
+        '''
+        if self.geo_index is None:
+            # two requests may build it at the same time, which is harmless: they both build the same index
+            self.geo_index = gi.GeoIndex(self.table.column('latitude'), self.table.column('longitude'))
+        return self.geo_index
+
+    def near_positions(self, lat, long, radius_km=None, k=None, ranges=None):
+        '''
+        This function returns the cities closest to a location that match all the ranges.
+
+        Parameters:
+        lat (float): latitude of the location
+        long (float): longitude of the location
+        radius_km (float): only the cities within this distance, in km (optional)
+        k (int): only the k closest cities (optional)
+        ranges (dict): {attribute: (low, high)}, see range_positions()
+
+        Returns:
+        positions (np.ndarray): row positions in the table, closest first
+        distances_km (np.ndarray): great-circle distance to each city in km
+        '''
+        geo = self.geo()
+        ranges = {attribute: bounds for attribute, bounds in (ranges or {}).items() if bounds is not None}
+        allowed = None
+        if ranges:
+            positions = self.query_positions(ranges)
+            if len(positions) <= GEO_SCAN_LIMIT:
+                query = gi.to_unit_vectors([lat], [long])[0]
+                chords = np.linalg.norm(geo.xyz[positions] - query, axis=1)
+                if radius_km is not None:
+                    keep = chords <= gi.km_to_chord(radius_km)
+                    positions, chords = positions[keep], chords[keep]
+                if k is not None and k < len(positions):
+                    top = np.argpartition(chords, k - 1)[:k] if k > 0 else np.empty(0, dtype=np.int64)
+                    positions, chords = positions[top], chords[top]
+                order = np.argsort(chords, kind='stable')
+                return positions[order], gi.chord_to_km(chords[order])
+            allowed = np.zeros(len(self.table), dtype=bool)
+            allowed[positions] = True
+
+        if radius_km is not None:
+            positions, distances = geo.within(lat, long, radius_km, allowed)
+            if k is not None:
+                positions, distances = positions[:k], distances[:k]
+            return positions, distances
+        return geo.k_nearest(lat, long, len(self.table) if k is None else k, allowed)
+
+    def query(self, ranges=None, sort_by=None, descending=False, limit=None):
+        '''
+        This function returns the cities that match all the ranges (see query_positions()).
+
+        Returns:
+        results (list): list of CityRow views
+        '''
+        return self.table.rows(self.query_positions(ranges, sort_by, descending, limit))
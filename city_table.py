@@ -0,0 +1,216 @@
+import uuid
+import numpy as np
+
+# Notes on the approach
+# Instead of one object per city holding strings straight from the csv files, the cities are stored column by column,
+# in one numpy array per attribute. Numbers are parsed once when the table is built, and then stay numbers.
+# Filtering and sorting work on whole columns at a time. Templates (and anything else that expects City objects)
+# get light-weight CityRow views, which read their values from the table.
+
+# every column of the table and its type
+COLUMNS = {
+    'name': str,
+    'latitude': np.float64,
+    'longitude': np.float64,
+    'population': np.int64,
+    'county': str,
+    'state': str,
+    'example_zipcode': str,
+    'summer_high_temp': np.float64,
+    'winter_low_temp': np.float64,
+    'crime_rate': np.float64,
+    'state_population': np.int64,
+    'house_price': np.int64,
+}
+
+
+def parse_value(value, dtype):
+    '''
+    This function converts one value from the csv files into the type of its column.
+    Missing values become '' for text, NaN for decimal numbers (so they are never mistaken for a real 0,
+    e.g. a winter low of 0 F) and 0 for whole numbers, which have no missing value.
+    '''
+    if dtype is str:
+        return '' if value is None else str(value)
+    if value is None or value == '':
+        return 0 if dtype is np.int64 else np.nan
+    if dtype is np.int64:
+        return int(float(value))
+    return float(value)
+
+
+def plain_value(value):
+    '''
+    This function returns a value of a row as a plain python value, with None for a missing (NaN) number.
+    '''
+    return None if isinstance(value, float) and np.isnan(value) else value
+
+
+class CityTable:
+    '''
+    This class stores a set of cities column by column (one numpy array per attribute, see COLUMNS).
+    '''
+    def __init__(self, columns, version=None):
+        self.columns = columns
+        # a new table gets a new version, so anything cached from an older table is never mistaken for it
+        # (the dataset gives its tables a version derived from their sources, see index_snapshot.table_version(),
+        # and a table read back from a snapshot keeps the version it was written with)
+        self.version = version if version is not None else uuid.uuid4().hex[:12]
+
+    @classmethod
+    def from_records(cls, records, version=None):
+        '''
+        This function builds a table from a list of dictionaries (e.g. rows of a cities cache file).
+
+        Parameters:
+        records (list): list of dictionaries with the COLUMNS as keys
+        version (str): version of the new table (a new random one if None)
+
+        Returns:
+        table (CityTable): the new table
+        '''
+        columns = {}
+        for column, dtype in COLUMNS.items():
+            columns[column] = np.array([parse_value(record.get(column), dtype) for record in records], dtype=dtype)
+        return cls(columns, version)
+
+    @classmethod
+    def from_cities(cls, cities, version=None):
+        '''
+        This function builds a table from a list of City objects (see from_records() for the version).
+        '''
+        return cls.from_records([city.__dict__ for city in cities], version)
+
+    def __len__(self):
+        return len(self.columns['name'])
+
+    def __getitem__(self, position):
+        return CityRow(self, int(position))
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield CityRow(self, position)
+
+    def column(self, column):
+        '''
+        This function returns the numpy array of one column.
+        '''
+        return self.columns[column]
+
+    def rows(self, positions):
+        '''
+        This function returns a list of CityRow views for the given positions.
+        '''
+        return [CityRow(self, int(position)) for position in positions]
+
+    def take(self, positions):
+        '''
+        This function returns a new table with only the rows at the given positions (or where a boolean mask is True).
+        '''
+        return CityTable({column: values[positions] for column, values in self.columns.items()})
+
+    def mask(self, ranges):
+        '''
+        This function returns a boolean mask of the rows with low <= value < high for every (column, (low, high)) in ranges.
+        A bound of None means no bound.
+        '''
+        keep = np.ones(len(self), dtype=bool)
+        for column, (low, high) in ranges.items():
+            values = self.columns[column]
+            if low is not None:
+                keep &= values >= low
+            if high is not None:
+                keep &= values < high
+        return keep
+
+    def filter(self, ranges):
+        '''
+        This function returns a new table with only the rows that match all the ranges (see mask()).
+        '''
+        return self.take(self.mask(ranges))
+
+    def sort_by(self, column, descending=False):
+        '''
+        This function returns a new table sorted by one column.
+        '''
+        order = np.argsort(self.columns[column], kind='stable')
+        if descending:
+            order = order[::-1]
+        return self.take(order)
+
+    def apply_changes(self, deleted=(), updated=None, inserted=(), version=None):
+        '''
+        This function returns a new table with some rows deleted, some rows changed and some rows added.
+        The rows that are kept stay in the same order, and the added rows go at the end.
+
+        Parameters:
+        deleted (list): positions of the rows to delete
+        updated (dict): {position: record} for the rows to change (records are dictionaries with the COLUMNS as keys)
+        inserted (list): records of the rows to add
+        version (str): version of the new table (a new random one if None)
+
+        Returns:
+        table (CityTable): the new table
+        position_map (np.ndarray): new position of every row of this table (-1 for the deleted ones)
+        changed (np.ndarray): positions in the new table of the changed and the added rows
+        '''
+        updated = updated or {}
+        keep = np.ones(len(self), dtype=bool)
+        keep[np.asarray(deleted, dtype=np.int64)] = False
+        position_map = np.full(len(self), -1, dtype=np.int64)
+        position_map[keep] = np.arange(np.count_nonzero(keep))
+
+        update_positions = position_map[np.array(list(updated), dtype=np.int64)]
+        records = list(updated.values()) + list(inserted)
+        columns = {}
+        for column, dtype in COLUMNS.items():
+            new_values = np.array([parse_value(record.get(column), dtype) for record in records], dtype=dtype)
+            # the added rows go at the end (text columns get wider if a new value is longer), then the changed rows are overwritten
+            values = np.concatenate([self.columns[column][keep], new_values[len(updated):]])
+            values[update_positions] = new_values[:len(updated)]
+            columns[column] = values
+
+        changed = np.concatenate([update_positions, np.arange(np.count_nonzero(keep), np.count_nonzero(keep) + len(inserted))])
+        return CityTable(columns, version), position_map, changed
+
+    def to_records(self):
+        '''
+        This function returns the table as a list of dictionaries with plain python values.
+        '''
+        return [row.to_dict() for row in self]
+
+
+class CityRow:
+    '''
+    This class is a read-only view of one row of a CityTable.
+    It has the same attributes as the City class, so it can be used in its place (e.g. in templates).
+    '''
+    __slots__ = ('table', 'position')
+
+    def __init__(self, table, position):
+        self.table = table
+        self.position = position
+
+    def __getattr__(self, column):
+        try:
+            values = self.table.columns[column]
+        except KeyError:
+            raise AttributeError(column) from None
+        value = values[self.position]
+        return str(value) if values.dtype.kind == 'U' else value.item()
+
+    def __eq__(self, other):
+        return isinstance(other, CityRow) and other.table is self.table and other.position == self.position
+
+    def __hash__(self):
+        return hash((id(self.table), self.position))
+
+    def to_dict(self):
+        '''
+        This function returns the row as a dictionary with plain python values (None for a missing number).
+        '''
+        return {column: plain_value(getattr(self, column)) for column in COLUMNS}
+
+    def __str__(self):
+        return("City Name: " + self.name + ", County: " + self.county + ", State: " + self.state + ", Population: " + str(self.population) + ", Summer High Temp: " + str(self.summer_high_temp) + ", Winter Low Temp: " + str(self.winter_low_temp)
+               + ", Crime Rate: " + str(self.crime_rate) + ", State Population: " + str(self.state_population) + ", House Price: " + str(self.house_price))
@@ -0,0 +1,56 @@
+import os
+
+# Settings of the city search tool.
+# Every setting can be overridden with an environment variable of the same name, prefixed with CITY_SEARCH_
+# (e.g. CITY_SEARCH_MIN_POPULATION=50000), or by passing a dictionary to get_config() / create_app().
+
+ENV_PREFIX = 'CITY_SEARCH_'
+
+DEFAULT_CONFIG = {
+    # minimum population of the cities to include
+    'MIN_POPULATION': 15000,
+    # where the cache files are read from and written to
+    'CACHE_DIR': '.',
+    # where the source data files (state_list.csv, Sale_Prices_City.csv) are
+    'DATA_DIR': os.path.dirname(os.path.abspath(__file__)),
+    # cache of the search results: how many are kept in each process, for how many seconds,
+    # and a redis url to share them between the web workers ('' to keep them in each process)
+    'QUERY_CACHE_SIZE': 1024,
+    'QUERY_CACHE_TTL': 600,
+    'QUERY_CACHE_URL': '',
+    # refresh the data from the sources every this many seconds while the web app runs (0 to never refresh)
+    'REFRESH_INTERVAL': 0,
+    # token the /admin endpoints ask for in the X-Admin-Token header ('' to turn the /admin endpoints off)
+    'ADMIN_TOKEN': '',
+    # where to write the timing of every stage and request as json lines (a file, '-' for stderr, '' for nowhere)
+    'SPAN_LOG': '',
+    # folder to write request profiles to ('' to turn profiling off); a request is profiled when it has ?profile=1
+    'PROFILE_DIR': '',
+    # 'cprofile', or 'pyinstrument' (if it is installed)
+    'PROFILER': 'cprofile',
+    # how many stages of the data build run at once (0 to run them one after the other, see build_pipeline.py)
+    'BUILD_WORKERS': 4,
+}
+
+
+def get_config(overrides=None):
+    '''
+    This function returns the settings, starting from DEFAULT_CONFIG,
+    then the environment variables, then the overrides.
+
+    Parameters:
+    overrides (dict): settings that take precedence over everything else (optional)
+
+    Returns:
+    config (dict): the settings
+    '''
+    config = dict(DEFAULT_CONFIG)
+    for key, default in DEFAULT_CONFIG.items():
+        value = os.environ.get(ENV_PREFIX + key)
+        if value is not None:
+            # environment variables are strings, so convert them to the type of the default
+            config[key] = type(default)(value)
+    for key, value in (overrides or {}).items():
+        if value is not None:
+            config[key] = value
+    return config
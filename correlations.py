@@ -0,0 +1,181 @@
+import json
+import threading
+import numpy as np
+
+# Notes on the approach
+# The four correlation plots compare the house price with one other attribute each.
+# All four are computed in one pass over the table: for each plot, the Pearson and Spearman correlations and the
+# regression line come out of a few numpy operations on the cities that have a value for its attribute.
+# The statistics and the figure specs only depend on the table of cities, so they are computed once per
+# table version and kept until the data changes. The statistics are cheap and computed up front; a figure spec
+# holds every city (it is a large json string with many cities), so each one is only made when it is first asked for.
+# While a new version of the data is swapped in, requests that started on the old one still come in, so the
+# store keeps the last two versions: a late request for the old table does not throw away the new one.
+
+# name of each plot: (CityTable column, scale factor, axis title, plot title)
+CORRELATION_PLOTS = {
+    'price_crime': ('crime_rate', 1000, 'Crime Rate (incidents per 1000 people)', 'House Price vs. Crime Rate'),
+    'price_sum_temp': ('summer_high_temp', 1, 'Avg. Summer High Temp. (F)', 'House Price vs. Summer High Temperature'),
+    'price_winter_temp': ('winter_low_temp', 1, 'Avg. Winter Low Temp. (F)', 'House Price vs. Winter Low Temperature'),
+    'price_population': ('population', 1, 'Population', 'House Price vs. Population'),
+}
+
+# how many versions of the table the store keeps
+KEEP_VERSIONS = 2
+
+
+def rank(values):
+    '''
+    This function returns the rank of every value in each column (1 for the smallest), averaging the ranks of ties.
+
+    Parameters:
+    values (np.ndarray): an (n, k) matrix
+
+    Returns:
+    ranks (np.ndarray): an (n, k) matrix of ranks
+    '''
+    ranks = np.empty(values.shape, dtype=np.float64)
+    for column in range(values.shape[1]):
+        _, inverse, counts = np.unique(values[:, column], return_inverse=True, return_counts=True)
+        # tied values share the average of the ranks they would have taken
+        average_rank = np.cumsum(counts) - (counts - 1) / 2
+        ranks[:, column] = average_rank[inverse]
+    return ranks
+
+
+def pearson(x, y):
+    '''
+    This function returns the Pearson correlation between every column of x and the vector y.
+    '''
+    x_centered = x - x.mean(axis=0)
+    y_centered = y - y.mean()
+    denominator = np.sqrt((x_centered ** 2).sum(axis=0) * (y_centered ** 2).sum())
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (x_centered.T @ y_centered) / denominator
+
+
+def linear_fit(x, y):
+    '''
+    This function fits a straight line y = slope * x + intercept for every column of x (least squares).
+
+    Returns:
+    slopes (np.ndarray): the slope for every column
+    intercepts (np.ndarray): the intercept for every column
+    '''
+    x_mean = x.mean(axis=0)
+    x_centered = x - x_mean
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slopes = (x_centered.T @ (y - y.mean())) / (x_centered ** 2).sum(axis=0)
+    return slopes, y.mean() - slopes * x_mean
+
+
+def compute_correlations(table):
+    '''
+    This function computes the statistics of all the correlation plots in one pass.
+    A city without a value for the attribute of a plot (NaN) is left out of that plot.
+
+    Parameters:
+    table (CityTable): the table of cities
+
+    Returns:
+    stats (dict): for every plot name, the pearson and spearman correlations, the regression line and its r squared
+    '''
+    y_all = table.column('house_price').astype(np.float64)
+    stats = {}
+    for name, (column, scale, _, title) in CORRELATION_PLOTS.items():
+        x = table.column(column).astype(np.float64) * scale
+        known = ~np.isnan(x) & ~np.isnan(y_all)
+        x, y = x[known][:, None], y_all[known]
+        pearson_r = pearson(x, y)[0]
+        spearman_r = pearson(rank(x), rank(y[:, None])[:, 0])[0]
+        slopes, intercepts = linear_fit(x, y)
+        stats[name] = {
+            'title': title,
+            'n': int(len(y)),
+            'pearson': round(float(pearson_r), 4),
+            'spearman': round(float(spearman_r), 4),
+            'slope': float(slopes[0]),
+            'intercept': float(intercepts[0]),
+            'r_squared': round(float(pearson_r ** 2), 4),
+        }
+    return stats
+
+
+def scatter_figure(table, name, stats):
+    '''
+    This function returns one correlation plot (with its regression line) as a plain plotly figure dictionary.
+    '''
+    column, scale, x_title, title = CORRELATION_PLOTS[name]
+    x = table.column(column).astype(np.float64) * scale
+    known = ~np.isnan(x)
+    x, y, names = x[known], table.column('house_price')[known], table.column('name')[known]
+    line_x = [float(x.min()), float(x.max())] if len(x) else []
+    line_y = [stats['slope'] * value + stats['intercept'] for value in line_x]
+    return {
+        'data': [
+            {'type': 'scatter', 'mode': 'markers', 'name': 'Cities', 'x': x.tolist(), 'y': y.tolist(),
+             'text': names.tolist()},
+            {'type': 'scatter', 'mode': 'lines', 'name': 'Linear fit', 'x': line_x, 'y': line_y},
+        ],
+        'layout': {
+            'title': {'text': title + ' (Pearson r = ' + str(stats['pearson']) + ', Spearman = ' + str(stats['spearman']) + ')'},
+            'xaxis': {'title': {'text': x_title}},
+            'yaxis': {'title': {'text': 'House Price'}},
+        },
+    }
+
+
+class CorrelationStore:
+    '''
+    This class keeps the statistics and the figure specs of the correlation plots for the last KEEP_VERSIONS versions
+    of the table, and computes them only for a version it does not have.
+    '''
+    def __init__(self):
+        # {table version: {'stats': ..., 'figures': {plot name: figure spec}}}, oldest first
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def entry(self, table):
+        # called with the lock held
+        entry = self.versions.get(table.version)
+        if entry is None:
+            entry = self.versions[table.version] = {'stats': compute_correlations(table), 'figures': {}}
+            while len(self.versions) > KEEP_VERSIONS:
+                del self.versions[next(iter(self.versions))]
+        return entry
+
+    def get(self, table):
+        '''
+        This function returns the statistics of the correlation plots for a table.
+
+        Parameters:
+        table (CityTable): the table of cities
+
+        Returns:
+        stats (dict): see compute_correlations()
+        '''
+        with self.lock:
+            return self.entry(table)['stats']
+
+    def figure(self, table, name):
+        '''
+        This function returns the figure spec (a json string) of one correlation plot for a table.
+
+        Parameters:
+        table (CityTable): the table of cities
+        name (str): name of the plot, see CORRELATION_PLOTS
+
+        Returns:
+        figure (str): the figure spec, or None if there is no plot with that name
+        '''
+        if name not in CORRELATION_PLOTS:
+            return None
+        with self.lock:
+            entry = self.entry(table)
+            figure = entry['figures'].get(name)
+        if figure is None:
+            # made outside the lock (it takes a while), and kept in the entry of its own version
+            figure = json.dumps(scatter_figure(table, name, entry['stats'][name]), separators=(',', ':')).replace('</', '<\\/')
+            with self.lock:
+                entry['figures'][name] = figure
+        return figure
@@ -0,0 +1,520 @@
+import json
+import os
+import threading
+import time
+
+# Import other files
+import get_cities_v2 as gci
+import get_crime_data as gcr
+import get_house_prices as ghp
+import join_data as jd
+import city_table as ct
+import city_index as ci
+import cache_store as cs
+import index_snapshot as snap
+import weather_data as wd
+import build_pipeline as bp
+from instrumentation import span
+
+
+# The cities are cached once, for the lowest minimum population we support (geonamescache only has cities with 15000+ people).
+# Higher minimum populations are a filter on the loaded cities, so changing it never rebuilds the cache.
+LOWEST_MIN_POPULATION = 15000
+
+CITIES_CACHE_FILE = 'cities_cache.csv'
+CRIME_CACHE_FILE = 'crime_cache.csv'
+HOUSE_PRICES_CACHE_FILE = 'house_prices_cache.csv'
+
+# the columns of every cache file (also written when there are no rows)
+CITIES_CACHE_COLUMNS = ['name', 'latitude', 'longitude', 'population', 'countrycode', 'county', 'state', 'example_zipcode',
+                        'summer_high_temp', 'winter_low_temp']
+CRIME_CACHE_COLUMNS = ['state', 'full_name', 'population', 'crime rate']
+HOUSE_PRICES_CACHE_COLUMNS = ['City', 'State', 'Price']
+
+
+# Create a Class City
+class City:
+    '''
+    This class represents a city and will be the unit of analysis for this project.
+    '''
+    def __init__(self):
+        self.name = None
+        self.latitude = None
+        self.longitude = None
+        self.population = None
+        self.county = None
+        self.state = None
+        self.example_zipcode = None
+        self.summer_high_temp = None
+        self.winter_low_temp = None
+        self.crime_rate = None
+        self.state_population = None
+        self.house_price = None
+
+
+    def __str__(self):
+        return("City Name: " + self.name + ", County: " + self.county + ", State: " + self.state + ", Population: " + str(self.population) + ", Summer High Temp: " + str(self.summer_high_temp) + ", Winter Low Temp: " + str(self.winter_low_temp)
+               + ", Crime Rate: " + str(self.crime_rate) + ", State Population: " + str(self.state_population) + ", House Price: " + str(self.house_price))
+
+
+class Dataset:
+    '''
+    This class holds everything the search tool needs once the data is loaded:
+    the table of cities, the search index over it, how the data sources were matched,
+    and how long the build took (see build_pipeline.py; None when the data came from the snapshot).
+    '''
+    def __init__(self, table, index, match_stats=None, build_report=None):
+        self.table = table
+        self.index = index
+        self.match_stats = match_stats or {}
+        self.build_report = build_report
+
+    def __len__(self):
+        return len(self.table)
+
+
+class DatasetHolder:
+    '''
+    This class holds the dataset the web app is serving, and swaps in a newer one when it is ready.
+    A Dataset is never changed once it is built: a request takes the current one (get()) once and uses it to the end,
+    so requests that started before a swap finish on the data they started with.
+    '''
+    def __init__(self, dataset=None, load_seconds=None, prepare=None):
+        self.lock = threading.Lock()
+        # called with every new dataset before it is swapped in (e.g. to compute what the web app derives from it)
+        self.prepare = prepare
+        self.current = None
+        self.loaded_at = None
+        self.load_seconds = None
+        self.previous_version = None
+        self.swaps = 0
+        self.loading = False
+        self.last_error = None
+        if dataset is not None:
+            self.swap(dataset, load_seconds)
+
+    def get(self):
+        '''
+        This function returns the current dataset (reading one attribute, so it is atomic).
+        '''
+        return self.current
+
+    def swap(self, dataset, load_seconds=None):
+        '''
+        This function makes a new dataset the current one.
+        '''
+        with self.lock:
+            if dataset is self.current:
+                return
+            if self.current is not None:
+                self.previous_version = self.current.table.version
+                self.swaps += 1
+            self.loaded_at = time.strftime('%Y-%m-%d %H:%M:%S')
+            self.load_seconds = None if load_seconds is None else round(load_seconds, 3)
+            self.current = dataset
+
+    def reload(self, load_function):
+        '''
+        This function loads a new dataset with load_function (called without arguments), prepares it
+        (see the prepare argument of the constructor) and swaps it in.
+        The current dataset keeps being served while the new one loads.
+        '''
+        start = time.perf_counter()
+        dataset = load_function()
+        if self.prepare is not None:
+            self.prepare(dataset)
+        self.swap(dataset, time.perf_counter() - start)
+        return dataset
+
+    def reload_in_background(self, load_function):
+        '''
+        This function starts reload() on a background thread, unless a reload is already running.
+
+        Returns:
+        started (bool): whether a new reload was started
+        '''
+        with self.lock:
+            if self.loading:
+                return False
+            self.loading = True
+
+        def run():
+            try:
+                self.reload(load_function)
+                self.last_error = None
+            except Exception as error:
+                # the current dataset stays in place
+                self.last_error = repr(error)
+                print('\nLoading the new data failed: ' + self.last_error)
+            finally:
+                with self.lock:
+                    self.loading = False
+
+        threading.Thread(target=run, name='dataset-reload', daemon=True).start()
+        return True
+
+    def info(self):
+        '''
+        This function describes the current dataset and the last reload.
+        '''
+        dataset = self.current
+        with self.lock:
+            return {
+                'version': dataset.table.version if dataset is not None else None,
+                'cities': len(dataset) if dataset is not None else 0,
+                'loaded_at': self.loaded_at,
+                'load_seconds': self.load_seconds,
+                'previous_version': self.previous_version,
+                'swaps': self.swaps,
+                'loading': self.loading,
+                'last_error': self.last_error,
+                'build_seconds': dataset.build_report['wall_seconds'] if dataset is not None and dataset.build_report else None,
+                'build_critical_path': dataset.build_report['critical_path'] if dataset is not None and dataset.build_report else None,
+            }
+
+
+def write_cities_chache(CACHE_FILE_NAME, CITIES_CACHE, sources=None):
+    '''
+    This function takes in a list of city dictionaries and writes them to a csv file.
+
+    Parameters:
+    CACHE_FILE_NAME: string
+        the name of the csv file
+
+    CITIES_CACHE: list
+        a list of city dictionaries
+
+    sources: dict
+        what the data was built from
+    '''
+
+    cs.write_csv_cache(CACHE_FILE_NAME, CITIES_CACHE, sources, CITIES_CACHE_COLUMNS)
+    print('Cities cache file created.')
+
+
+def write_crime_chache(CACHE_FILE_NAME, CRIME_CACHE, sources=None):
+    '''
+    This function takes in a list of dictionaries that contain state-wise crime data and writes them to a csv file.
+
+    Parameters:
+    CACHE_FILE_NAME: string
+        the name of the csv file
+
+    CRIME_CACHE: list
+        a list of dictionaries that contain state-wise crime data
+
+    sources: dict
+        what the data was built from
+
+    Returns:
+    None
+    '''
+
+    cs.write_csv_cache(CACHE_FILE_NAME, CRIME_CACHE, sources, CRIME_CACHE_COLUMNS)
+    print('Crime Data cache file created.')
+
+
+def write_house_prices_chache(CACHE_FILE_NAME, HOUSE_PRICES_CACHE, sources=None):
+    '''
+    This function takes in a list of dictionaries that contain city-wise house price data and writes them to a csv file.
+
+    Parameters:
+    CACHE_FILE_NAME: string
+        the name of the csv file
+
+    HOUSE_PRICES_CACHE: list
+        a list of dictionaries that contain city-wise house price data
+
+    sources: dict
+        what the data was built from
+
+    Returns:
+    None
+
+    '''
+
+    cs.write_csv_cache(CACHE_FILE_NAME, HOUSE_PRICES_CACHE, sources, HOUSE_PRICES_CACHE_COLUMNS)
+    print('House Price cache file created.')
+
+
+def cities_sources():
+    '''
+    This function describes what the cities cache is built from: the libraries and the weather settings.
+    '''
+    return {'geonamescache': cs.package_version('geonamescache'), 'zipcodes': cs.package_version('zipcodes'),
+            'min_population': LOWEST_MIN_POPULATION, 'seasons': json.dumps(wd.SEASONS), 'season_years': json.dumps(wd.SEASON_YEARS)}
+
+
+def crime_sources(data_dir='.'):
+    '''
+    This function describes what the crime cache is built from: the list of states.
+    '''
+    return {'state_list.csv': cs.file_hash(os.path.join(data_dir, jd.STATES_FILE))}
+
+
+def house_prices_sources(data_dir='.'):
+    '''
+    This function describes what the house prices cache is built from: the source csv file and the month.
+    '''
+    source_file = ghp.resolve_source_file(os.path.join(data_dir, ghp.SOURCE_FILE))
+    return {'Sale_Prices_City.csv': cs.file_hash(source_file), 'month': ghp.DEFAULT_MONTH}
+
+
+def dataset_sources(config):
+    '''
+    This function describes what the final table of cities is built from: the sources of every cache,
+    the contents of the cache files (as recorded when they were written), the settings, and the columns.
+    '''
+    cache_dir = config['CACHE_DIR']
+    data_dir = config['DATA_DIR']
+    return {
+        'cities': cities_sources(),
+        'crime': crime_sources(data_dir),
+        'house_prices': house_prices_sources(data_dir),
+        'caches': {file: cs.recorded_hash(os.path.join(cache_dir, file)) for file in (CITIES_CACHE_FILE, CRIME_CACHE_FILE, HOUSE_PRICES_CACHE_FILE)},
+        'min_population': config['MIN_POPULATION'],
+        'columns': list(ct.COLUMNS),
+        'attributes': ci.ATTRIBUTES,
+    }
+
+
+def load_cities_cache(cache_dir='.'):
+    '''
+    This function returns all the cities (as a list of dictionaries) from the cache file,
+    or generates them with the gci module and writes them to the cache file.
+    The cache holds every city over LOWEST_MIN_POPULATION, whatever minimum population is asked for later.
+
+    Parameters:
+    cache_dir (str): folder of the cache files
+
+    Returns:
+    CITIES_CACHE (list): list of dictionaries, one per city
+    '''
+    CACHE_FILE_NAME = os.path.join(cache_dir, CITIES_CACHE_FILE)
+    sources = cities_sources()
+    # if a valid cache file exists, load the data from the file,
+    # or call the function from the gci module to generate the data, and write the data to the cache file
+    CITIES_CACHE = cs.read_csv_cache(CACHE_FILE_NAME, sources)
+    if CITIES_CACHE is not None:
+        print('Loaded ' + str(len(CITIES_CACHE)) + ' cities from cache.')
+    else:
+        print('\nNo cache file found for cities. Generating data from python libraries...')
+        CITIES_CACHE = gci.get_cities(LOWEST_MIN_POPULATION, cache_dir=cache_dir)
+        write_cities_chache(CACHE_FILE_NAME, CITIES_CACHE, sources)
+    return CITIES_CACHE
+
+
+def load_crime_cache(cache_dir='.', data_dir='.'):
+    '''
+    This function returns the state-wise crime data from the cache file, or fetches it from the API and caches it.
+    '''
+    CACHE_FILE_NAME = os.path.join(cache_dir, CRIME_CACHE_FILE)
+    sources = crime_sources(data_dir)
+    CRIME_CACHE = cs.read_csv_cache(CACHE_FILE_NAME, sources)
+    if CRIME_CACHE is not None:
+        print('Loaded all ' + str(len(CRIME_CACHE)) + ' states crime data from cache.')
+    else:
+        print('\nNo cache file found for crime data. Fetching data from API...')
+        CRIME_CACHE = gcr.get_data(gcr.CrimeClient(cache_dir=os.path.join(cache_dir, gcr.CACHE_DIR)), data_dir=data_dir)
+        write_crime_chache(CACHE_FILE_NAME, CRIME_CACHE, sources)
+    return CRIME_CACHE
+
+
+def load_house_prices_cache(cache_dir='.', data_dir='.'):
+    '''
+    This function returns the city-wise house prices from the cache file, or reads them from the source csv file and caches them.
+    '''
+    CACHE_FILE_NAME = os.path.join(cache_dir, HOUSE_PRICES_CACHE_FILE)
+    source_file = ghp.resolve_source_file(os.path.join(data_dir, ghp.SOURCE_FILE))
+    sources = house_prices_sources(data_dir)
+    HOUSE_PRICES_CACHE = cs.read_csv_cache(CACHE_FILE_NAME, sources)
+    if HOUSE_PRICES_CACHE is not None:
+        print('Loaded ' + str(len(HOUSE_PRICES_CACHE)) + ' house prices data from cache.')
+    else:
+        print('\nNo cache file found for house prices data. Fetching data from source CSV file with multi-year data...')
+        HOUSE_PRICES_CACHE = ghp.get_data(source_file=source_file, snapshot_dir=cache_dir)
+        write_house_prices_chache(CACHE_FILE_NAME, HOUSE_PRICES_CACHE, sources)
+    return HOUSE_PRICES_CACHE
+
+
+def filter_by_population(CITIES_CACHE, min_population):
+    '''
+    This function keeps only the cities with a population over min_population.
+    '''
+    return [city for city in CITIES_CACHE if int(float(city['population'])) > min_population]
+
+
+def make_cities(CITIES_CACHE):
+    '''
+    This function creates class 'City' objects from the cities cache (which is a list of dictionaries)
+    '''
+    cities = []
+    for city in CITIES_CACHE:
+        new_city = City()
+        new_city.name = city['name']
+        new_city.latitude = city['latitude']
+        new_city.longitude = city['longitude']
+        new_city.population = city['population']
+        new_city.county = city['county']
+        new_city.state = city['state']
+        new_city.example_zipcode = city['example_zipcode']
+        new_city.summer_high_temp = city['summer_high_temp']
+        new_city.winter_low_temp = city['winter_low_temp']
+        cities.append(new_city)
+    return cities
+
+
+def join_sources(ALL_CITIES, CRIME_CACHE, HOUSE_PRICES_CACHE, config):
+    '''
+    This function joins the cities with the crime data and the house prices, and keeps the cities that have all of them.
+
+    Parameters:
+    ALL_CITIES (list): rows of the cities cache
+    CRIME_CACHE (list): rows of the crime cache
+    HOUSE_PRICES_CACHE (list): rows of the house prices cache
+    config (dict): the settings, see config.get_config()
+
+    Returns:
+    cities (list): list of City objects
+    match_stats (dict): how the data sets were matched, see join_data.enrich_cities()
+    '''
+    # the cache has every city, so apply the minimum population here
+    CITIES_CACHE = filter_by_population(ALL_CITIES, config['MIN_POPULATION'])
+    print('\n' + str(len(CITIES_CACHE)) + ' cities have a population over ' + str(config['MIN_POPULATION']) + '.')
+
+    cities = make_cities(CITIES_CACHE)
+
+    # add crime, state population and house price data to the city objects
+    # the crime data is looked up by state, and the house prices by (city name, state), using dictionaries built once
+    # some city names are spelled differently in the datasets, so names are also matched after normalizing them
+    match_stats = jd.enrich_cities(cities, CRIME_CACHE, HOUSE_PRICES_CACHE, states_file=os.path.join(config['DATA_DIR'], jd.STATES_FILE))
+    jd.print_match_stats(match_stats)
+    print('\nAdded state-wise aggregate crime-rate data and house price data to the cities.')
+
+    # discard the entries without house price data or crime data
+    cities = [city for city in cities if city.house_price != None and city.crime_rate != None]
+    print('\nOnly ' + str(len(cities)) + ' cities have both house price and crime data. Discarding the remaining ' + str(len(CITIES_CACHE) - len(cities)) + ' cities.')
+
+    return cities, match_stats
+
+
+def build_cities_cache(cache_dir, sources, ALL_CITIES, locations, temperatures):
+    '''
+    This function puts together the outputs of the city stages of the build (see build_stages()) and writes the cities cache.
+    '''
+    CITIES_CACHE = gci.merge_location_and_weather(ALL_CITIES, locations, temperatures)
+    write_cities_chache(os.path.join(cache_dir, CITIES_CACHE_FILE), CITIES_CACHE, sources)
+    return CITIES_CACHE
+
+
+def build_table(joined, config):
+    '''
+    This function stores the joined cities column by column (see city_table.py), with all the numbers parsed once.
+    The caches exist by now, so the table gets a version derived from them: every process that builds the table
+    from the same caches gives it the same version (see index_snapshot.table_version()).
+
+    Parameters:
+    joined (tuple): the cities and the match statistics, as returned by join_sources()
+    config (dict): the settings, see config.get_config()
+
+    Returns:
+    table (CityTable): the table of cities
+    '''
+    cities, _ = joined
+    return ct.CityTable.from_cities(cities, snap.table_version(snap.sources_checksum(dataset_sources(config))))
+
+
+def build_index(table):
+    '''
+    This function builds the multi-attribute range index over a table of cities (see city_index.py).
+    '''
+    index = ci.CityIndex(table)
+    print('\nIndexed ' + str(len(index)) + ' cities for searching.')
+    return index
+
+
+def write_dataset_snapshot(snapshot_file, config, joined, table, index):
+    # the caches exist now, so the description of the sources is complete
+    snap.write_snapshot(snapshot_file, table, index, snap.sources_checksum(dataset_sources(config)), joined[1])
+    return None
+
+
+def build_stages(config):
+    '''
+    This function describes the build of the dataset as a graph of stages (see build_pipeline.py):
+
+        geonames -> zip_mapping (in a process) -+
+                 -> weather (threads) ----------+-> cities -+
+        crime --------------------------------------------+-> join -> table_build -> index_build -> snapshot_write
+        house_prices -------------------------------------+
+
+    The cities come straight from their cache when it is valid (one 'cities' stage).
+    The crime data and the house prices have their own caches, which also serve as their checkpoints.
+
+    Parameters:
+    config (dict): the settings, see config.get_config()
+
+    Returns:
+    stages (list): list of build_pipeline.Stage objects
+    '''
+    cache_dir = config['CACHE_DIR']
+    data_dir = config['DATA_DIR']
+    sources = cities_sources()
+    cities_file = os.path.join(cache_dir, CITIES_CACHE_FILE)
+    if os.path.exists(cities_file) and cs.cache_problem(cities_file, sources) is None:
+        stages = [bp.Stage('cities', load_cities_cache, args=(cache_dir,), checkpoint=False)]
+    else:
+        print('\nNo cache file found for cities. Generating data from python libraries...')
+        stages = [
+            bp.Stage('geonames', gci.list_cities, args=(LOWEST_MIN_POPULATION,)),
+            bp.Stage('zip_mapping', gci.map_locations, deps=('geonames',), kwargs={'cache_dir': cache_dir}, executor='process'),
+            bp.Stage('weather', gci.map_weather, deps=('geonames',), kwargs={'cache_dir': cache_dir}),
+            bp.Stage('cities', build_cities_cache, args=(cache_dir, sources), deps=('geonames', 'zip_mapping', 'weather'),
+                     executor='inline', checkpoint=False),
+        ]
+    return stages + [
+        bp.Stage('crime', load_crime_cache, args=(cache_dir, data_dir), checkpoint=False),
+        bp.Stage('house_prices', load_house_prices_cache, args=(cache_dir, data_dir), checkpoint=False),
+        bp.Stage('join', join_sources, deps=('cities', 'crime', 'house_prices'), kwargs={'config': config},
+                 executor='inline', checkpoint=False),
+        # store the final cities column by column, with all the numbers parsed once
+        bp.Stage('table_build', build_table, deps=('join',), kwargs={'config': config}, executor='inline', checkpoint=False),
+        # build the multi-attribute range index over the cities
+        # (the bucket labels of the search form are presets over this index, see search_functions.BUCKET_PRESETS)
+        bp.Stage('index_build', build_index, deps=('table_build',), executor='inline', checkpoint=False),
+        bp.Stage('snapshot_write', write_dataset_snapshot, args=(os.path.join(cache_dir, snap.SNAPSHOT_FILE), config),
+                 deps=('join', 'table_build', 'index_build'), executor='inline', checkpoint=False),
+    ]
+
+
+def load_dataset(config):
+    '''
+    This function gets all the data (from the caches, or from the sources), joins it,
+    and returns the table of cities with its search index.
+    The sources are loaded concurrently (see build_stages()).
+
+    Parameters:
+    config (dict): the settings, see config.get_config()
+
+    Returns:
+    dataset (Dataset): the loaded data
+    '''
+    cache_dir = config['CACHE_DIR']
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # the table and the index are saved once they are built, and opened straight from that snapshot
+    # as long as nothing they were built from has changed
+    snapshot_file = os.path.join(cache_dir, snap.SNAPSHOT_FILE)
+    with span('snapshot_load'):
+        table, index, header = snap.load_snapshot(snapshot_file, snap.sources_checksum(dataset_sources(config)))
+    if table is not None:
+        print('Loaded ' + str(len(table)) + ' cities and their search index from the snapshot written ' + header['created'] + '.')
+        return Dataset(table, index, header['match_stats'])
+
+    # the checkpoints of a failed build are only used again if the city sources are the same
+    # (the zip mapping and the weather are the stages worth resuming)
+    pipeline = bp.BuildPipeline(build_stages(config), os.path.join(cache_dir, bp.CHECKPOINT_DIR),
+                                key=snap.sources_checksum(cities_sources()), max_workers=config['BUILD_WORKERS'])
+    outputs, report = pipeline.run()
+    _, match_stats = outputs['join']
+    return Dataset(outputs['table_build'], outputs['index_build'], match_stats, report)
@@ -0,0 +1,265 @@
+import numpy as np
+
+# Notes on the approach
+# Points are stored as unit vectors on the sphere (x, y, z), so the straight-line (chord) distance between two
+# points always grows with the great-circle distance between them. The 3D space is cut into cubic cells and every
+# point is filed under the id of the cell it falls in. A query only has to look at the cells around it, ring by ring,
+# instead of scanning every point.
+# Radius queries look at the cube of cells that can hold points within the radius, and k-nearest queries grow the
+# search ring by ring until the k-th closest point found so far is closer than anything in the next ring could be.
+# Both can be limited to a subset of the points (a boolean mask), so that they compose with other filters.
+
+EARTH_RADIUS_KM = 6371.0088
+
+# ~0.005 chord units is about 32 km on the surface of the earth
+DEFAULT_CELL_SIZE = 0.005
+
+# how many rings of cells to search around a query before falling back to a full scan
+DEFAULT_MAX_RINGS = 8
+
+# radius queries wider than this many cells scan every point instead (a vectorized scan is faster by then)
+MAX_RADIUS_RINGS = 12
+
+
+def to_unit_vectors(lats, longs):
+    '''
+    This function converts latitudes and longitudes (in degrees) into unit vectors on the sphere.
+
+    Parameters:
+    lats (array-like): latitudes in degrees
+    longs (array-like): longitudes in degrees
+
+    Returns:
+    xyz (np.ndarray): an (n, 3) array of unit vectors
+    '''
+    lat_rad = np.radians(np.asarray(lats, dtype=np.float64))
+    long_rad = np.radians(np.asarray(longs, dtype=np.float64))
+    cos_lat = np.cos(lat_rad)
+    return np.column_stack((cos_lat * np.cos(long_rad), cos_lat * np.sin(long_rad), np.sin(lat_rad)))
+
+
+def chord_to_km(chord):
+    '''
+    This function converts a chord length on the unit sphere into a great-circle distance in km.
+    '''
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+
+def km_to_chord(km):
+    '''
+    This function converts a great-circle distance in km into a chord length on the unit sphere.
+    '''
+    return 2 * np.sin(np.minimum(np.asarray(km, dtype=np.float64) / (2 * EARTH_RADIUS_KM), np.pi / 2))
+
+
+class GeoIndex:
+    '''
+    This class is a grid-bucket spatial index over a fixed set of latitude / longitude points.
+    It answers nearest neighbour queries without scanning every point.
+    '''
+    def __init__(self, lats, longs, cell_size=DEFAULT_CELL_SIZE):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.longs = np.asarray(longs, dtype=np.float64)
+        self.cell_size = float(cell_size)
+        self.xyz = to_unit_vectors(self.lats, self.longs)
+
+        # number of cells along each axis, with one spare cell of padding on each side
+        self._cells_per_axis = int(np.ceil(2 / self.cell_size)) + 3
+
+        # sort the points by cell id, and remember where each cell starts and how many points it holds
+        point_cells = self._cell_ids(self._cell_coords(self.xyz))
+        self.order = np.argsort(point_cells, kind='stable')
+        self.cell_keys, self.cell_starts, self.cell_counts = np.unique(point_cells[self.order], return_index=True, return_counts=True)
+
+    def __len__(self):
+        return len(self.lats)
+
+    def to_arrays(self):
+        '''
+        This function returns everything needed to rebuild the index as a dictionary of numpy arrays,
+        so that it can be written to disk with np.savez.
+        '''
+        return {'lats': self.lats, 'longs': self.longs, 'xyz': self.xyz, 'cell_size': np.array(self.cell_size),
+                'order': self.order, 'cell_keys': self.cell_keys, 'cell_starts': self.cell_starts, 'cell_counts': self.cell_counts}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        '''
+        This function recreates an index from the output of to_arrays() without sorting the points again.
+        '''
+        index = cls.__new__(cls)
+        index.lats = arrays['lats']
+        index.longs = arrays['longs']
+        index.xyz = arrays['xyz']
+        index.cell_size = float(arrays['cell_size'])
+        index._cells_per_axis = int(np.ceil(2 / index.cell_size)) + 3
+        index.order = arrays['order']
+        index.cell_keys = arrays['cell_keys']
+        index.cell_starts = arrays['cell_starts']
+        index.cell_counts = arrays['cell_counts']
+        return index
+
+    def _cell_coords(self, xyz):
+        return np.floor((xyz + 1) / self.cell_size).astype(np.int64) + 1
+
+    def _cell_ids(self, coords):
+        n = self._cells_per_axis
+        return (coords[..., 0] * n + coords[..., 1]) * n + coords[..., 2]
+
+    def _ring_offsets(self, ring):
+        # all the cell offsets that are exactly 'ring' cells away (Chebyshev distance) from the centre cell
+        steps = np.arange(-ring, ring + 1)
+        offsets = np.stack(np.meshgrid(steps, steps, steps, indexing='ij'), axis=-1).reshape(-1, 3)
+        return offsets[np.abs(offsets).max(axis=1) == ring]
+
+    def _cube_offsets(self, rings):
+        # all the cell offsets at most 'rings' cells away from the centre cell
+        steps = np.arange(-rings, rings + 1)
+        return np.stack(np.meshgrid(steps, steps, steps, indexing='ij'), axis=-1).reshape(-1, 3)
+
+    def _points_in_cells(self, cell_ids):
+        # look up the given cell ids and return the (original) indices of every point inside them
+        pos = np.searchsorted(self.cell_keys, cell_ids)
+        in_range = pos < len(self.cell_keys)
+        pos, cell_ids = pos[in_range], cell_ids[in_range]
+        pos = pos[self.cell_keys[pos] == cell_ids]
+        if len(pos) == 0:
+            return np.empty(0, dtype=np.int64)
+        starts = self.cell_starts[pos]
+        counts = self.cell_counts[pos]
+        # expand (start, count) pairs into one flat array of positions in the sorted order
+        flat = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return self.order[flat]
+
+    def nearest(self, lat, long, max_rings=DEFAULT_MAX_RINGS):
+        '''
+        This function finds the point closest to a given latitude and longitude.
+
+        Parameters:
+        lat (float): latitude of the query location
+        long (float): longitude of the query location
+        max_rings (int): stop searching after this many rings of cells and scan every point instead
+
+        Returns:
+        index (int): position of the closest point in the arrays the index was built from
+        distance_km (float): great-circle distance to that point in km
+        '''
+        if len(self) == 0:
+            return None, None
+        query = to_unit_vectors([lat], [long])[0]
+        centre = self._cell_coords(query)
+
+        best_index, best_chord = None, np.inf
+        ring = 0
+        while ring <= max_rings:
+            candidates = self._points_in_cells(self._cell_ids(centre + self._ring_offsets(ring)))
+            if len(candidates):
+                chords = np.linalg.norm(self.xyz[candidates] - query, axis=1)
+                pick = np.argmin(chords)
+                if chords[pick] < best_chord:
+                    best_index, best_chord = int(candidates[pick]), chords[pick]
+            # every point in ring + 1 or further is at least ring * cell_size away
+            if best_chord <= ring * self.cell_size:
+                break
+            ring += 1
+        else:
+            # nothing close by: fall back to a single vectorized scan over all the points
+            chords = np.linalg.norm(self.xyz - query, axis=1)
+            best_index = int(np.argmin(chords))
+            best_chord = chords[best_index]
+
+        return best_index, float(chord_to_km(best_chord))
+
+    def nearest_many(self, lats, longs, max_rings=DEFAULT_MAX_RINGS):
+        '''
+        This function finds the closest point for every location in a batch.
+
+        Parameters:
+        lats (array-like): latitudes of the query locations
+        longs (array-like): longitudes of the query locations
+        max_rings (int): see nearest()
+
+        Returns:
+        indices (np.ndarray): position of the closest point for each query (-1 if the index has no points)
+        distances_km (np.ndarray): great-circle distance to that point in km (inf if the index has no points)
+        '''
+        if len(self) == 0:
+            return np.full(len(lats), -1, dtype=np.int64), np.full(len(lats), np.inf, dtype=np.float64)
+        indices = np.empty(len(lats), dtype=np.int64)
+        distances = np.empty(len(lats), dtype=np.float64)
+        for i, (lat, long) in enumerate(zip(lats, longs)):
+            indices[i], distances[i] = self.nearest(float(lat), float(long), max_rings=max_rings)
+        return indices, distances
+
+    def within(self, lat, long, radius_km, allowed=None):
+        '''
+        This function finds every point within a distance of a given latitude and longitude.
+
+        Parameters:
+        lat (float): latitude of the query location
+        long (float): longitude of the query location
+        radius_km (float): the distance, in km
+        allowed (np.ndarray): boolean mask over the points, only the ones set to True are returned (optional)
+
+        Returns:
+        indices (np.ndarray): positions of the points, closest first
+        distances_km (np.ndarray): great-circle distance to each of them in km
+        '''
+        query = to_unit_vectors([lat], [long])[0]
+        radius_chord = float(km_to_chord(radius_km))
+        rings = int(np.ceil(radius_chord / self.cell_size))
+        if rings > MAX_RADIUS_RINGS:
+            candidates = np.arange(len(self)) if allowed is None else np.flatnonzero(allowed)
+        else:
+            candidates = self._points_in_cells(self._cell_ids(self._cell_coords(query) + self._cube_offsets(rings)))
+            if allowed is not None:
+                candidates = candidates[allowed[candidates]]
+        chords = np.linalg.norm(self.xyz[candidates] - query, axis=1)
+        keep = chords <= radius_chord
+        candidates, chords = candidates[keep], chords[keep]
+        order = np.argsort(chords, kind='stable')
+        return candidates[order], chord_to_km(chords[order])
+
+    def k_nearest(self, lat, long, k, allowed=None, max_rings=DEFAULT_MAX_RINGS):
+        '''
+        This function finds the k points closest to a given latitude and longitude.
+
+        Parameters:
+        lat (float): latitude of the query location
+        long (float): longitude of the query location
+        k (int): how many points to find
+        allowed (np.ndarray): boolean mask over the points, only the ones set to True are returned (optional)
+        max_rings (int): stop searching after this many rings of cells and scan every (allowed) point instead
+
+        Returns:
+        indices (np.ndarray): positions of the points, closest first
+        distances_km (np.ndarray): great-circle distance to each of them in km
+        '''
+        if k <= 0 or len(self) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        query = to_unit_vectors([lat], [long])[0]
+        centre = self._cell_coords(query)
+        found, found_chords = [], []
+        count = 0
+        for ring in range(max_rings + 1):
+            candidates = self._points_in_cells(self._cell_ids(centre + self._ring_offsets(ring)))
+            if allowed is not None:
+                candidates = candidates[allowed[candidates]]
+            if len(candidates):
+                found.append(candidates)
+                found_chords.append(np.linalg.norm(self.xyz[candidates] - query, axis=1))
+                count += len(candidates)
+            # every point in ring + 1 or further is at least ring * cell_size away
+            if count >= k and np.partition(np.concatenate(found_chords), k - 1)[k - 1] <= ring * self.cell_size:
+                candidates, chords = np.concatenate(found), np.concatenate(found_chords)
+                break
+        else:
+            # not enough close by: fall back to a single vectorized scan over all the (allowed) points
+            candidates = np.arange(len(self)) if allowed is None else np.flatnonzero(allowed)
+            chords = np.linalg.norm(self.xyz[candidates] - query, axis=1)
+
+        if k < len(candidates):
+            top = np.argpartition(chords, k - 1)[:k]
+            candidates, chords = candidates[top], chords[top]
+        order = np.argsort(chords, kind='stable')
+        return candidates[order], chord_to_km(chords[order])
@@ -1,30 +1,45 @@
-import zipcodes as zip
+import os
 from pprint import pprint
 import csv
-import geonamescache
 import numpy as np
-import meteostat
 from datetime import datetime
 
+import zipcode_index as zi
+import weather_data as wd
+from instrumentation import span
 
-def get_cities(min_population):
+
+def get_cities(min_population, weather_source=None, weather_workers=wd.DEFAULT_WORKERS, cache_dir='.'):
     '''
     This function returns a list of dictionaries, where each dictionary is a city
     It used multiple python libraries to get the data.
     1. geonamescache: to get the list of all cities in the world
     2. Python Zipcodes: to get the county and state of each city
-    3. Meteostat: to get the weather data for each city
+    3. Meteostat: to get the weather data for each city (see weather_data.py)
 
     Parameters:
     min_population (int): minimum population of the city to be included in the list
+    weather_source (MeteostatSource): where to get the weather data from (defaults to the Meteostat library)
+    weather_workers (int): maximum number of concurrent weather requests
+    cache_dir (str): folder for the zipcode index and the weather cache
 
     Returns:
     cities_list (list): list of dictionaries, where each dictionary is a city with its attributes
     '''
+    cities_list = list_cities(min_population)
+    return add_location_and_weather(cities_list, weather_source, weather_workers, cache_dir)
+
 
-    # get all cities globally from this database
-    gc = geonamescache.GeonamesCache()
-    cities_global = gc.get_cities()
+def list_cities(min_population):
+    '''
+    This function returns the cities in the US with a population over min_population, from the geonamescache library
+    (name, coordinates and population only).
+    '''
+    # get all cities globally from this database (only imported here: it is only needed when the cities are not cached)
+    with span('geonames_load'):
+        import geonamescache
+        gc = geonamescache.GeonamesCache()
+        cities_global = gc.get_cities()
     print('\nDownloaded info on ' + str(len(cities_global.keys())) + ' cities from geonamescache library.')
 
     # get all cities in the US with population over the stated minimum
@@ -40,16 +55,72 @@ def get_cities(min_population):
             cities_list.append(city_dict)
 
     print('\nWe have now shortlisted ' + str(len(cities_list)) + ' cities in the US with population over ' + str(min_population) + '.')
+    return cities_list
+
+
+def add_location_and_weather(cities_list, weather_source=None, weather_workers=wd.DEFAULT_WORKERS, cache_dir='.'):
+    '''
+    This function adds the county, state, example zipcode and seasonal temperatures to a list of cities (see list_cities()),
+    and discards the cities without weather data.
+
+    Parameters:
+    cities_list (list): list of city dictionaries with name, latitude, longitude and population
+    weather_source (MeteostatSource): where to get the weather data from (defaults to the Meteostat library)
+    weather_workers (int): maximum number of concurrent weather requests
+    cache_dir (str): folder for the zipcode index and the weather cache
+
+    Returns:
+    cities_list (list): the cities that have weather data, with their new attributes
+    '''
+    if not cities_list:
+        return []
+    locations = map_locations(cities_list, cache_dir)
+    temperatures = map_weather(cities_list, weather_source, weather_workers, cache_dir)
+    return merge_location_and_weather(cities_list, locations, temperatures)
+
+
+def map_locations(cities_list, cache_dir='.'):
+    '''
+    This function finds the county, state and example zipcode of every city, from the closest zipcode.
+    It does not change the cities, so it can run in another process (see build_pipeline.py).
+
+    Parameters:
+    cities_list (list): list of city dictionaries with latitude and longitude
+    cache_dir (str): folder for the zipcode index
 
-    # Download all the zipcodes in the US using the Python Zipcodes library
-    zipcodes_list = zip.filter_by(country="US")
+    Returns:
+    locations (list): a (county, state, zipcode) tuple for every city, or None where no zipcode was found
+    '''
+    if not cities_list:
+        return []
+
+    # Load the prebuilt spatial index over all the zipcodes in the US (or build it once from the Python Zipcodes library)
     print('\nAdding county and state to each city object from the Python Zipcodes library...')
-    print('Downloaded info on all ' + str(len(zipcodes_list)) + ' zipcodes in the US.')
+    with span('zip_mapping', cities=len(cities_list)):
+        zip_index = zi.get_zipcode_index(file_name=os.path.join(cache_dir, zi.INDEX_FILE))
+        print('Indexed all ' + str(len(zip_index)) + ' zipcodes in the US.')
 
-    # get the county and state of each city using the closest latitude and longitude
-    for city in cities_list:
-        city['county'], city['state'], city['example_zipcode'] = get_close_lat_long(zipcodes_list, city['latitude'], city['longitude'])
-    print('\nSuccessfully added county and state to each city object using closest coordinate mapping.')
+        # get the county and state of each city using the closest latitude and longitude, for all cities in one batch
+        matches = zip_index.lookup_many([city['latitude'] for city in cities_list], [city['longitude'] for city in cities_list])
+    return [tuple(match) if match is not None else None for match in matches]
+
+
+def map_weather(cities_list, weather_source=None, weather_workers=wd.DEFAULT_WORKERS, cache_dir='.'):
+    '''
+    This function finds the summer high and winter low temperatures of every city, from its closest weather station.
+    It does not change the cities, and does not need their zipcodes.
+
+    Parameters:
+    cities_list (list): list of city dictionaries with latitude and longitude
+    weather_source (MeteostatSource): where to get the weather data from (defaults to the Meteostat library)
+    weather_workers (int): maximum number of concurrent weather requests
+    cache_dir (str): folder for the weather cache
+
+    Returns:
+    temperatures (list): a (summer high, winter low) tuple for every city, with None where there is no data
+    '''
+    if not cities_list:
+        return []
 
     # WEATHER DATA
     '''
@@ -66,21 +137,43 @@ def get_cities(min_population):
     end_weather_data = datetime.strptime('12/31/22', '%m/%d/%y')
 
 
-    progress_counter = 0
-    data_not_found = 0
+    # get the weather data for each city, from its closest weather station, on a pool of worker threads
+    # (stations are fetched only once each, and cached locally for later runs)
     print('\nGetting weather data for each city from the Python Meteostat Library...')
-    for city in cities_list:
-        # get the weather data for each city, from a weather station within a 10 mile radius of the given latitude and longitude
-        loc = meteostat.Point(float(city['latitude']), float(city['longitude']), 10)
-        data_m = meteostat.Monthly(loc, start_weather_data, end_weather_data).fetch()
+    with span('weather_fetch', cities=len(cities_list)):
+        city_stations, station_data = wd.fetch_weather(cities_list, start_weather_data, end_weather_data,
+                                                       source=weather_source, max_workers=weather_workers,
+                                                       cache_dir=os.path.join(cache_dir, wd.CACHE_DIR))
+
+    # calculate the summer high temperature and winter low temperature for every station in one pass
+    with span('weather_params', stations=len(station_data)):
+        weather_params = wd.seasonal_params(wd.to_long_format(station_data))
+
+    temperatures = []
+    for station_id in city_stations:
+        summer_high, winter_low = None, None
+        if station_id in weather_params.index:
+            summer_high, winter_low = weather_params.loc[station_id, ['summer_high_temp', 'winter_low_temp']]
+            summer_high = None if np.isnan(summer_high) else float(summer_high)
+            winter_low = None if np.isnan(winter_low) else float(winter_low)
+        temperatures.append((summer_high, winter_low))
+    return temperatures
+
+
+def merge_location_and_weather(cities_list, locations, temperatures):
+    '''
+    This function adds the results of map_locations() and map_weather() to the cities, and discards the cities without weather data.
 
-        # calculate the summer high temperature and winter low temperature for each city 
-        city['summer_high_temp'], city['winter_low_temp'] = calc_weather_params(data_m)
+    Returns:
+    cities_list (list): the cities that have weather data, with their new attributes
+    '''
+    for city, location in zip(cities_list, locations):
+        city['county'], city['state'], city['example_zipcode'] = location if location is not None else (None, None, None)
+    print('\nSuccessfully added county and state to each city object using closest coordinate mapping.')
 
-        # show progress in steps of ~25%
-        progress_counter += 1
-        if abs((progress_counter*100/len(cities_list))%25 - 25) <0.8:
-            print('   ...' + str(round(progress_counter/len(cities_list),2) * 100) + '% done')
+    data_not_found = 0
+    for city, (summer_high, winter_low) in zip(cities_list, temperatures):
+        city['summer_high_temp'], city['winter_low_temp'] = summer_high, winter_low
 
         # if weather data is not found for a city, keep track of it
         if city['summer_high_temp'] == None or city['winter_low_temp'] == None:
@@ -98,8 +191,12 @@ def get_close_lat_long(zipcodes_list, lat, long):
     '''
     This function takes in a latitude and longitude and returns the closest zipcode to it, 
     along with the county and state of that zipcode.
+    The lookup goes through the spatial index in zipcode_index, which is built from zipcodes_list
+    only once, as long as the same list is passed.
 
     Parameters:
+    zipcodes_list: list
+        the list of zipcode dictionaries from the Python Zipcodes library
     lat: float 
         the latitude of the location
     long: float 
@@ -113,16 +210,14 @@ def get_close_lat_long(zipcodes_list, lat, long):
     zipcode: string
         the zipcode of the closest zipcode
     '''
-    for zipcode in zipcodes_list:
-        if abs(float(zipcode['lat']) - float(lat)) < 0.1 and abs(float(zipcode['long']) - float(long)) < 0.1:
-            return zipcode['county'], zipcode['state'], zipcode['zip_code']
-    return None
+    return zi.get_zipcode_index(zipcodes_list).lookup(lat, long)
 
 
 def calc_weather_params(data_m):
     '''
     This function takes in a dataframe of weather data and calculates the average high temperature for the month 
     of July and August, and the average low temperature for the month of December and January.
+    Months are picked by their date (see weather_data.seasonal_params), so missing months do not shift the others.
 
     Parameters:
     data_m: dataframe from meteostat library
@@ -134,26 +229,12 @@ def calc_weather_params(data_m):
         the average low temperature for the month of December and January
 
     '''
-    try:
-        # calculate the average high temperature for the month of July and August. 
-        # Using numpy.nanmean to ignore the NaN values, as many of the cities do not have data for all the months, 
-        # or, in some cases, none of the months
-        avg_high_temp = np.nanmean([data_m.iloc[6, 2], data_m.iloc[7, 2], data_m.iloc[18, 2], data_m.iloc[19, 2], data_m.iloc[30, 2], data_m.iloc[31, 2], data_m.iloc[42, 2], data_m.iloc[43, 2]])
-    except:
-        avg_high_temp = None
-    try:
-        avg_low_temp = np.nanmean([data_m.iloc[11, 1], data_m.iloc[12, 1], data_m.iloc[23, 1], data_m.iloc[24, 1], data_m.iloc[35, 1], data_m.iloc[36, 1], data_m.iloc[47, 1], data_m.iloc[48, 1]])
-    except:
-        avg_low_temp = None
-    # convert to fahrenheit
-    try:
-        avg_high_temp = round((avg_high_temp * 9/5) + 32, 2)
-    except:
-        avg_high_temp = None
-    try:
-        avg_low_temp = round((avg_low_temp * 9/5) + 32, 2)
-    except:
-        avg_low_temp = None
+    params = wd.seasonal_params(wd.to_long_format({'station': data_m}))
+    if params.empty:
+        return None, None
+    avg_high_temp, avg_low_temp = params.iloc[0][['summer_high_temp', 'winter_low_temp']]
+    avg_high_temp = None if np.isnan(avg_high_temp) else float(avg_high_temp)
+    avg_low_temp = None if np.isnan(avg_low_temp) else float(avg_low_temp)
     return avg_high_temp, avg_low_temp
 
 
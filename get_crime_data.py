@@ -1,95 +1,276 @@
-import requests
 import json
+import os
+import random
+import threading
+import time
 from pprint import pprint
 import csv
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# Note on data sources. 
-# There are API's with population at the county or fips_code level. 
-# For instance, I could have used the census API and aggregated the data at the state level. 
+import cache_store as cs
+from instrumentation import span
+
+# Note on data sources.
+# There are API's with population at the county or fips_code level.
+# For instance, I could have used the census API and aggregated the data at the state level.
 # I chose to use a self-made csv file for the sake of simplicity.
 
-# get the list of states and their population from a csv file
-STATES_LIST = []
-with open('state_list.csv', 'r', encoding = 'utf-8-sig') as file_obj:
-    reader = csv.reader(file_obj)  # alternatively, we can use DictReader
-    for row in reader:
-        new_dict = {}
-        new_dict['state'] = row[0]
-        new_dict['full_name'] = row[1]
-        new_dict['population'] = row[2]
-        STATES_LIST.append(new_dict)
+# the list of states and their population, in the data folder
+STATES_FILE = 'state_list.csv'
+
+
+def load_states(file_name=STATES_FILE):
+    '''
+    This function reads the list of states and their population from a csv file.
+
+    Parameters:
+    file_name (str): the csv file with the list of states
+
+    Returns:
+    states_list (list): a dictionary with 'state', 'full_name' and 'population' for every state
+    '''
+    states_list = []
+    with open(file_name, 'r', encoding = 'utf-8-sig') as file_obj:
+        reader = csv.reader(file_obj)  # alternatively, we can use DictReader
+        for row in reader:
+            new_dict = {}
+            new_dict['state'] = row[0]
+            new_dict['full_name'] = row[1]
+            new_dict['population'] = row[2]
+            states_list.append(new_dict)
+    return states_list
+
+
+# pprint(load_states())
+
+# api documentation: https://cde.ucr.cjis.gov/LATEST/webapp/#/pages/docApi
+BASE_URL = 'https://api.usa.gov/crime/fbi/cde'
+API_KEY_FILE = 'crime_api_key.txt'
+
+# taking a 3 year average
+FROM_YEAR = 2019
+TO_YEAR = 2022
+
+# responses of the API are cached per state in this folder, and reused for this many seconds
+CACHE_DIR = 'crime_api_cache'
+CACHE_TTL = 7 * 24 * 60 * 60
 
+# how many states are fetched at the same time, and how often a failed call is tried again
+DEFAULT_WORKERS = 8
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 0.5
+TIMEOUT_SECONDS = 30
 
-# pprint(STATES_LIST)
+# status codes that are worth trying again: rate limited, or a problem on the server side
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
 
-def construct_url(state):
+_API_KEY = None
+
+
+def read_api_key(file_name=API_KEY_FILE):
+    '''
+    This function returns the API key, from the CRIME_API_KEY environment variable or from the key file.
+    The key is only read once per process.
+    '''
+    global _API_KEY
+    if _API_KEY is None:
+        _API_KEY = os.environ.get('CRIME_API_KEY')
+        if _API_KEY is None:
+            with open(file_name, 'r') as f:
+                _API_KEY = f.read().strip()
+    return _API_KEY
+
+
+def construct_url(state, base_url=BASE_URL, api_key=None):
     '''
     This function constructs the url for the crime API.
 
     Parameters:
     state (str): state for which the crime data is needed
+    base_url (str): root of the API (e.g. a local mock server for testing)
+    api_key (str): the API key (read from the key file if not given)
 
     Returns:
     url (str): url for the API call
     params (dict): parameters for the API call
-    
+
     '''
-    # api documentation: https://cde.ucr.cjis.gov/LATEST/webapp/#/pages/docApi
-    # sample api = https://api.usa.gov/crime/fbi/cde/arrest/state/CA/all?from=2020&to=2022&API_KEY=WfbWxVqRDseuwGbOzoIMhNQyVKBWy01Fc7yoiay9
-    baseurl = 'https://api.usa.gov/crime/fbi/cde'
+    # sample api = https://api.usa.gov/crime/fbi/cde/arrest/state/CA/all?from=2020&to=2022&API_KEY=...
     endpoint = '/arrest/state'
-    with open('crime_api_key.txt', 'r') as f:
-        api_key = f.read()
+    if api_key is None:
+        api_key = read_api_key()
     state_param = '/' + str(state)
     crime_type_param = '/all'
     # taking a 3 year average
-    params = {'api_key': api_key, 'from': 2019, 'to': 2022}
-    url = baseurl + endpoint + state_param + crime_type_param
+    params = {'api_key': api_key, 'from': FROM_YEAR, 'to': TO_YEAR}
+    url = base_url + endpoint + state_param + crime_type_param
     return url, params
 
-def get_data():
+
+class CrimeClient:
+    '''
+    This class downloads the crime data of many states from the crime API.
+    It keeps one pooled HTTP session, fetches several states at once, tries again (with exponential backoff)
+    when the API is rate limited or fails, and caches every state's response on disk.
+    '''
+    def __init__(self, base_url=BASE_URL, api_key=None, max_workers=DEFAULT_WORKERS, max_retries=MAX_RETRIES,
+                 backoff=BACKOFF_SECONDS, timeout=TIMEOUT_SECONDS, cache_dir=CACHE_DIR, cache_ttl=CACHE_TTL):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.cache_dir = cache_dir
+        self.cache_ttl = cache_ttl
+
+        # the HTTP session is only made on the first cache miss (see open_session)
+        self.requests = None
+        self.session = None
+        self.session_lock = threading.Lock()
+
+    def open_session(self):
+        '''
+        This function returns the HTTP session of the client: one connection pool, big enough for all the worker threads.
+        The requests library is only imported here, so that nothing is imported for it when every state is cached.
+        '''
+        with self.session_lock:
+            if self.session is None:
+                import requests
+                self.requests = requests
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.session = session
+            return self.session
+
+    def cache_file_name(self, state):
+        return os.path.join(self.cache_dir, f'{state}_{FROM_YEAR}_{TO_YEAR}.json')
+
+    def read_cache(self, state):
+        '''
+        This function returns the cached response for a state, or None if there is none or it is too old.
+        '''
+        if self.cache_dir is None or not os.path.exists(self.cache_file_name(state)):
+            return None
+        file_name = self.cache_file_name(state)
+        if time.time() - os.path.getmtime(file_name) > self.cache_ttl:
+            return None
+        with open(file_name, 'r', encoding = 'utf-8') as file_obj:
+            return json.load(file_obj)
+
+    def write_cache(self, state, data):
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cs.atomic_write(self.cache_file_name(state), lambda file_obj: json.dump(data, file_obj))
+
+    def fetch_state(self, state):
+        '''
+        This function returns the yearly crime data of one state, from the cache or from the API.
+
+        Parameters:
+        state (str): two letter code of the state
+
+        Returns:
+        data (list): list of dictionaries, one per year, with the number of arrests per crime type
+        '''
+        data = self.read_cache(state)
+        if data is not None:
+            return data
+
+        session = self.open_session()
+        url, params = construct_url(state, self.base_url, self.api_key)
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                response = session.get(url, params=params, timeout=self.timeout)
+            except (self.requests.ConnectionError, self.requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                    response.raise_for_status()
+                    data = response.json()['data']
+                    self.write_cache(state, data)
+                    return data
+                retry_after = response.headers.get('Retry-After')
+            # wait before trying again: as long as the API asks for, or twice as long as last time (plus some jitter)
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else self.backoff * 2 ** attempt
+            time.sleep(delay + random.uniform(0, self.backoff))
+
+    def fetch_all(self, states):
+        '''
+        This function returns the crime data of many states, fetched on a pool of worker threads.
+
+        Parameters:
+        states (list): two letter codes of the states
+
+        Returns:
+        results (dict): {state: data}, see fetch_state()
+        '''
+        results = {}
+        progress_counter = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self.fetch_state, state): state for state in states}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+
+                # print progress every 20%
+                progress_counter += 1
+                if abs((progress_counter*100/len(states))%20 == 0):
+                    print('   ...' + str(round(progress_counter/len(states),2) * 100) + '% done')
+        return results
+
+
+def calc_crime_rate(data, population):
+    '''
+    This function calculates the yearly crime rate of a state from its crime data.
+
+    Parameters:
+    data (list): yearly crime data of the state, see CrimeClient.fetch_state()
+    population (str): population of the state
+
+    Returns:
+    crime_rate (float): average number of arrests per person per year
+    '''
+    total_crime = 0
+    for crime_dict in data:
+        for k, v in crime_dict.items():
+            if k != 'data_year':
+                total_crime += v
+
+    crime_rate = total_crime / int(population)
+
+    # taking a 3 year average
+    return round(crime_rate/3, 4)
+
+
+def get_data(client=None, states_list=None, data_dir='.'):
     '''
     This function gets the crime data for each state and calculates the crime rate for each state.
-    
+
     Parameters:
-    None
+    client (CrimeClient): the client to download the data with (optional)
+    states_list (list): the states, see load_states() (read from the data folder if not given)
+    data_dir (str): the folder of state_list.csv
 
     Returns:
-    STATES_LIST (list): list of dictionaries with crime data for each state
-    
+    states_list (list): list of dictionaries with crime data for each state
+
     '''
-    
-    progress_counter = 0
+    if client is None:
+        client = CrimeClient()
+    if states_list is None:
+        states_list = load_states(os.path.join(data_dir, STATES_FILE))
+
     print('Downloading crime data for all states...')
-    for state in STATES_LIST:
-        # call the API
-        url, params = construct_url(state['state'])
-        data = requests.get(url, params=params).json()['data']
-        # pprint(data, depth=2)
-
-        # process the data
-        total_crime = 0
-        for crime_dict in data:
-            for k, v in crime_dict.items():
-                if k != 'data_year':
-                    total_crime += v
-        # print(total_crime)
-    
-        crime_rate = total_crime / int(state['population'])
-    
-        # taking a 3 year average
-        crime_rate = round(crime_rate/3, 4)
-        # print(str(crime_rate*100)+'%')
-
-        # add the crime data to the dictionary
-        state['crime rate'] = crime_rate
-
-        # print progress every 20%
-        progress_counter += 1
-        if abs((progress_counter*100/len(STATES_LIST))%20 == 0):
-            print('   ...' + str(round(progress_counter/len(STATES_LIST),2) * 100) + '% done')
-
-    return STATES_LIST
+    with span('crime_fetch', states=len(states_list)):
+        results = client.fetch_all([state['state'] for state in states_list])
+
+    # add the crime data to a copy of every state's dictionary, so the list passed in is left as it was
+    return [dict(state, **{'crime rate': calc_crime_rate(results[state['state']], state['population'])}) for state in states_list]
 
 
 '''
@@ -101,4 +282,4 @@ def main():
 
 if __name__ == '__main__':
     main()
-'''
\ No newline at end of file
+'''
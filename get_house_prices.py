@@ -1,5 +1,11 @@
 import csv
+import json
+import os
 from pprint import pprint
+from statistics import median
+
+import cache_store as cs
+from instrumentation import span
 
 # Notes on data sources
 # I explored Zillow's API, but it requires a paid subscription.
@@ -7,31 +13,259 @@ from pprint import pprint
 # https://www.kaggle.com/datasets/paultimothymooney/zillow-house-price-data
 
 
-SOURCE_FILE = 'Sale_Prices_city.csv'
-def get_data():
+SOURCE_FILE = 'Sale_Prices_City.csv'
+
+# the month used for the house price of each city, unless asked otherwise
+DEFAULT_MONTH = '2019-08'
+
+# pass this as the month to use the most recent month that has a price, for each city
+LATEST = 'latest'
+
+# binary snapshot of the full price matrix (cities x months), and the row / column labels that go with it,
+# named after the csv file they are written from (see snapshot_files())
+SNAPSHOT_SUFFIX = '.prices.npy'
+SNAPSHOT_META_SUFFIX = '.prices.meta.json'
+
+
+def resolve_source_file(file_name=SOURCE_FILE):
     '''
-    This function returns a list of dictionaries
+    This function returns the path of the source csv file.
+    If the exact name does not exist, a file in the same folder whose name only differs in case is used instead
+    (the data has been shipped both as Sale_Prices_City.csv and Sale_Prices_city.csv).
+
+    Parameters:
+    file_name (str): expected path of the csv file
 
     Returns:
-    house_prices_trimmed (list): list of dictionaries, where each dictionary is a city with house price info
+    path (str): path of the csv file that exists on disk
+    '''
+    if os.path.exists(file_name):
+        return file_name
+    folder, base_name = os.path.split(file_name)
+    for candidate in os.listdir(folder or '.'):
+        if candidate.lower() == base_name.lower():
+            return os.path.join(folder, candidate)
+    raise FileNotFoundError('Could not find the house prices file ' + file_name)
+
+
+def get_months(source_file=SOURCE_FILE):
+    '''
+    This function returns the list of month columns (e.g. '2008-03') in the source csv file, oldest first.
+    '''
+    with open(resolve_source_file(source_file), 'r', encoding = 'utf-8') as file_obj:
+        header = next(csv.reader(file_obj))
+    return [column for column in header if is_month(column)]
+
+
+def is_month(column):
+    '''
+    This function returns True if a column name looks like a month, like '2019-08'.
+    '''
+    return len(column) == 7 and column[4] == '-' and column[:4].isdigit() and column[5:].isdigit()
+
+
+def select_months(months, month=DEFAULT_MONTH, window=1):
+    '''
+    This function returns the month columns to read: the given month and the (window - 1) months before it.
+
+    Parameters:
+    months (list): all the month columns in the file, oldest first
+    month (str): last month of the window, or LATEST for the last month in the file
+    window (int): number of months to include (12 for a trailing-12-month median)
+
+    Returns:
+    selected (list): the selected month columns, oldest first
     '''
-    house_prices = []
+    end = len(months) if month == LATEST else months.index(month) + 1
+    return months[max(end - window, 0):end]
+
+
+def iter_prices(month=DEFAULT_MONTH, window=1, source_file=SOURCE_FILE):
+    '''
+    This function reads the source csv file one row at a time and yields the house price of each city.
+    Only the city, state and selected month columns are picked out of each row, and no row is kept in memory.
+
+    When window is 1 the price is the value for that month (with month=LATEST, the most recent month that has a value).
+    When window is more than 1 the price is the median of the non-empty values in the window.
+    Cities without any price in the selected months are skipped.
+
+    Parameters:
+    month (str): month to use ('2019-08'), or LATEST
+    window (int): number of months (ending at month) to take the median over
+    source_file (str): path to the csv file
+
+    Yields:
+    row (dict): a dictionary with the City, State and Price of one city
+    '''
+    with open(resolve_source_file(source_file), 'r', encoding = 'utf-8') as file_obj:
+        reader = csv.reader(file_obj, delimiter=',')
+        header = next(reader)
+        months = [column for column in header if is_month(column)]
+        city_col = header.index('RegionName')
+        state_col = header.index('StateName')
+        if month == LATEST and window == 1:
+            # look at every month, and keep the last one with a value
+            price_cols = [header.index(m) for m in months]
+        else:
+            price_cols = [header.index(m) for m in select_months(months, month, window)]
 
-    # read the csv file
-    with open(SOURCE_FILE, 'r', encoding = 'utf-8') as file_obj:
-        reader = csv.DictReader(file_obj, delimiter=',')
         for row in reader:
-            house_prices.append(row)
-    
-    # retain data only from 3 columns - RegionName, StateName, 2019-08 (price)
-    house_prices_trimmed = []
-    for row in house_prices:
-        house_prices_trimmed.append({
-            'City': row['RegionName'],
-            'State': row['StateName'],
-            'Price': row['2019-08']          
-        })
+            values = [row[col] for col in price_cols if row[col] != '']
+            if not values:
+                continue
+            if window == 1:
+                price = values[-1]
+            else:
+                price = str(int(round(median([float(v) for v in values]))))
+            yield {'City': row[city_col], 'State': row[state_col], 'Price': price}
+
+
+def snapshot_files(source_file=SOURCE_FILE, snapshot_dir=None):
+    '''
+    This function returns the paths of the binary snapshot of a source csv file and of its json file,
+    which are named after the csv file, so that a snapshot is never read for another csv file.
+
+    Parameters:
+    source_file (str): path to the csv file
+    snapshot_dir (str): folder of the snapshot (by default, the folder of the csv file)
+
+    Returns:
+    snapshot_file (str): path of the .npy file
+    meta_file (str): path of the json file
+    '''
+    folder, base_name = os.path.split(source_file)
+    name = os.path.join(folder if snapshot_dir is None else snapshot_dir, os.path.splitext(base_name)[0])
+    return name + SNAPSHOT_SUFFIX, name + SNAPSHOT_META_SUFFIX
 
+
+def write_price_snapshot(source_file=SOURCE_FILE, snapshot_file=None, meta_file=None):
+    '''
+    This function writes the full price matrix (cities x months, NaN where there is no price) to a .npy file,
+    and the city names, states, months and the hash of the csv file to a small json file next to it.
+    The .npy file can later be memory-mapped by load_price_snapshot(), without parsing the csv again.
+    Both files are written atomically, the json file last, so a snapshot cut short is never taken as up to date.
+
+    Parameters:
+    source_file (str): path to the csv file
+    snapshot_file (str): path of the .npy file to write (by default, see snapshot_files())
+    meta_file (str): path of the json file to write (by default, see snapshot_files())
+
+    Returns:
+    None
+    '''
+    import numpy as np
+
+    default_snapshot_file, default_meta_file = snapshot_files(source_file)
+    snapshot_file = snapshot_file or default_snapshot_file
+    meta_file = meta_file or default_meta_file
+    source_file = resolve_source_file(source_file)
+    cities, states, rows = [], [], []
+    with open(source_file, 'r', encoding = 'utf-8') as file_obj:
+        reader = csv.reader(file_obj, delimiter=',')
+        header = next(reader)
+        months = [column for column in header if is_month(column)]
+        month_cols = [header.index(m) for m in months]
+        city_col = header.index('RegionName')
+        state_col = header.index('StateName')
+        for row in reader:
+            cities.append(row[city_col])
+            states.append(row[state_col])
+            rows.append([float(row[col]) if row[col] != '' else np.nan for col in month_cols])
+
+    prices = np.array(rows, dtype=np.float64).reshape(len(rows), len(months))
+    meta = {'City': cities, 'State': states, 'months': months, 'source_hash': cs.file_hash(source_file)}
+    cs.atomic_write(snapshot_file, lambda file_obj: np.save(file_obj, prices), mode='wb')
+    cs.atomic_write(meta_file, lambda file_obj: json.dump(meta, file_obj))
+    print('House price snapshot written for ' + str(len(cities)) + ' cities and ' + str(len(months)) + ' months.')
+
+
+def load_price_snapshot(snapshot_file=None, meta_file=None, mmap=True):
+    '''
+    This function loads the price matrix written by write_price_snapshot().
+
+    Parameters:
+    snapshot_file (str): path of the .npy file (by default, the one of SOURCE_FILE)
+    meta_file (str): path of the json file (by default, the one of SOURCE_FILE)
+    mmap (bool): memory-map the matrix instead of reading it all into memory
+
+    Returns:
+    prices (np.ndarray): cities x months matrix of prices, NaN where there is no price
+    meta (dict): the 'City', 'State' and 'months' lists that label the rows and columns
+    '''
+    import numpy as np
+
+    default_snapshot_file, default_meta_file = snapshot_files()
+    prices = np.load(snapshot_file or default_snapshot_file, mmap_mode='r' if mmap else None)
+    with open(meta_file or default_meta_file, 'r', encoding = 'utf-8') as file_obj:
+        meta = json.load(file_obj)
+    return prices, meta
+
+
+def snapshot_is_fresh(source_file=SOURCE_FILE, snapshot_file=None, meta_file=None):
+    '''
+    This function returns True if a snapshot exists and was written from the current content of the source csv file
+    (the hash of the csv file is recorded in the json file of the snapshot).
+    '''
+    default_snapshot_file, default_meta_file = snapshot_files(source_file)
+    snapshot_file = snapshot_file or default_snapshot_file
+    meta_file = meta_file or default_meta_file
+    if not os.path.exists(snapshot_file):
+        return False
+    try:
+        with open(meta_file, 'r', encoding = 'utf-8') as file_obj:
+            recorded = json.load(file_obj).get('source_hash')
+    except (OSError, ValueError):
+        return False
+    return recorded == cs.file_hash(resolve_source_file(source_file))
+
+
+def iter_prices_from_snapshot(month=DEFAULT_MONTH, window=1, snapshot_file=None, meta_file=None):
+    '''
+    This function does the same as iter_prices(), but reads from the binary snapshot instead of the csv file.
+    '''
+    import numpy as np
+
+    prices, meta = load_price_snapshot(snapshot_file, meta_file)
+    months = meta['months']
+    if month == LATEST and window == 1:
+        # position of the last month with a value, in every row
+        has_value = ~np.isnan(prices)
+        last = prices.shape[1] - 1 - np.argmax(has_value[:, ::-1], axis=1)
+        values = np.where(has_value.any(axis=1), prices[np.arange(len(prices)), last], np.nan)
+    else:
+        start = months.index(select_months(months, month, window)[0])
+        end = start + len(select_months(months, month, window))
+        window_prices = np.asarray(prices[:, start:end])
+        values = np.full(len(prices), np.nan)
+        has_value = ~np.isnan(window_prices).all(axis=1)
+        values[has_value] = np.nanmedian(window_prices[has_value], axis=1)
+
+    for city, state, value in zip(meta['City'], meta['State'], values):
+        if not np.isnan(value):
+            yield {'City': city, 'State': state, 'Price': str(int(round(value)))}
+
+
+def get_data(month=DEFAULT_MONTH, window=1, source_file=SOURCE_FILE, snapshot_dir=None):
+    '''
+    This function returns a list of dictionaries
+
+    Parameters:
+    month (str): month to use ('2019-08'), or LATEST (see iter_prices)
+    window (int): number of months (ending at month) to take the median over
+    source_file (str): path to the csv file
+    snapshot_dir (str): folder of the binary snapshot of the csv file, if there is one (see snapshot_files())
+
+    Returns:
+    house_prices_trimmed (list): list of dictionaries, where each dictionary is a city with house price info
+    '''
+    # retain data only from 3 columns - RegionName, StateName, and the price
+    # (from the binary snapshot if there is an up to date one, as that skips parsing the csv file altogether)
+    with span('house_prices_load', month=month, window=window):
+        snapshot_file, meta_file = snapshot_files(source_file, snapshot_dir)
+        if snapshot_is_fresh(source_file, snapshot_file, meta_file):
+            house_prices_trimmed = list(iter_prices_from_snapshot(month, window, snapshot_file, meta_file))
+        else:
+            house_prices_trimmed = list(iter_prices(month, window, source_file))
     return house_prices_trimmed
 
 '''
@@ -42,4 +276,4 @@ def main():
 
 if __name__ == '__main__':
     main()
-'''
\ No newline at end of file
+'''
@@ -1,17 +1,28 @@
-from flask import Flask, render_template, request
-import plotly.graph_objects as go 
-import plotly.express as px
-import zipcodes as zip
+from flask import Flask, Response, abort, g, jsonify, render_template, request
 from pprint import pprint
+import argparse
 import csv
-import geonamescache
-import numpy as np
+import hmac
+import json
+import os
+import threading
+import time
 
 # Import other files
-import get_cities_v2 as gci
-import get_crime_data as gcr
-import get_house_prices as ghp
+import config as cfg
+import dataset as ds
 import search_functions as sf
+import city_table as ct
+import plot_service as ps
+import correlations as cor
+import similarity as sim
+import ranking as rk
+import price_trends as pt
+import city_index as ci
+import search_api as sa
+import query_cache as qc
+import refresh as rf
+import instrumentation as ins
 
 
 '''TO DO
@@ -28,64 +39,24 @@ REPORT (look at the rubric): 1.5 to 2 hours
 '''
 
 
-def get_bar_plot(search_results):
+def get_bar_plot(search_results, plot_service):
     '''
-    This function takes in a list of City objects and returns a bar plot of the house prices of the cities.
+    This function takes in a list of cities and returns a bar plot of the house prices of the cities.
 
     Parameters:
     search_results: list
-        a list of City objects
-    
+        a list of CityRow views (or City objects)
+    plot_service: PlotService
+        the cache of rendered figures
+
     Returns:
-    div: string
-        the html code for the bar plot
-    
+    spec: string
+        the figure as json, to be drawn with plotly.js on the page
+
     '''
-    x_values = [x.name for x in search_results]
-    y_values = [int(y.house_price) for y in search_results]
-    bars = go.Bar(x=x_values, y=y_values, orientation='v')
-
-    layout = go.Layout(
-    title='House Price by City',
-    xaxis=dict(title='City', autorange=True),
-    yaxis=dict(title='House Prices', autorange=True)
-    )
     # sort the graph by house price, highest to lowest
-    fig = go.Figure(data=bars, layout=layout)
-    div = fig.to_html(full_html=False)
-    return div
-
-
+    return plot_service.get(('bar',) + ps.result_key(search_results), lambda: ps.bar_plot_figure(search_results))
 
-# The dictionary that represents the search tree (not binary, it has many branches at each node)
-SEARCH_TREE = {}
-# I am aware using a global variable is not a good practice, 
-# but I am using it here because I need to access this variable in multiple functions.
-# I could not solve for scope issues when I tried to pass this variable as an argument to the functions.
-
-# Create a Class City
-class City:
-    '''
-    This class represents a city and will be the unit of analysis for this project.
-    '''
-    def __init__(self):
-        self.name = None
-        self.latitude = None
-        self.longitude = None
-        self.population = None
-        self.county = None
-        self.state = None
-        self.example_zipcode = None
-        self.summer_high_temp = None
-        self.winter_low_temp = None
-        self.crime_rate = None
-        self.state_population = None
-        self.house_price = None
-        
-
-    def __str__(self):
-        return("City Name: " + self.name + ", County: " + self.county + ", State: " + self.state + ", Population: " + str(self.population) + ", Summer High Temp: " + str(self.summer_high_temp) + ", Winter Low Temp: " + str(self.winter_low_temp)
-               + ", Crime Rate: " + str(self.crime_rate) + ", State Population: " + str(self.state_population) + ", House Price: " + str(self.house_price))
 
 def is_yes(usr_input):
     '''
@@ -108,265 +79,128 @@ def is_yes(usr_input):
         return False
 
 
-def write_cities_chache(CACHE_FILE_NAME, CITIES_CACHE):
-    '''
-    This function takes in a list of City objects and writes them to a csv file.
-
-    Parameters:
-    CACHE_FILE_NAME: string
-        the name of the csv file
-    
-    CITIES_CACHE: list
-        a list of City objects
-    '''
-
-    with open(CACHE_FILE_NAME, 'w', encoding = 'utf-8', newline='') as file_obj:
-        writer = csv.DictWriter(file_obj, fieldnames=CITIES_CACHE[0].keys())
-        writer.writeheader() # first row
-        writer.writerows(CITIES_CACHE)
-
-        # writer = csv.writer(file_obj)
-        # writer.writerow(CITIES_CACHE[0].__dict__.keys())
-        # for row in CITIES_CACHE:
-        #     row_dict = row.__dict__
-        #     writer.writerow(row_dict.values())
-    print('Cities cache file created.')
-
 
-def write_crime_chache(CACHE_FILE_NAME, CRIME_CACHE):
+def build_correlation_plots(table):
     '''
-    This function takes in a list of dictionaries that contain state-wise crime data and writes them to a csv file.
+    This function builds the four correlation scatter plots between house prices and the other attributes.
 
     Parameters:
-    CACHE_FILE_NAME: string
-        the name of the csv file
-
-    CRIME_CACHE: list
-        a list of dictionaries that contain state-wise crime data
+    table: CityTable
+        the table of cities
 
     Returns:
-    None
+    plots: dict
+        the plotly figures, keyed by a short name
     '''
+    # plotly.express takes a long time to import, and only the interactive program uses it
+    import plotly.express as px
 
-    with open(CACHE_FILE_NAME, 'w', encoding = 'utf-8', newline='') as file_obj:
-        writer = csv.DictWriter(file_obj, fieldnames=CRIME_CACHE[0].keys())
-        writer.writeheader() # first row
-        writer.writerows(CRIME_CACHE)
-    print('Crime Data cache file created.')
+    plots = {}
+    y_values = table.column('house_price')
 
+    # plot correlation between house prices and crime rate
+    x_values = table.column('crime_rate')*1000
+    plots['price_crime'] = px.scatter(x=x_values, y=y_values, title='House Price vs. Crime Rate')
 
-def write_house_prices_chache(CACHE_FILE_NAME, HOUSE_PRICES_CACHE):
-    '''
-    This function takes in a list of dictionaries that contain city-wise house price data and writes them to a csv file.
+    # plot correlation between house prices and weather
+    x_values = table.column('summer_high_temp')
+    plots['price_sum_temp'] = px.scatter(x=x_values, y=y_values, title='House Price vs. Summer High Temperature')
 
-    Parameters:
-    CACHE_FILE_NAME: string
-        the name of the csv file
+    # plot correlation between house prices and weather
+    x_values = table.column('winter_low_temp')
+    plots['price_winter_temp'] = px.scatter(x=x_values, y=y_values, title='House Price vs. Winter Low Temperature')
 
-    HOUSE_PRICES_CACHE: list
-        a list of dictionaries that contain city-wise house price data
+    # plot correlation between house prices and population
+    x_values = table.column('population')
+    plots['price_population'] = px.scatter(x=x_values, y=y_values, title='House Price vs. Population')
+    return plots
 
-    Returns:
-    None
 
+def create_app(config=None, dataset=None):
     '''
+    This function creates the flask app of the city search tool.
+    All the data is loaded here, before the app is returned, so the app is ready to serve as soon as it exists.
+    The app serves the dataset held in app.datasets (a DatasetHolder), which can be replaced while it runs:
+    POST /admin/dataset/reload loads the data again in the background (e.g. a snapshot written by --refresh
+    or --prebuild in another process) and swaps it in once it is ready.
 
+    Parameters:
+    config: dict
+        settings that override the defaults and environment variables (see config.py)
+    dataset: Dataset
+        data that is already loaded (optional, it is loaded from the caches / sources otherwise)
 
-    with open(CACHE_FILE_NAME, 'w', encoding = 'utf-8', newline='') as file_obj:
-        writer = csv.DictWriter(file_obj, fieldnames=HOUSE_PRICES_CACHE[0].keys())
-        writer.writeheader() # first row
-        writer.writerows(HOUSE_PRICES_CACHE)
-    print('House Price cache file created.')
-
-# GET THE DATA
-
-# Get the cities from cache or generate them
-CITIES_CACHE = []
-
-# a list of relevant cities will be generated based on the user input
-min_population = int(input("What is the minimum population of your candidate city? (It needs to be over 15000): "))
-
-CACHE_FILE_NAME = 'cities_cache_' + str(min_population) +  '.csv'
-# if the cache file exists, load the data from the file, 
-# or call the function from the gci module to generate the data, and write the data to the cache file
-try:
-    with open(CACHE_FILE_NAME, 'r', encoding = 'utf-8') as file_obj:
-        reader = csv.DictReader(file_obj, delimiter=',')
-        for row in reader:
-            CITIES_CACHE.append(row)
-    print('Loaded ' + str(len(CITIES_CACHE)) + ' cities from cache.')
-except:
-    print(f'\nNo cache file found for cities with population over {min_population}. Generating data from python libraries...')
-    CITIES_CACHE = gci.get_cities(min_population)
-    write_cities_chache(CACHE_FILE_NAME, CITIES_CACHE)
-
-# Get the crime data from cache or generate them
-CRIME_CACHE = []
-CACHE_FILE_NAME = 'crime_cache.csv'
-try:
-    with open(CACHE_FILE_NAME, 'r', encoding = 'utf-8') as file_obj:
-        reader = csv.DictReader(file_obj, delimiter=',')
-        for row in reader:
-            CRIME_CACHE.append(row)
-    print('Loaded all ' + str(len(CRIME_CACHE)) + ' states crime data from cache.')
-except:
-    print('\nNo cache file found for crime data. Fetching data from API...')
-    CRIME_CACHE = gcr.get_data()
-    write_crime_chache(CACHE_FILE_NAME, CRIME_CACHE)
-
-# Get the house price data from cache or generate them
-HOUSE_PRICES_CACHE = []
-CACHE_FILE_NAME = 'house_prices_cache.csv'
-try:
-    with open(CACHE_FILE_NAME, 'r', encoding = 'utf-8') as file_obj:
-        reader = csv.DictReader(file_obj, delimiter=',')
-        for row in reader:
-            HOUSE_PRICES_CACHE.append(row)
-    print('Loaded ' + str(len(HOUSE_PRICES_CACHE)) + ' house prices data from cache.')
-except:
-    print('\nNo cache file found for house prices data. Fetching data from source CSV file with multi-year data...')
-    HOUSE_PRICES_CACHE = ghp.get_data()
-    write_house_prices_chache(CACHE_FILE_NAME, HOUSE_PRICES_CACHE)
-
-# create class 'City' objects from the cities cache (which is a list of dictionaries)
-cities = []
-for city in CITIES_CACHE:
-    new_city = City()
-    new_city.name = city['name']
-    new_city.latitude = city['latitude']
-    new_city.longitude = city['longitude']
-    new_city.population = city['population']
-    new_city.county = city['county']
-    new_city.state = city['state']
-    new_city.example_zipcode = city['example_zipcode']
-    new_city.summer_high_temp = city['summer_high_temp']
-    new_city.winter_low_temp = city['winter_low_temp']
-    cities.append(new_city)
-
-# add crime and state population data to the city objects
-# for every city, scan the CRIME_CACHE for the correct state, and add the crime rate and population data to the city object
-for city in cities:
-    for state_entry in CRIME_CACHE:
-        if city.state == state_entry['state']:
-            city.crime_rate = state_entry['crime rate']
-            city.state_population = state_entry['population']
-            break
-print('\nAdded state-wise aggregate crime-rate data to the cities in that state.')
-
-
-# add the house price data to the city objects
-# for every city, scan the HOUSE_PRICES_CACHE for the correct city, and add the house price data to the city object
-# some city names are slightly different in the two datasets, so we miss out on some data
-for city in cities:
-    for city_entry in HOUSE_PRICES_CACHE:
-        if city.name == city_entry['City']:
-            city.house_price = city_entry['Price']
-            break
-print('\nAdded house price data to the cities.')
-
-# discard the entries without house price data or crime data
-cities = [city for city in cities if city.house_price != None and city.crime_rate != None]
-print('\nOnly ' + str(len(cities)) + ' cities have both house price and crime data. Discarding the remaining ' + str(len(CITIES_CACHE) - len(cities)) + ' cities.')
-print('\nData is now fully ready!')
-
-
-# Write the final cities to a CSV file - this is for debugging purposes
-with open('cities_data_structure.csv', 'w', encoding = 'utf-8', newline='') as file_obj:
-    writer = csv.DictWriter(file_obj, fieldnames=cities[0].__dict__.keys())
-    writer.writeheader() # first row
-    for row in cities:
-        row_dict = row.__dict__
-        writer.writerow(row_dict)
-
-
-
-# ANALYSIS AND PLOTTING SECTION
-# plot correlation between house prices and crime rate
-x_values = [float(x.crime_rate)*1000 for x in cities]
-y_values = [int(y.house_price) for y in cities]
-scatter = go.Scatter(x=x_values, y=y_values)
-fig_price_crime = px.scatter(x=x_values, y=y_values, title='House Price vs. Crime Rate')
-
-# plot correlation between house prices and weather
-x_values = [float(x.summer_high_temp) for x in cities]
-y_values = [int(y.house_price) for y in cities]
-scatter = go.Scatter(x=x_values, y=y_values)
-fig_price_sum_temp = px.scatter(x=x_values, y=y_values, title='House Price vs. Summer High Temperature')
-
-# plot correlation between house prices and weather
-x_values = [float(x.winter_low_temp) for x in cities]
-y_values = [int(y.house_price) for y in cities]
-scatter = go.Scatter(x=x_values, y=y_values)
-fig_price_winter_temp = px.scatter(x=x_values, y=y_values, title='House Price vs. Winter Low Temperature')
-
-# plot correlation between house prices and population
-x_values = [float(x.population) for x in cities]
-y_values = [int(y.house_price) for y in cities]
-scatter = go.Scatter(x=x_values, y=y_values)
-fig_price_population = px.scatter(x=x_values, y=y_values, title='House Price vs. Population')
-
-# Run a while loop and ask user what plots they wish to see
-while True:
-    response = input('''
-    \nLet's plot some data!
-    Which correlation scatter plot would you like to see? (1, 2, 3, 4, or 5): 
-    1. House Price vs. Crime Rate
-    2. House Price vs. Summer High Temperature
-    3. House Price vs. Winter Low Temperature
-    4. House Price vs. Population
-    5. Exit
-    Enter Input : ''')
-    if response == '1':
-        print('Please open your browser to view the plot\n')
-        fig_price_crime.show()
-    elif response == '2':
-        print('Please open your browser to view the plot\n')
-        fig_price_sum_temp.show()
-    elif response == '3':
-        print('Please open your browser to view the plot\n')
-        fig_price_winter_temp.show()
-    elif response == '4':
-        print('Please open your browser to view the plot\n')
-        fig_price_population.show()
-    elif response == '5':
-        break
-    else:
-        print('Invalid input. Please enter a number between 1 and 5.')
-
-
-# SEARCH SECTION
-# make empty search tree
-SEARCH_TREE = sf.make_search_tree(SEARCH_TREE)
-
-# write the search tree to a JSON file
-sf.write_tree_to_file(SEARCH_TREE)
-
-# insert cities into the search tree
-insertions = 0
-for city in cities:
-    sf.add_city_to_search_tree(city, SEARCH_TREE)
-    insertions += 1
-print('\nInserted ' + str(insertions) + ' cities into the search tree.')
-# pprint(SEARCH_TREE)
-
-
-# Sanity Check - count the number of cities in the search tree
-# print(sf.do_sanity_count_check(SEARCH_TREE))
-
-# Sample Search
-# sresults = SEARCH_TREE['price 200-400k']['crime rare']['summer temp 90-100']['winter temp 40-50']
-# for r in sresults:
-    # pprint(r.name)
-
-# Start Search tool
-print('\nWelcome to the city search tool. You can search for cities based on a few criteria.')
-response = input('Please type yes to proceed. [You will need to click on the URL in the terminal below to run the flask app] : ')
-
+    Returns:
+    app: Flask
+        the flask app
+    '''
+    config = cfg.get_config(config)
+    ins.configure_logging(config['SPAN_LOG'])
+    start = time.perf_counter()
+    if dataset is None:
+        dataset = ds.load_dataset(config)
+
+    # the correlation statistics, the index of the coordinates, the similarity matrix and the price trends of every
+    # dataset are computed before it is served (at startup, and before every reload or refresh is swapped in),
+    # so that the first visitor does not wait for them
+    # (the searches use the index with the price trends, trend_store.get(data.index), so they can filter and rank on them)
+    correlation_store = cor.CorrelationStore()
+    similarity_store = sim.SimilarityStore()
+    trend_store = pt.TrendStore(config['DATA_DIR'], config['CACHE_DIR'])
+    ranking_store = rk.RankingStore()
+
+    def prepare(new_dataset):
+        correlation_store.get(new_dataset.table)
+        new_dataset.index.geo()
+        similarity_store.get(new_dataset.table)
+        # the house price file is only checked for changes here, not on every request
+        trend_store.check_source()
+        ranking_store.get(trend_store.get(new_dataset.index))
+
+    prepare(dataset)
+    datasets = ds.DatasetHolder(dataset, time.perf_counter() - start, prepare)
 
-if is_yes(response):
-    # RUN THE FLASK APP
     app = Flask(__name__)
-
+    app.config.update(config)
+    app.datasets = datasets
+    plot_service = ps.PlotService()
+    query_cache = qc.QueryCache(qc.make_backend(config['QUERY_CACHE_URL'], config['QUERY_CACHE_SIZE']), config['QUERY_CACHE_TTL'])
+
+    # keep the data up to date in the background (the searches are answered from the current data meanwhile)
+    # a thread does not survive a fork: with gunicorn --preload, create_app() runs in the master process before the
+    # workers are forked, so the refresh thread is started by every process on its first request instead (see wsgi.py)
+    # (only one of the processes refreshes from the sources, the others load the snapshot it writes, see refresh.py)
+    refresh_threads = {}
+    refresh_lock = threading.Lock()
+
+    def start_refresh():
+        with refresh_lock:
+            if os.getpid() not in refresh_threads:
+                refresh_threads[os.getpid()] = rf.start_background_refresh(datasets, config, config['REFRESH_INTERVAL'])
+
+    # time every request, and profile the ones that ask for it (if profiling is turned on)
+    profiler = ins.RequestProfiler(config['PROFILE_DIR'], config['PROFILER']) if config['PROFILE_DIR'] else None
+
+    @app.before_request
+    def start_request():
+        g.request_start = time.perf_counter()
+        if config['REFRESH_INTERVAL'] > 0 and os.getpid() not in refresh_threads:
+            start_refresh()
+        if profiler is not None and request.args.get('profile') == '1':
+            g.profiler = profiler.start()
+
+    @app.after_request
+    def finish_request(response):
+        endpoint = request.endpoint or 'unknown'
+        running_profiler = g.pop('profiler', None)
+        if running_profiler is not None:
+            response.headers['X-Profile-File'] = profiler.stop(running_profiler, endpoint)
+        seconds = time.perf_counter() - g.pop('request_start', time.perf_counter())
+        ins.record_span('request.' + endpoint, seconds, method=request.method, status=response.status_code)
+        ins.METRICS.increment('requests_total', {'endpoint': endpoint, 'status': response.status_code})
+        return response
+
+    # every request takes the current dataset once, at the start, and uses only that one
     @app.route('/')
     def index():
         return render_template('index.html')
@@ -377,22 +211,324 @@ if is_yes(response):
 
     @app.route('/handle_search', methods=['POST'])
     def handle_search():
+        data = datasets.get()
         house_price = str(request.form['price'])
         crime_rate = str(request.form['Crime Rate'])
         avg_summer_high = str(request.form['summer_temp'])
         avg_winter_low = str(request.form['winter_temp'])
 
-        search_results = SEARCH_TREE[house_price][crime_rate][avg_summer_high][avg_winter_low]
-        if search_results == []:
-            return "Sorry, there are no cities that match your search criteria. Please try again."
-        return render_template('search_results_new.html', search_results=search_results, plot_div=get_bar_plot(search_results))
+        bucket_labels = [house_price, crime_rate, avg_summer_high, avg_winter_low]
+
+        # when the user gives the importance of any attribute (w_price, ...), the cities are ranked, best fit first
+        # (see ranking.py); the form sends every w_ field, empty for the attributes that do not matter
+        ranked = any(request.form.get('w_' + attribute) for attribute in ci.ATTRIBUTES)
+        try:
+            ranges = sf.presets_to_ranges(bucket_labels)
+            criteria, soft, penalty = sa.parse_ranking_args(request.form) if ranked else (None, None, None)
+        except ValueError as error:
+            # an unknown bucket label, or a ranking parameter that is not understood (sa.SearchError)
+            return str(error), 400
+
+        def render_results():
+            scores = None
+            with ins.span('search_lookup'):
+                if ranked:
+                    index = trend_store.get(data.index)
+                    positions, scores, _ = rk.rank_positions(index, criteria, ranges, soft,
+                                                             stats=ranking_store.get(index), penalty=penalty)
+                    search_results = data.table.rows(positions)
+                    scores = [round(float(score), 3) for score in scores]
+                else:
+                    search_results = sf.search_buckets(data.index, bucket_labels)
+            if search_results == []:
+                return "Sorry, there are no cities that match your search criteria. Please try again."
+            with ins.span('plot_build', cities=len(search_results)):
+                plot_json = get_bar_plot(search_results, plot_service)
+            with ins.span('template_render', cities=len(search_results)):
+                return render_template('search_results_new.html', search_results=search_results, scores=scores, plot_json=plot_json)
+
+        # the order of the buckets does not change the results
+        key = sorted(bucket_labels)
+        if ranked:
+            key = {'buckets': key, 'criteria': sorted([attribute, weight, ideal] for attribute, (weight, ideal) in criteria.items()),
+                   'soft': sorted([attribute, low, high] for attribute, (low, high) in soft.items()), 'penalty': penalty}
+        return query_cache.get_or_build('html', key, data.table.version, render_results)
+
+    @app.route('/api/search')
+    def search_api():
+        # ?min_price=250000&max_price=350000&sort=-population&limit=20, see search_api.py for all the parameters
+        data = datasets.get()
+        index = trend_store.get(data.index)
+        try:
+            if request.args.get('format') == 'ndjson':
+                # check the parameters before the response starts, so that mistakes still get a 400 error
+                sa.parse_search_args(request.args, index.values)
+                sa.decode_cursor(request.args.get('cursor'), data.table.version)
+                return Response(sa.search_stream(index, request.args), mimetype='application/x-ndjson')
+            def build_page():
+                with ins.span('search_lookup'):
+                    return json.dumps(sa.search_page(index, request.args))
+
+            page = query_cache.get_or_build('api', sa.normalized_query(request.args, index.values), data.table.version, build_page)
+            return Response(page, mimetype='application/json')
+        except sa.SearchError as error:
+            return jsonify({'error': str(error)}), 400
+
+    @app.route('/api/nearby')
+    def nearby_api():
+        # ?near=Ann Arbor&state=MI&radius=100&max_price=400000, see search_api.py for all the parameters
+        data = datasets.get()
+        index = trend_store.get(data.index)
+        try:
+            def build_results():
+                with ins.span('geo_lookup'):
+                    return json.dumps(sa.nearby(index, request.args))
+
+            results = query_cache.get_or_build('nearby', sa.normalized_nearby_query(request.args, index.values), data.table.version, build_results)
+            return Response(results, mimetype='application/json')
+        except sa.SearchError as error:
+            return jsonify({'error': str(error)}), 400
+
+    @app.route('/api/rank')
+    def rank_api():
+        # ?max_price=500000&w_price=3&w_winter_low=2&ideal_winter_low=45, see search_api.py for all the parameters
+        data = datasets.get()
+        index = trend_store.get(data.index)
+        try:
+            def build_results():
+                with ins.span('rank_lookup'):
+                    return json.dumps(sa.rank(index, ranking_store.get(index), request.args))
+
+            results = query_cache.get_or_build('rank', sa.normalized_ranking_query(request.args, index.values), data.table.version, build_results)
+            return Response(results, mimetype='application/json')
+        except sa.SearchError as error:
+            return jsonify({'error': str(error)}), 400
+
+    @app.route('/api/price_history')
+    def price_history_api():
+        # the monthly house prices and the price trends of one city, e.g. ?name=Ann Arbor&state=MI
+        data = datasets.get()
+        index = trend_store.get(data.index)
+        try:
+            if not request.args.get('name'):
+                raise sa.SearchError('name is missing')
+            position = sa.find_city(data.table, request.args.get('name'), request.args.get('state'))
+        except sa.SearchError as error:
+            return jsonify({'error': str(error)}), 400
+        months, prices = trend_store.history(data.index, position)
+        return jsonify({'city': sa.result_dicts(index, [position])[0], 'months': months, 'prices': prices})
+
+    @app.route('/similar')
+    def similar_cities():
+        # the cities most like one city, e.g. /similar?name=Ann Arbor&state=MI&w_price=2
+        data = datasets.get()
+
+        def render_similar():
+            with ins.span('similar_lookup'):
+                results = sa.similar(data.table, similarity_store.get(data.table), request.args)
+            return render_template('similar.html', features=list(sim.FEATURES), **results)
+
+        try:
+            return query_cache.get_or_build('similar_html', sa.normalized_similar_query(request.args), data.table.version, render_similar)
+        except sa.SearchError as error:
+            return str(error), 400
+
+    @app.route('/api/similar')
+    def similar_api():
+        data = datasets.get()
+        try:
+            def build_results():
+                with ins.span('similar_lookup'):
+                    return json.dumps(sa.similar(data.table, similarity_store.get(data.table), request.args))
+
+            results = query_cache.get_or_build('similar', sa.normalized_similar_query(request.args), data.table.version, build_results)
+            return Response(results, mimetype='application/json')
+        except sa.SearchError as error:
+            return jsonify({'error': str(error)}), 400
+
+    @app.route('/api/cache')
+    def cache_stats_api():
+        stats = query_cache.stats()
+        stats['plots'] = {'entries': len(plot_service.entries), 'hits': plot_service.hits, 'misses': plot_service.misses}
+        return jsonify(stats)
+
+    @app.route('/metrics')
+    def metrics():
+        # Prometheus text format: the span histograms, the request counts, and the state of the data and the caches
+        data = datasets.get()
+        cache_stats = query_cache.stats()
+        gauges = {
+            'dataset_cities': len(data),
+            'dataset_load_seconds': datasets.load_seconds,
+            'dataset_swaps': datasets.swaps,
+            'query_cache_entries': cache_stats['entries'],
+            'query_cache_hits': cache_stats['hits'],
+            'query_cache_misses': cache_stats['misses'],
+            'plot_cache_hits': plot_service.hits,
+            'plot_cache_misses': plot_service.misses,
+        }
+        return Response(ins.METRICS.render(gauges), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/plots')
+    def correlation_plots():
+        data = datasets.get()
+        stats = correlation_store.get(data.table)
+        return render_template('plots.html', stats=stats, n=len(data))
+
+    @app.route('/plots/<name>')
+    def correlation_plot(name):
+        table = datasets.get().table
+        figure = correlation_store.figure(table, name)
+        if figure is None:
+            abort(404)
+        return render_template('plot.html', stats=correlation_store.get(table)[name], plot_json=figure)
+
+    @app.route('/api/correlations')
+    def correlations_api():
+        return jsonify(correlation_store.get(datasets.get().table))
+
+    @app.route('/api/plots/<name>')
+    def correlation_plot_api(name):
+        figure = correlation_store.figure(datasets.get().table, name)
+        if figure is None:
+            abort(404)
+        return Response(figure, mimetype='application/json')
+
+    def check_admin():
+        # the admin endpoints are turned off without an ADMIN_TOKEN, and admin requests must send it
+        # (the address a request comes from proves nothing: behind a local proxy, every request comes from 127.0.0.1)
+        if not config['ADMIN_TOKEN']:
+            abort(404)
+        if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), config['ADMIN_TOKEN']):
+            abort(403)
+
+    @app.route('/admin/dataset')
+    def dataset_info():
+        check_admin()
+        return jsonify(datasets.info())
+
+    @app.route('/admin/dataset/reload', methods=['POST'])
+    def dataset_reload():
+        check_admin()
+        started = datasets.reload_in_background(lambda: ds.load_dataset(config))
+        return jsonify(dict(datasets.info(), started=started)), 202
+
+    @app.route(ps.PLOTLY_JS_URL)
+    def plotly_js():
+        # served once per browser: the file never changes while the app runs
+        source, etag = ps.plotly_js()
+        if request.if_none_match.contains(etag):
+            return Response(status=304)
+        response = Response(source, mimetype='application/javascript')
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 60 * 60
+        return response
+
+    return app
+
+
+def run_interactive(config):
+    '''
+    This function runs the tool in the terminal: it asks for the minimum population, shows the correlation plots
+    the user asks for, and then starts the flask app.
+
+    Parameters:
+    config: dict
+        settings that override the defaults and environment variables (see config.py)
+    '''
+    # GET THE DATA
+    # a list of relevant cities will be generated based on the user input
+    # (unless it was already given on the command line or in the environment)
+    if config.get('MIN_POPULATION') is None and cfg.ENV_PREFIX + 'MIN_POPULATION' not in os.environ:
+        config['MIN_POPULATION'] = int(input("What is the minimum population of your candidate city? (It needs to be over 15000): "))
+    config = cfg.get_config(config)
+    dataset = ds.load_dataset(config)
+    print('\nData is now fully ready!')
+
+    # Write the final cities to a CSV file - this is for debugging purposes
+    with open('cities_data_structure.csv', 'w', encoding = 'utf-8', newline='') as file_obj:
+        writer = csv.DictWriter(file_obj, fieldnames=ct.COLUMNS.keys())
+        writer.writeheader() # first row
+        writer.writerows(dataset.table.to_records())
+
+    # ANALYSIS AND PLOTTING SECTION
+    plots = build_correlation_plots(dataset.table)
+
+    # Run a while loop and ask user what plots they wish to see
+    while True:
+        response = input('''
+        \nLet's plot some data!
+        Which correlation scatter plot would you like to see? (1, 2, 3, 4, or 5): 
+        1. House Price vs. Crime Rate
+        2. House Price vs. Summer High Temperature
+        3. House Price vs. Winter Low Temperature
+        4. House Price vs. Population
+        5. Exit
+        Enter Input : ''')
+        if response == '1':
+            print('Please open your browser to view the plot\n')
+            plots['price_crime'].show()
+        elif response == '2':
+            print('Please open your browser to view the plot\n')
+            plots['price_sum_temp'].show()
+        elif response == '3':
+            print('Please open your browser to view the plot\n')
+            plots['price_winter_temp'].show()
+        elif response == '4':
+            print('Please open your browser to view the plot\n')
+            plots['price_population'].show()
+        elif response == '5':
+            break
+        else:
+            print('Invalid input. Please enter a number between 1 and 5.')
+
+    # Sample Search
+    # sresults = sf.search_buckets(dataset.index, ['price 200-400k', 'crime rare', 'summer temp 90-100', 'winter temp 40-50'])
+    # for r in sresults:
+        # pprint(r.name)
 
-    app.run(debug=True, use_reloader=False)
-else:
-    pass
+    # Start Search tool
+    print('\nWelcome to the city search tool. You can search for cities based on a few criteria.')
+    response = input('Please type yes to proceed. [You will need to click on the URL in the terminal below to run the flask app] : ')
 
-print('Thank you for interacting with this tool. Goodbye!')
+    if is_yes(response):
+        # RUN THE FLASK APP
+        app = create_app(config, dataset)
+        app.run(debug=True, use_reloader=False)
+
+    print('Thank you for interacting with this tool. Goodbye!')
+
+
+def main():
+    '''
+    This function is the command line entry point.
+    Without any options, the tool runs interactively in the terminal, like before.
+    With --serve it loads the data and starts the web app without asking anything,
+    and with --prebuild it only builds the caches (e.g. before starting the web workers).
+    '''
+    parser = argparse.ArgumentParser(description='City search tool')
+    parser.add_argument('--min-population', type=int, help='minimum population of the cities to include')
+    parser.add_argument('--cache-dir', help='folder for the cache files')
+    parser.add_argument('--serve', action='store_true', help='start the web app without any prompts')
+    parser.add_argument('--prebuild', action='store_true', help='build all the caches and exit')
+    parser.add_argument('--refresh', action='store_true', help='bring the caches up to date with the sources and exit')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+
+    config = {'MIN_POPULATION': args.min_population, 'CACHE_DIR': args.cache_dir}
+    if args.prebuild:
+        dataset = ds.load_dataset(cfg.get_config(config))
+        print('\nPrebuilt the data for ' + str(len(dataset)) + ' cities.')
+    elif args.refresh:
+        config = cfg.get_config(config)
+        pprint(rf.refresh_dataset(ds.load_dataset(config), config)[1])
+    elif args.serve:
+        create_app(config).run(host=args.host, port=args.port)
+    else:
+        run_interactive(config)
 
 
-# if __name__ == "__main__":
-    # main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import struct
+import time
+import numpy as np
+
+import cache_store as cs
+import city_table as ct
+import city_index as ci
+
+# Notes on the approach
+# The table of cities and its search index are written to one binary file once they are built,
+# so the next start can open them in a few milliseconds instead of reading the csv caches and joining them again.
+#
+# Layout of the file:
+#   MAGIC (8 bytes) | length of the header (8 bytes, little endian) | header (json) | arrays
+# The header has the format version, a checksum of what the data was built from (see sources_checksum()),
+# the version of the table, and the dtype, shape and position of every array. Every array starts on an
+# ALIGNMENT byte boundary, so the whole file is memory mapped once and each array is a view into it:
+# nothing is parsed or copied when the file is opened, and the operating system only reads the pages that are used
+# (which are also shared between the web workers).
+
+MAGIC = b'CITYSNAP'
+FORMAT_VERSION = 1
+SNAPSHOT_FILE = 'city_index.snapshot'
+ALIGNMENT = 64
+
+
+def sources_checksum(sources):
+    '''
+    This function returns the checksum of a description of the sources (any dictionary json can write).
+    '''
+    return hashlib.sha256(json.dumps(sources, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def table_version(checksum):
+    '''
+    This function returns the version of a table built from the sources with this checksum.
+    Every process that builds the table from the same sources gives it the same version, so the keys and cursors
+    made from the version (e.g. in a shared query cache) mean the same thing in every web worker.
+    '''
+    return checksum[:12]
+
+
+def aligned(size):
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def snapshot_arrays(table, index):
+    '''
+    This function returns every array that goes into a snapshot, by name.
+    '''
+    arrays = {}
+    for column in ct.COLUMNS:
+        arrays['column/' + column] = table.column(column)
+    for attribute in ci.ATTRIBUTES:
+        arrays['values/' + attribute] = index.values[attribute]
+        arrays['order/' + attribute] = index.order[attribute]
+        arrays['sorted/' + attribute] = index.sorted_values[attribute]
+    return arrays
+
+
+def write_snapshot(file_name, table, index, checksum, match_stats=None):
+    '''
+    This function writes the table of cities and its search index to a snapshot file.
+
+    Parameters:
+    file_name (str): the snapshot file
+    table (CityTable): the table of cities
+    index (CityIndex): the search index over the table
+    checksum (str): checksum of the sources, see sources_checksum()
+    match_stats (dict): how the data sets were joined (optional, kept for reporting)
+
+    Returns:
+    None
+    '''
+    arrays = {name: np.ascontiguousarray(values) for name, values in snapshot_arrays(table, index).items()}
+    layout = {}
+    offset = 0
+    for name, values in arrays.items():
+        layout[name] = {'dtype': values.dtype.str, 'shape': list(values.shape), 'offset': offset}
+        offset = aligned(offset + values.nbytes)
+    header = json.dumps({
+        'format_version': FORMAT_VERSION,
+        'checksum': checksum,
+        'table_version': table.version,
+        'rows': len(table),
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'match_stats': match_stats or {},
+        'data_size': offset,
+        'arrays': layout,
+    }).encode('utf-8')
+    data_start = aligned(len(MAGIC) + 8 + len(header))
+
+    def write_arrays(file_obj):
+        file_obj.write(MAGIC + struct.pack('<Q', len(header)) + header)
+        file_obj.write(b'\0' * (data_start - file_obj.tell()))
+        for name, values in arrays.items():
+            file_obj.write(values.tobytes())
+            file_obj.write(b'\0' * (data_start + aligned(layout[name]['offset'] + values.nbytes) - file_obj.tell()))
+
+    cs.atomic_write(file_name, write_arrays, mode='wb')
+
+
+def read_header(file_name):
+    '''
+    This function returns the header of a snapshot file and where its arrays start.
+
+    Returns:
+    header (dict): the header, see the notes at the top
+    data_start (int): position of the first array in the file
+    '''
+    with open(file_name, 'rb') as file_obj:
+        start = file_obj.read(len(MAGIC) + 8)
+        if len(start) < len(MAGIC) + 8 or start[:len(MAGIC)] != MAGIC:
+            raise ValueError('not a snapshot file')
+        header_length = struct.unpack('<Q', start[len(MAGIC):])[0]
+        header = json.loads(file_obj.read(header_length).decode('utf-8'))
+    return header, aligned(len(MAGIC) + 8 + header_length)
+
+
+def snapshot_problem(file_name, checksum=None):
+    '''
+    This function checks a snapshot file before it is used.
+
+    Returns:
+    reason (str): why the snapshot cannot be used, or None if it is valid
+    '''
+    try:
+        header, data_start = read_header(file_name)
+    except (OSError, ValueError, struct.error):
+        return 'it is missing or unreadable'
+    if header.get('format_version') != FORMAT_VERSION:
+        return 'it was written with format version ' + str(header.get('format_version'))
+    if checksum is not None and header.get('checksum') != checksum:
+        return 'the source data has changed'
+    if os.path.getsize(file_name) < data_start + header.get('data_size', 0):
+        return 'the file is incomplete'
+    return None
+
+
+def load_snapshot(file_name, checksum=None):
+    '''
+    This function opens a snapshot file (memory mapped), if it exists and still matches the sources.
+
+    Parameters:
+    file_name (str): the snapshot file
+    checksum (str): checksum of the current sources (not checked if None)
+
+    Returns:
+    table (CityTable): the table of cities, or None if the snapshot cannot be used
+    index (CityIndex): the search index over the table, or None
+    header (dict): the header of the snapshot, or None
+    '''
+    if not os.path.exists(file_name):
+        return None, None, None
+    reason = snapshot_problem(file_name, checksum)
+    if reason is not None:
+        print('Ignoring the snapshot file ' + file_name + ': ' + reason + '.')
+        return None, None, None
+
+    header, data_start = read_header(file_name)
+    buffer = np.memmap(file_name, dtype=np.uint8, mode='r')
+    arrays = {}
+    for name, layout in header['arrays'].items():
+        dtype = np.dtype(layout['dtype'])
+        start = data_start + layout['offset']
+        count = int(np.prod(layout['shape']))
+        arrays[name] = buffer[start:start + count * dtype.itemsize].view(dtype).reshape(layout['shape'])
+
+    table = ct.CityTable({column: arrays['column/' + column] for column in ct.COLUMNS}, version=header['table_version'])
+    index = ci.CityIndex.from_arrays(table, {attribute: arrays['values/' + attribute] for attribute in ci.ATTRIBUTES},
+                                     {attribute: arrays['order/' + attribute] for attribute in ci.ATTRIBUTES},
+                                     {attribute: arrays['sorted/' + attribute] for attribute in ci.ATTRIBUTES})
+    return table, index, header
@@ -0,0 +1,213 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Notes on the approach
+# Named spans time the stages of building the data (loading geonames, mapping zipcodes, fetching the weather and
+# the crime data, loading the house prices, joining, building the index) and the phases of each request
+# (looking up the cities, building the plot, rendering the template).
+# Every span that ends is
+# - added to a histogram per span name, which the web app serves in the Prometheus text format (/metrics)
+# - written as one json line to the 'city_search.spans' logger (nothing is written unless logging is configured,
+#   see configure_logging())
+# Spans can be nested: each one knows the span it was started in, on the same thread.
+# Timing a span costs a few microseconds, so they are only put around whole stages, never inside loops.
+
+LOGGER = logging.getLogger('city_search.spans')
+LOGGER.addHandler(logging.NullHandler())
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+METRIC_PREFIX = 'city_search_'
+
+
+class Metrics:
+    '''
+    This class collects the durations of the spans (as histograms) and any counters, for the /metrics endpoint.
+    '''
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, name, seconds):
+        '''
+        This function adds the duration of one span to the histogram of its name.
+        '''
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram['counts'][i] += 1
+                    break
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    def increment(self, name, labels=None, amount=1):
+        '''
+        This function adds to a counter (e.g. the number of requests per endpoint and status).
+        '''
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def render(self, gauges=None):
+        '''
+        This function returns every metric in the Prometheus text format.
+
+        Parameters:
+        gauges (dict): current values to add, {name: value} or {name: {labels tuple: value}}
+
+        Returns:
+        text (str): the metrics
+        '''
+        lines = []
+        with self.lock:
+            if self.histograms:
+                lines.append('# TYPE ' + METRIC_PREFIX + 'span_seconds histogram')
+            for name, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, histogram['counts']):
+                    cumulative += count
+                    lines.append(METRIC_PREFIX + 'span_seconds_bucket{span="%s",le="%s"} %d' % (name, bound, cumulative))
+                lines.append(METRIC_PREFIX + 'span_seconds_bucket{span="%s",le="+Inf"} %d' % (name, histogram['count']))
+                lines.append(METRIC_PREFIX + 'span_seconds_sum{span="%s"} %.6f' % (name, histogram['sum']))
+                lines.append(METRIC_PREFIX + 'span_seconds_count{span="%s"} %d' % (name, histogram['count']))
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append('# TYPE ' + METRIC_PREFIX + name + ' counter')
+                for (counter, labels), value in sorted(self.counters.items()):
+                    if counter == name:
+                        lines.append(METRIC_PREFIX + name + format_labels(labels) + ' ' + str(value))
+        for name, value in sorted((gauges or {}).items()):
+            lines.append('# TYPE ' + METRIC_PREFIX + name + ' gauge')
+            values = value if isinstance(value, dict) else {(): value}
+            for labels, number in sorted(values.items()):
+                lines.append(METRIC_PREFIX + name + format_labels(labels) + ' ' + str(0 if number is None else number))
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels) + '}'
+
+
+METRICS = Metrics()
+
+_local = threading.local()
+
+
+@contextmanager
+def span(name, **fields):
+    '''
+    This function times a block of code as a named span, e.g.
+
+        with span('zip_mapping', cities=len(cities_list)):
+            ...
+
+    Parameters:
+    name (str): name of the span
+    fields: anything else to write in the log line of the span
+    '''
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    parent = stack[-1] if stack else None
+    stack.append(name)
+    start = time.perf_counter()
+    status = 'ok'
+    try:
+        yield
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        stack.pop()
+        record_span(name, time.perf_counter() - start, status=status, parent=parent, **fields)
+
+
+def record_span(name, seconds, **fields):
+    '''
+    This function records a span that was timed some other way (e.g. from the start to the end of a request).
+    '''
+    METRICS.observe(name, seconds)
+    if LOGGER.isEnabledFor(logging.INFO):
+        record = {'span': name, 'seconds': round(seconds, 6)}
+        record.update((key, value) for key, value in fields.items() if value is not None)
+        LOGGER.info(json.dumps(record, default=str))
+
+
+class JsonFormatter(logging.Formatter):
+    '''
+    This class writes each log record as one json line, with the time it was made.
+    '''
+    def format(self, record):
+        message = record.getMessage()
+        try:
+            data = json.loads(message)
+        except ValueError:
+            data = {'message': message}
+        return json.dumps(dict({'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'), 'level': record.levelname}, **data))
+
+
+def configure_logging(destination):
+    '''
+    This function writes the span logs as json lines to a file, or to stderr if destination is '-'.
+    Nothing is done if destination is empty.
+    '''
+    if not destination:
+        return
+    handler = logging.StreamHandler() if destination == '-' else logging.FileHandler(destination, encoding='utf-8')
+    handler.setFormatter(JsonFormatter())
+    LOGGER.addHandler(handler)
+    LOGGER.setLevel(logging.INFO)
+    LOGGER.propagate = False
+
+
+class RequestProfiler:
+    '''
+    This class profiles single requests of the web app, when they ask for it (with ?profile=1),
+    and writes each profile to a file in a folder: a .prof file for cProfile (open it with pstats or snakeviz),
+    or an .html file for pyinstrument (which has to be installed).
+    '''
+    def __init__(self, directory, profiler='cprofile'):
+        self.directory = directory
+        self.profiler = profiler
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        if self.profiler == 'pyinstrument':
+            import pyinstrument
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+        else:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler
+
+    def stop(self, profiler, name):
+        '''
+        This function stops a profiler started with start() and writes its profile.
+
+        Returns:
+        file_name (str): the file written
+        '''
+        base = os.path.join(self.directory, name + '-' + time.strftime('%Y%m%d-%H%M%S') + '-' + str(time.perf_counter_ns() % 1000000))
+        if self.profiler == 'pyinstrument':
+            profiler.stop()
+            file_name = base + '.html'
+            with open(file_name, 'w', encoding='utf-8') as file_obj:
+                file_obj.write(profiler.output_html())
+        else:
+            profiler.disable()
+            file_name = base + '.prof'
+            profiler.dump_stats(file_name)
+        return file_name
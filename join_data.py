@@ -0,0 +1,169 @@
+import csv
+import re
+
+# Notes on the approach
+# The cities come from geonamescache, the crime data is per state, and the house prices come from Zillow.
+# Instead of scanning the crime and house price lists for every city, we build dictionaries (hash indexes) once,
+# and each city is then matched with a single lookup.
+# The house prices are matched on (city name, state), since names like 'Springfield' exist in many states.
+# City names are spelled differently across the data sources ('St. Louis' vs 'Saint Louis', 'Boise City' vs 'Boise'),
+# so names are also normalized through a small alias table before matching.
+
+STATES_FILE = 'state_list.csv'
+
+# words that are spelled in more than one way; every spelling is mapped to the one on the right
+WORD_ALIASES = {
+    'saint': 'st',
+    'sainte': 'ste',
+    'fort': 'ft',
+    'mount': 'mt',
+    'mountain': 'mtn',
+    'north': 'n',
+    'south': 's',
+    'east': 'e',
+    'west': 'w',
+}
+
+# trailing words that are sometimes part of the official name and sometimes not
+NAME_SUFFIXES = ('city', 'town', 'township', 'village', 'borough', 'municipality')
+
+
+def load_state_codes(file_name=STATES_FILE):
+    '''
+    This function returns a dictionary that maps full state names (lower case) to their two letter codes.
+
+    Parameters:
+    file_name (str): the csv file with the list of states
+
+    Returns:
+    state_codes (dict): e.g. {'california': 'CA', ...}
+    '''
+    state_codes = {}
+    with open(file_name, 'r', encoding = 'utf-8-sig') as file_obj:
+        for row in csv.reader(file_obj):
+            state_codes[row[1].strip().lower()] = row[0].strip().upper()
+    state_codes['district of columbia'] = 'DC'
+    return state_codes
+
+
+def state_code(state, state_codes):
+    '''
+    This function returns the two letter code of a state, given either its code or its full name.
+    '''
+    state = (state or '').strip()
+    if len(state) == 2:
+        return state.upper()
+    return state_codes.get(state.lower(), state.upper())
+
+
+def exact_key(name):
+    '''
+    This function returns the name used for exact matching: lower case, with surrounding spaces removed.
+    '''
+    return (name or '').strip().lower()
+
+
+def normalize_city_name(name):
+    '''
+    This function normalizes a city name so that different spellings of the same city end up the same.
+    Punctuation is removed, words are mapped through WORD_ALIASES, and a trailing word like 'city' is dropped.
+
+    Parameters:
+    name (str): a city name, e.g. 'St. Louis' or 'Saint Louis'
+
+    Returns:
+    key (str): the normalized name, e.g. 'st louis'
+    '''
+    words = re.sub(r'[^a-z0-9 ]', ' ', exact_key(name).replace("'", '')).split()
+    words = [WORD_ALIASES.get(word, word) for word in words]
+    if len(words) > 1 and words[-1] in NAME_SUFFIXES:
+        words = words[:-1]
+    return ' '.join(words)
+
+
+def index_by_state(crime_rows):
+    '''
+    This function indexes the state-wise crime data by state code.
+
+    Parameters:
+    crime_rows (list): list of dictionaries with (at least) a 'state' key
+
+    Returns:
+    index (dict): {state code: row}
+    '''
+    return {row['state'].strip().upper(): row for row in crime_rows}
+
+
+def index_house_prices(house_price_rows, state_codes):
+    '''
+    This function builds two indexes over the house price data:
+    one on the exact (city name, state code), and one on the normalized (city name, state code).
+    When two rows share a key, the first one is kept (the source file is sorted by city size, largest first).
+
+    Parameters:
+    house_price_rows (list): list of dictionaries with 'City', 'State' and 'Price' keys
+    state_codes (dict): full state name to code, see load_state_codes()
+
+    Returns:
+    exact_index (dict): {(exact name, state code): row}
+    alias_index (dict): {(normalized name, state code): row}
+    '''
+    exact_index = {}
+    alias_index = {}
+    for row in house_price_rows:
+        code = state_code(row['State'], state_codes)
+        exact_index.setdefault((exact_key(row['City']), code), row)
+        alias_index.setdefault((normalize_city_name(row['City']), code), row)
+    return exact_index, alias_index
+
+
+def enrich_cities(cities, crime_rows, house_price_rows, states_file=STATES_FILE):
+    '''
+    This function adds the crime rate, state population and house price to every City object, in linear time.
+
+    Parameters:
+    cities (list): list of City objects (with name and state set)
+    crime_rows (list): state-wise crime data (the crime cache)
+    house_price_rows (list): city-wise house prices (the house prices cache)
+    states_file (str): the csv file with the list of states
+
+    Returns:
+    stats (dict): how many cities were matched, and how
+    '''
+    state_codes = load_state_codes(states_file)
+    crime_index = index_by_state(crime_rows)
+    exact_index, alias_index = index_house_prices(house_price_rows, state_codes)
+
+    stats = {'cities': len(cities), 'crime matched': 0, 'price exact': 0, 'price alias': 0, 'price unmatched': 0}
+    for city in cities:
+        code = state_code(city.state, state_codes)
+
+        state_entry = crime_index.get(code)
+        if state_entry is not None:
+            city.crime_rate = state_entry['crime rate']
+            city.state_population = state_entry['population']
+            stats['crime matched'] += 1
+
+        city_entry = exact_index.get((exact_key(city.name), code))
+        if city_entry is not None:
+            stats['price exact'] += 1
+        else:
+            city_entry = alias_index.get((normalize_city_name(city.name), code))
+            if city_entry is not None:
+                stats['price alias'] += 1
+            else:
+                stats['price unmatched'] += 1
+        if city_entry is not None:
+            city.house_price = city_entry['Price']
+
+    return stats
+
+
+def print_match_stats(stats):
+    '''
+    This function prints the match statistics returned by enrich_cities().
+    '''
+    print('\nMatched crime data for ' + str(stats['crime matched']) + ' of ' + str(stats['cities']) + ' cities.')
+    print('Matched house prices for ' + str(stats['price exact'] + stats['price alias']) + ' of ' + str(stats['cities']) + ' cities ('
+          + str(stats['price exact']) + ' by exact name, ' + str(stats['price alias']) + ' by normalized name, '
+          + str(stats['price unmatched']) + ' not found).')
@@ -1,8 +1,21 @@
-import json
+import os
+import sys
 from pprint import pprint
 
-search_tree_object = {}
-with open('search_tree.json', 'r') as f:
-    search_tree_object = json.load(f)
+import config as cfg
+import index_snapshot as snap
 
-pprint(search_tree_object)
\ No newline at end of file
+# Opens the snapshot of the cities and their search index (written by dataset.load_dataset()) and prints what is in it.
+#     python load_search_tree.py [snapshot file]
+
+file_name = sys.argv[1] if len(sys.argv) > 1 else os.path.join(cfg.get_config()['CACHE_DIR'], snap.SNAPSHOT_FILE)
+
+table, index, header = snap.load_snapshot(file_name)
+if table is None:
+    print('No snapshot found at ' + file_name + '. Run hardikm_final_proj_v1.py --prebuild to write one.')
+    sys.exit(1)
+
+pprint({key: value for key, value in header.items() if key != 'arrays'})
+print('\nThe 5 most expensive cities:')
+for city in index.query(sort_by='price', descending=True, limit=5):
+    print(city)
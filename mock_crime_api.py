@@ -0,0 +1,101 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A local stand-in for the FBI crime API, so that get_crime_data can be run (and timed) without the network.
+# It answers /arrest/state/<STATE>/all with made-up (but repeatable) yearly arrest numbers for that state.
+# It can also be slowed down, and made to fail every n-th request, to exercise the retries of the client.
+#
+# Run it on its own with:  python mock_crime_api.py 8080
+# and point the client at it: CrimeClient(base_url='http://127.0.0.1:8080', api_key='test')
+
+CRIME_TYPES = ['Aggravated Assault', 'Burglary', 'Larceny', 'Motor Vehicle Theft', 'Robbery', 'Drug Abuse Violations']
+
+PATH_PATTERN = re.compile(r'^/arrest/state/([A-Za-z]{2})/all$')
+
+
+def fake_state_data(state, from_year, to_year):
+    '''
+    This function returns made-up yearly arrest numbers for a state. The same state always gets the same numbers.
+    '''
+    rng = random.Random(state)
+    return [dict({'data_year': year}, **{crime: rng.randint(100, 20000) for crime in CRIME_TYPES})
+            for year in range(from_year, to_year + 1)]
+
+
+class MockCrimeHandler(BaseHTTPRequestHandler):
+    '''
+    This class handles the requests made to the mock server.
+    '''
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.request_count += 1
+            request_number = server.request_count
+        if server.latency:
+            time.sleep(server.latency)
+
+        # fail every n-th request, like a rate limited or overloaded API would
+        if server.fail_every and request_number % server.fail_every == 0:
+            self.send_response(server.fail_status)
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+            return
+
+        path, _, query = self.path.partition('?')
+        match = PATH_PATTERN.match(path)
+        if match is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        params = dict(part.split('=', 1) for part in query.split('&') if '=' in part)
+        body = json.dumps({'data': fake_state_data(match.group(1).upper(), int(params.get('from', 2019)), int(params.get('to', 2022)))})
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode('utf-8'))
+
+    def log_message(self, format, *args):
+        # keep the terminal quiet
+        pass
+
+
+def start_mock_server(port=0, latency=0, fail_every=0, fail_status=429):
+    '''
+    This function starts the mock crime API on a background thread.
+
+    Parameters:
+    port (int): port to listen on (0 picks a free port)
+    latency (float): seconds to wait before answering each request
+    fail_every (int): answer every n-th request with fail_status (0 never fails)
+    fail_status (int): the status code of the failed requests
+
+    Returns:
+    server (ThreadingHTTPServer): the running server (call server.shutdown() to stop it)
+    base_url (str): the url to give to CrimeClient
+    '''
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockCrimeHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.request_count = 0
+    server.latency = latency
+    server.fail_every = fail_every
+    server.fail_status = fail_status
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:' + str(server.server_address[1])
+
+
+if __name__ == '__main__':
+    import sys
+    server, base_url = start_mock_server(int(sys.argv[1]) if len(sys.argv) > 1 else 8080)
+    print('Mock crime API running at ' + base_url + ' (Ctrl+C to stop)')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+# Notes on the approach
+# The search results page used to build a plotly Figure and call fig.to_html() on every search,
+# which inlines the whole plotly.js library (~4.8 MB) into each response.
+# Now the page loads plotly.js once, from its own url (which the browser caches), and gets a small json spec
+# of the figure to draw on the client side. The specs are cached (least recently used entries are dropped first),
+# keyed by which cities are in the result, so popular searches are not built again.
+
+DEFAULT_MAX_ENTRIES = 256
+
+PLOTLY_JS_URL = '/assets/plotly.min.js'
+
+
+class PlotService:
+    '''
+    This class builds figure specs (as json strings) and keeps the most recently used ones in memory.
+    '''
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build_figure):
+        '''
+        This function returns the json spec of a figure, from the cache if possible.
+
+        Parameters:
+        key (tuple): identifies the figure (it must change whenever the figure would change)
+        build_figure (function): called without arguments on a cache miss, returns the figure as a dictionary
+
+        Returns:
+        spec (str): the figure as a json string, ready for Plotly.newPlot on the client side
+        '''
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+
+        # build outside the lock, so that other requests are not kept waiting
+        # '</' is escaped so that the spec can be put inside a <script> tag as it is
+        spec = json.dumps(build_figure(), separators=(',', ':')).replace('</', '<\\/')
+
+        with self.lock:
+            self.entries[key] = spec
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return spec
+
+    def clear(self):
+        '''
+        This function empties the cache.
+        '''
+        with self.lock:
+            self.entries.clear()
+
+
+def result_key(search_results):
+    '''
+    This function returns a key that identifies a list of search results:
+    the version of the table they come from, and their positions in it.
+    '''
+    if search_results and hasattr(search_results[0], 'position'):
+        return (search_results[0].table.version, tuple(city.position for city in search_results))
+    return tuple((city.name, city.state) for city in search_results)
+
+
+def bar_plot_figure(search_results):
+    '''
+    This function returns the bar plot of the house prices of a list of cities, as a plain plotly figure dictionary.
+
+    Parameters:
+    search_results (list): a list of CityRow views (or City objects)
+
+    Returns:
+    figure (dict): with 'data' and 'layout', as expected by Plotly.newPlot
+    '''
+    x_values = [x.name for x in search_results]
+    y_values = [int(y.house_price) for y in search_results]
+    return {
+        'data': [{'type': 'bar', 'x': x_values, 'y': y_values, 'orientation': 'v'}],
+        'layout': {
+            'title': {'text': 'House Price by City'},
+            'xaxis': {'title': {'text': 'City'}, 'autorange': True},
+            'yaxis': {'title': {'text': 'House Prices'}, 'autorange': True},
+        },
+    }
+
+
+_PLOTLY_JS = None
+
+
+def plotly_js():
+    '''
+    This function returns the plotly.js library (as shipped with the plotly python package) and its ETag.
+    It is read only once per process.
+    '''
+    global _PLOTLY_JS
+    if _PLOTLY_JS is None:
+        from plotly.offline import get_plotlyjs
+        source = get_plotlyjs().encode('utf-8')
+        _PLOTLY_JS = (source, hashlib.sha1(source).hexdigest())
+    return _PLOTLY_JS
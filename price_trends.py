@@ -0,0 +1,206 @@
+import os
+import threading
+import numpy as np
+
+import get_house_prices as ghp
+import join_data as jd
+
+# Notes on the approach
+# The house price file has a price for every city and month from 2008-03 on, but the search only used one month.
+# The whole history is kept as one dense matrix (cities x months, NaN where a month has no price), in the binary
+# snapshot of get_house_prices (written once from the csv file, then memory-mapped), and the trends of every city
+# are computed from it in a few vectorized passes over the matrix:
+# - price_yoy: the change of the price over the last year, from the last month with a price
+# - price_cagr: the yearly growth rate from the first month with a price to the last one
+# - price_volatility: the standard deviation of the monthly changes (of the log of the price), over a year
+# - price_drawdown: the largest fall of the price from its highest point so far (e.g. -0.3 for a fall of 30%)
+# Every rate is a fraction (0.05 is 5%).
+# The rows of the matrix are matched with the cities of the table the same way the house prices are (join_data.py),
+# and the trends are added to the search index as attributes, so that searches can filter, sort and rank on them.
+# They only depend on the data, so they are computed once per table version (and kept for the previous version
+# too, which requests that started before a reload may still be using).
+
+TRENDS = ('price_yoy', 'price_cagr', 'price_volatility', 'price_drawdown')
+
+# the ideal value of every trend when ranking on it (see ranking.py): growth and a small drawdown are better
+DEFAULT_IDEALS = {
+    'price_yoy': 'max',
+    'price_cagr': 'max',
+    'price_volatility': 'min',
+    'price_drawdown': 'max',
+}
+
+# at least this many months of prices are needed for the growth rate and the volatility
+MIN_MONTHS = 12
+
+# how many versions of the table the store keeps the trends for
+KEEP_VERSIONS = 2
+
+
+def load_price_matrix(data_dir='.', cache_dir='.'):
+    '''
+    This function returns the full price matrix, from the binary snapshot in the cache folder
+    (which is written first, if it is missing or was written from another version of the source csv file).
+
+    Returns:
+    prices (np.ndarray): cities x months matrix of prices, NaN where there is no price
+    meta (dict): the 'City', 'State' and 'months' lists that label the rows and columns
+    '''
+    source_file = ghp.resolve_source_file(os.path.join(data_dir, ghp.SOURCE_FILE))
+    snapshot_file, meta_file = ghp.snapshot_files(source_file, cache_dir)
+    if not ghp.snapshot_is_fresh(source_file, snapshot_file, meta_file):
+        ghp.write_price_snapshot(source_file, snapshot_file, meta_file)
+    return ghp.load_price_snapshot(snapshot_file, meta_file)
+
+
+def compute_trends(prices):
+    '''
+    This function computes the TRENDS of every row of a price matrix.
+
+    Parameters:
+    prices (np.ndarray): cities x months matrix of prices, NaN where there is no price
+
+    Returns:
+    trends (dict): {trend name: np.ndarray with one value per row}, NaN where there are too few prices
+    '''
+    prices = np.asarray(prices, dtype=np.float64)
+    rows, months = prices.shape
+    has_price = ~np.isnan(prices)
+    any_price = has_price.any(axis=1)
+    row_numbers = np.arange(rows)
+    first = np.argmax(has_price, axis=1)
+    last = months - 1 - np.argmax(has_price[:, ::-1], axis=1)
+    latest = np.where(any_price, prices[row_numbers, last], np.nan)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # price_yoy: the last price against the price 12 months before it
+        year_before = prices[row_numbers, np.maximum(last - 12, 0)]
+        yoy = np.where(last >= 12, latest / year_before - 1, np.nan)
+
+        # price_cagr: from the first price to the last one
+        years = (last - first) / 12
+        cagr = np.where(years >= MIN_MONTHS / 12, (latest / prices[row_numbers, first]) ** (1 / np.maximum(years, 1e-9)) - 1, np.nan)
+
+        # price_volatility: the monthly changes of the log of the price (a gap in the prices leaves out the changes around it)
+        changes = np.diff(np.log(prices), axis=1)
+        known = ~np.isnan(changes)
+        count = known.sum(axis=1)
+        mean = np.where(known, changes, 0).sum(axis=1) / count
+        variance = np.where(known, (changes - mean[:, None]) ** 2, 0).sum(axis=1) / count
+        volatility = np.where(count >= MIN_MONTHS, np.sqrt(variance * 12), np.nan)
+
+        # price_drawdown: the price against the highest price before it (fmax skips the missing months)
+        drawdowns = prices / np.fmax.accumulate(prices, axis=1) - 1
+        drawdown = np.where(any_price, np.where(np.isnan(drawdowns), 0, drawdowns).min(axis=1), np.nan)
+
+    return {'price_yoy': yoy, 'price_cagr': cagr, 'price_volatility': volatility, 'price_drawdown': drawdown}
+
+
+def match_rows(table, meta, states_file=jd.STATES_FILE):
+    '''
+    This function finds the row of the price matrix of every city of the table,
+    matching on the city name and state like join_data.enrich_cities() does.
+
+    Returns:
+    rows (np.ndarray): the row of every city in the order of the table, -1 for the cities without one
+    '''
+    state_codes = jd.load_state_codes(states_file)
+    exact_index, alias_index = jd.index_house_prices([{'City': city, 'State': state, 'row': row}
+                                                      for row, (city, state) in enumerate(zip(meta['City'], meta['State']))], state_codes)
+    rows = np.full(len(table), -1, dtype=np.int64)
+    for position, (name, state) in enumerate(zip(table.column('name'), table.column('state'))):
+        code = jd.state_code(str(state), state_codes)
+        entry = exact_index.get((jd.exact_key(str(name)), code)) or alias_index.get((jd.normalize_city_name(str(name)), code))
+        if entry is not None:
+            rows[position] = entry['row']
+    return rows
+
+
+class TrendStore:
+    '''
+    This class keeps, for the last KEEP_VERSIONS versions of the table, the price trends of its cities and a search index
+    that includes them.
+    The source csv file is only looked at by check_source() (called when a new dataset is prepared, e.g. after
+    refresh.refresh_house_prices()), never on a request: the price matrix is loaded again if the file has changed,
+    and the trends are then matched with the cities again.
+    '''
+    def __init__(self, data_dir='.', cache_dir='.'):
+        self.data_dir = data_dir
+        self.cache_dir = cache_dir
+        self.prices = None
+        self.meta = None
+        self.row_trends = None
+        self.source_key = None
+        # {(table version, source key): (index, rows, prices, meta)}, oldest first
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def current_source_key(self):
+        '''
+        This function returns what identifies the current contents of the source csv file: its modification time and size.
+        '''
+        stat = os.stat(ghp.resolve_source_file(os.path.join(self.data_dir, ghp.SOURCE_FILE)))
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def load(self):
+        # called with the lock held
+        source_key = self.current_source_key()
+        if self.source_key != source_key:
+            self.prices, self.meta = load_price_matrix(self.data_dir, self.cache_dir)
+            self.row_trends = compute_trends(self.prices)
+            self.source_key = source_key
+            print('Computed the price trends of ' + str(len(self.prices)) + ' cities over ' + str(len(self.meta['months'])) + ' months.')
+
+    def check_source(self):
+        '''
+        This function loads the price matrix again if the source csv file has changed since it was loaded.
+        '''
+        with self.lock:
+            self.load()
+
+    def entry(self, index):
+        # called with the lock held: the trends of the cities of the index, matched with the current price matrix
+        if self.prices is None:
+            self.load()
+        key = (index.table.version, self.source_key)
+        entry = self.versions.get(key)
+        if entry is None:
+            rows = match_rows(index.table, self.meta, os.path.join(self.data_dir, jd.STATES_FILE))
+            matched = rows >= 0
+            extra = {}
+            for name, values in self.row_trends.items():
+                extra[name] = np.full(len(rows), np.nan)
+                extra[name][matched] = values[rows[matched]]
+            entry = self.versions[key] = (index.with_attributes(extra), rows, self.prices, self.meta)
+            while len(self.versions) > KEEP_VERSIONS:
+                del self.versions[next(iter(self.versions))]
+        return entry
+
+    def get(self, index):
+        '''
+        This function returns the search index with the TRENDS added as attributes (see CityIndex.with_attributes()).
+
+        Parameters:
+        index (CityIndex): the index of the current dataset
+
+        Returns:
+        index (CityIndex): the same index, that can also be searched on the trends
+        '''
+        with self.lock:
+            return self.entry(index)[0]
+
+    def history(self, index, position):
+        '''
+        This function returns the monthly prices of one city of the table.
+
+        Returns:
+        months (list): the months, oldest first
+        prices (list): the price of every month (None where there is none), or None if the city has no price history
+        '''
+        # the rows and the matrix come from the same entry, matched with the table of this index
+        with self.lock:
+            _, rows, prices, meta = self.entry(index)
+        row = rows[position]
+        if row < 0:
+            return meta['months'], None
+        return meta['months'], [None if np.isnan(price) else float(price) for price in prices[row]]
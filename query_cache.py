@@ -0,0 +1,180 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+# Notes on the approach
+# The data only changes when it is rebuilt, and there are only so many different searches people make,
+# so the answer to a search (the rendered results page, or a page of the json API) is kept and reused.
+# Entries are keyed by the normalized parameters of the search and by the version of the table they were built from:
+# once the data is rebuilt (a table with a new version), the old entries can never be found again. Nothing is cleared
+# when the version changes: while a new version is swapped in, searches on the old one may still be running, and
+# with several workers each one changes version at its own time (so one clearing a shared backend would throw away
+# what the others just built). The old entries are pushed out (least recently used) or expire instead.
+# The entries live in a backend. LocalBackend keeps them in this process (least recently used ones are dropped first,
+# and every entry expires after a while). With several web workers, a shared backend (e.g. redis, see RedisBackend)
+# lets every worker reuse what the others have built. Both have the same get / set / clear functions,
+# so either one can stand in for the other.
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL = 10 * 60
+KEY_PREFIX = 'city_search:'
+
+
+class LocalBackend:
+    '''
+    This class stores cache entries in memory, in this process only.
+    '''
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        This function returns the value stored under a key, or None if there is none or it has expired.
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        '''
+        This function stores a value under a key, for ttl seconds (or until it is pushed out, if ttl is None).
+        '''
+        expires = None if ttl is None else time.monotonic() + ttl
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class RedisBackend:
+    '''
+    This class stores cache entries in a redis server, shared by all the web workers.
+    The redis package is only needed when this backend is used.
+    '''
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self.client.get(KEY_PREFIX + key)
+        return None if value is None else value.decode('utf-8')
+
+    def set(self, key, value, ttl=None):
+        self.client.set(KEY_PREFIX + key, value.encode('utf-8'), ex=None if ttl is None else int(ttl))
+
+    def clear(self):
+        # entries of older versions are never asked for again, and expire on their own
+        pass
+
+    def __len__(self):
+        # only the entries of this cache, the redis database may hold other keys
+        return sum(1 for _ in self.client.scan_iter(match=KEY_PREFIX + '*', count=1000))
+
+
+def make_backend(url=None, max_entries=DEFAULT_MAX_ENTRIES):
+    '''
+    This function returns the backend for a url: a RedisBackend for redis:// urls, and a LocalBackend otherwise.
+    '''
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(url)
+    return LocalBackend(max_entries)
+
+
+class QueryCache:
+    '''
+    This class keeps the answers to searches (as strings), for the current version of the data.
+    '''
+    def __init__(self, backend=None, ttl=DEFAULT_TTL):
+        self.backend = backend if backend is not None else LocalBackend()
+        self.ttl = ttl
+        self.version = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def make_key(self, namespace, params, version):
+        '''
+        This function returns the cache key of a search.
+
+        Parameters:
+        namespace (str): which kind of answer it is (e.g. 'html' or 'api')
+        params: the normalized parameters of the search (anything json can write, the same search must give the same value)
+        version (str): version of the table the answer is built from
+
+        Returns:
+        key (str): the cache key
+        '''
+        return namespace + ':' + version + ':' + json.dumps(params, sort_keys=True, separators=(',', ':'))
+
+    def check_version(self, version):
+        '''
+        This function counts the times the data has been rebuilt since the last search.
+        The entries of the older version are not cleared (see the notes at the top), the version in their key is enough.
+        '''
+        with self.lock:
+            if self.version == version:
+                return
+            if self.version is not None:
+                self.invalidations += 1
+            self.version = version
+
+    def get_or_build(self, namespace, params, version, build):
+        '''
+        This function returns the answer to a search, from the cache if possible.
+
+        Parameters:
+        namespace (str): see make_key()
+        params: see make_key()
+        version (str): see make_key()
+        build (function): called without arguments on a cache miss, returns the answer as a string
+
+        Returns:
+        answer (str): the answer
+        '''
+        self.check_version(version)
+        key = self.make_key(namespace, params, version)
+        value = self.backend.get(key)
+        with self.lock:
+            if value is not None:
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        # build outside the lock, so that other searches are not kept waiting
+        value = build()
+        self.backend.set(key, value, self.ttl)
+        return value
+
+    def stats(self):
+        '''
+        This function returns the hit / miss counts of the cache.
+        '''
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'version': self.version,
+                'entries': len(self.backend),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / requests, 4) if requests else None,
+                'invalidations': self.invalidations,
+            }
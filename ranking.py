@@ -0,0 +1,164 @@
+import threading
+import numpy as np
+
+# Notes on the approach
+# A ranked search gives every city a score between 0 and 1: how close each of its attributes is to the ideal value
+# the user asked for (e.g. the lowest price, or a winter low of 45 degrees), weighted by how much the user cares
+# about that attribute. The utility of one attribute is 1 at the ideal value and falls linearly to 0 at one 'scale'
+# away from it, where the scale is the spread of the attribute over all the cities (5th to 95th percentile),
+# so that a price difference and a temperature difference count on the same footing.
+# Soft constraints (e.g. 'preferably under 400k') do not remove the cities outside of them, but take points off
+# their score, in proportion to how far outside they are (a whole scale outside costs SOFT_PENALTY).
+# Every score is computed in one vectorized pass over the cities left by the (hard) ranges, and only the top k
+# are put in order (np.argpartition).
+# The ideal values and scales only depend on the data, so they are computed once per table version
+# (the previous version is kept too, for the ranked searches still running on it while a new one is swapped in).
+
+# the ideal value of every attribute when the user gives a weight but no ideal value:
+# 'min' or 'max' is the lowest or highest value among the cities
+DEFAULT_IDEALS = {
+    'price': 'min',
+    'crime_rate': 'min',
+    'summer_high': 'min',
+    'winter_low': 'max',
+    'population': 'max',
+}
+
+# how much a soft constraint costs when a city is a whole scale outside of it (the score itself is within 0 and 1)
+SOFT_PENALTY = 1.0
+
+# the spread of an attribute is measured between these percentiles, so a few extreme cities do not stretch it
+SCALE_PERCENTILES = (5, 95)
+
+# how many versions of the index the store keeps
+KEEP_VERSIONS = 2
+
+
+def attribute_stats(index):
+    '''
+    This function returns, for every attribute of the index (with any it has on top of city_index.ATTRIBUTES),
+    its lowest and highest values and its scale.
+
+    Parameters:
+    index (CityIndex): the index over the cities
+
+    Returns:
+    stats (dict): {attribute: {'min': float, 'max': float, 'scale': float}}
+    '''
+    stats = {}
+    for attribute, values in index.values.items():
+        known = values[~np.isnan(values)]
+        if len(known) == 0:
+            stats[attribute] = {'min': 0.0, 'max': 0.0, 'scale': 1.0}
+            continue
+        low, high = np.percentile(known, SCALE_PERCENTILES)
+        scale = float(high - low) if high > low else float(known.max() - known.min()) or 1.0
+        stats[attribute] = {'min': float(known.min()), 'max': float(known.max()), 'scale': scale}
+    return stats
+
+
+def resolve_ideal(ideal, stats):
+    '''
+    This function turns an ideal value ('min', 'max' or a number) into a number.
+    '''
+    if ideal == 'min':
+        return stats['min']
+    if ideal == 'max':
+        return stats['max']
+    return float(ideal)
+
+
+def score_positions(index, positions, criteria, soft=None, stats=None, penalty=SOFT_PENALTY):
+    '''
+    This function computes the score of the cities at some positions.
+
+    Parameters:
+    index (CityIndex): the index over the cities
+    positions (np.ndarray): row positions of the cities to score
+    criteria (dict): {attribute: (weight, ideal)}, the ideal being 'min', 'max' or a number
+    soft (dict): {attribute: (low, high)}, soft constraints (either bound can be None)
+    stats (dict): see attribute_stats() (computed if not given)
+    penalty (float): cost of being a whole scale outside of a soft constraint
+
+    Returns:
+    scores (np.ndarray): the score of every city, in the order of positions
+    '''
+    stats = stats or attribute_stats(index)
+    scores = np.zeros(len(positions), dtype=np.float64)
+    total_weight = sum(weight for weight, _ in criteria.values())
+    for attribute, (weight, ideal) in criteria.items():
+        if weight == 0:
+            continue
+        values = index.values[attribute][positions]
+        distance = np.abs(values - resolve_ideal(ideal, stats[attribute])) / stats[attribute]['scale']
+        # a missing value is as far from the ideal as it can be
+        utility = 1 - np.minimum(np.nan_to_num(distance, nan=1.0), 1)
+        scores += weight * utility
+    if total_weight > 0:
+        scores /= total_weight
+
+    for attribute, (low, high) in (soft or {}).items():
+        values = index.values[attribute][positions]
+        outside = np.zeros(len(positions), dtype=np.float64)
+        if low is not None:
+            outside += np.maximum(low - values, 0)
+        if high is not None:
+            outside += np.maximum(values - high, 0)
+        # a missing value counts as being a whole scale outside
+        outside = np.nan_to_num(outside / stats[attribute]['scale'], nan=1.0)
+        scores -= penalty * np.minimum(outside, 1)
+    return scores
+
+
+def rank_positions(index, criteria, ranges=None, soft=None, k=None, stats=None, penalty=SOFT_PENALTY):
+    '''
+    This function returns the k best scoring cities that match all the ranges.
+
+    Parameters:
+    index (CityIndex): the index over the cities
+    criteria (dict): {attribute: (weight, ideal)}, see score_positions()
+    ranges (dict): {attribute: (low, high)}, hard constraints (see CityIndex.query_positions())
+    soft (dict): {attribute: (low, high)}, soft constraints
+    k (int): how many cities to return (all of them if None)
+    stats (dict): see attribute_stats() (computed if not given)
+    penalty (float): see score_positions()
+
+    Returns:
+    positions (np.ndarray): row positions of the cities, best first
+    scores (np.ndarray): the score of each of them
+    count (int): how many cities matched the ranges
+    '''
+    positions = index.query_positions(ranges)
+    scores = score_positions(index, positions, criteria, soft, stats, penalty)
+    count = len(positions)
+    if k is not None and k < count:
+        top = np.argpartition(-scores, k - 1)[:k] if k > 0 else np.empty(0, dtype=np.int64)
+        positions, scores = positions[top], scores[top]
+    # best score first, and cities with the same score in the order of the table
+    order = np.lexsort((positions, -scores))
+    return positions[order], scores[order], count
+
+
+class RankingStore:
+    '''
+    This class keeps the attribute statistics of the ranking (see attribute_stats()) for the last KEEP_VERSIONS
+    versions of the index, and computes them only for a version it does not have.
+    '''
+    def __init__(self):
+        # {(table version, attributes): stats}, oldest first
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def get(self, index):
+        '''
+        This function returns the attribute statistics of an index.
+        '''
+        with self.lock:
+            # an index with more attributes (e.g. the price trends) over the same table has more statistics
+            version = (index.table.version, tuple(index.values))
+            stats = self.stats.get(version)
+            if stats is None:
+                stats = self.stats[version] = attribute_stats(index)
+                while len(self.stats) > KEEP_VERSIONS:
+                    del self.stats[next(iter(self.stats))]
+            return stats
@@ -0,0 +1,296 @@
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # windows has no fcntl (and the web app runs in a single process there)
+    fcntl = None
+
+# Import other files
+import get_cities_v2 as gci
+import get_crime_data as gcr
+import get_house_prices as ghp
+import city_table as ct
+import cache_store as cs
+import index_snapshot as snap
+import dataset as ds
+from instrumentation import span
+
+# Notes on the approach
+# A refresh brings the loaded data up to date without building everything again:
+# - cities: the list of cities from geonamescache is compared with the cities cache. Only the new cities are
+#   located (zipcode index) and get weather data. Cities that are gone are dropped, and changed populations updated.
+#   (Cities that had no weather data last time are not in the cache, so they are tried again. Their weather stations
+#   are cached on disk, so this is cheap.)
+# - crime: every state's API response is cached on disk for gcr.CACHE_TTL, so only the states whose response
+#   has expired are downloaded again.
+# - house prices: read again from the source csv file (or its binary snapshot, if the file did not change).
+# The three caches are joined as usual, and the result is compared with the loaded table, city by city.
+# Only the deleted, changed and new cities are applied to the table and merged into the search index
+# (see CityTable.apply_changes() and CityIndex.apply_changes()). The result is a new Dataset, built next to the old
+# one, which the web app swaps in when it is ready (see dataset.DatasetHolder). Searches use the old data until then.
+#
+# With several web worker processes, only one of them refreshes: the first one to take a lock on REFRESH_LOCK_FILE
+# (in the cache folder) keeps it for as long as it runs. The others never download or write anything: they watch the
+# snapshot file, and load it when it holds a table with another version than theirs (the table version comes from
+# the sources, see index_snapshot.table_version(), so every worker ends up with the same version).
+# A refresh itself (including `--refresh` from the command line) also holds REFRESH_RUN_LOCK_FILE while it runs,
+# so two processes never rewrite the caches at the same time.
+
+# settings of the cities cache that change the weather data of every city (the whole cache is built again if they change)
+WEATHER_SETTINGS = ('min_population', 'seasons', 'season_years')
+
+# the process that holds a lock on this file is the one that refreshes the data periodically
+REFRESH_LOCK_FILE = 'refresh.lock'
+# held by the process that is refreshing the data right now
+REFRESH_RUN_LOCK_FILE = 'refresh_run.lock'
+
+_REFRESH_LOCK = threading.Lock()
+
+
+def lock_file(file_name, blocking=True):
+    '''
+    This function takes an exclusive lock on a file (created if missing), shared by every process on the machine.
+
+    Parameters:
+    file_name (str): the lock file
+    blocking (bool): wait for the lock if another process holds it
+
+    Returns:
+    file_obj (file): the open lock file, which holds the lock until it is closed, or None if the lock is taken
+    '''
+    file_obj = open(file_name, 'a')
+    if fcntl is None:
+        return file_obj
+    try:
+        fcntl.flock(file_obj.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        file_obj.close()
+        return None
+    return file_obj
+
+
+def city_key(record):
+    '''
+    This function returns the key that identifies a city across the data sources: its name and coordinates.
+    '''
+    return (record['name'], round(float(record['latitude']), 4), round(float(record['longitude']), 4))
+
+
+def refresh_cities(config, weather_source=None):
+    '''
+    This function brings the cities cache up to date with the geonamescache library, see the notes at the top.
+
+    Parameters:
+    config (dict): the settings, see config.get_config()
+    weather_source (MeteostatSource): where to get the weather data from (optional)
+
+    Returns:
+    rows (list): rows of the cities cache
+    changes (dict): how many cities were added, removed and updated
+    '''
+    cache_dir = config['CACHE_DIR']
+    file_name = os.path.join(cache_dir, ds.CITIES_CACHE_FILE)
+    sources = ds.cities_sources()
+    old_rows, old_sources = cs.read_previous_cache(file_name)
+
+    if old_rows is None or any(old_sources.get(setting) != sources.get(setting) for setting in WEATHER_SETTINGS):
+        print('\nThe cities cache is missing or was built with other weather settings. Building it again...')
+        rows = gci.get_cities(ds.LOWEST_MIN_POPULATION, weather_source, cache_dir=cache_dir)
+        changes = {'added': len(rows), 'removed': len(old_rows or []), 'updated': 0}
+    else:
+        old_by_key = {city_key(row): row for row in old_rows}
+        rows, new_cities, updated = [], [], 0
+        for city in gci.list_cities(ds.LOWEST_MIN_POPULATION):
+            row = old_by_key.pop(city_key(city), None)
+            if row is None:
+                new_cities.append(city)
+                continue
+            if int(float(row['population'])) != int(city['population']):
+                row = dict(row, population=city['population'])
+                updated += 1
+            rows.append(row)
+        print('\n' + str(len(new_cities)) + ' cities are not in the cache yet, and ' + str(len(old_by_key)) + ' cities are gone.')
+        added = gci.add_location_and_weather(new_cities, weather_source, cache_dir=cache_dir)
+        rows.extend(added)
+        changes = {'added': len(added), 'removed': len(old_by_key), 'updated': updated}
+
+    if changes['added'] or changes['removed'] or changes['updated'] or old_sources != sources:
+        ds.write_cities_chache(file_name, rows, sources)
+    return rows, changes
+
+
+def refresh_crime(config, client=None):
+    '''
+    This function brings the crime cache up to date (only the states whose API response expired are downloaded).
+
+    Returns:
+    rows (list): rows of the crime cache
+    changed_states (list): the states whose crime rate changed
+    '''
+    cache_dir = config['CACHE_DIR']
+    file_name = os.path.join(cache_dir, ds.CRIME_CACHE_FILE)
+    old_rows, _ = cs.read_previous_cache(file_name)
+    old_rates = {row['state']: float(row['crime rate']) for row in old_rows or []}
+
+    if client is None:
+        client = gcr.CrimeClient(cache_dir=os.path.join(cache_dir, gcr.CACHE_DIR))
+    rows = gcr.get_data(client, data_dir=config['DATA_DIR'])
+    changed_states = [row['state'] for row in rows if old_rates.get(row['state']) != float(row['crime rate'])]
+
+    if changed_states or old_rows is None:
+        ds.write_crime_chache(file_name, rows, ds.crime_sources(config['DATA_DIR']))
+    return rows, changed_states
+
+
+def refresh_house_prices(config):
+    '''
+    This function brings the house prices cache up to date with the source csv file.
+
+    Returns:
+    rows (list): rows of the house prices cache
+    changed (int): how many cities have a new (or no longer have a) house price
+    '''
+    file_name = os.path.join(config['CACHE_DIR'], ds.HOUSE_PRICES_CACHE_FILE)
+    old_rows, old_sources = cs.read_previous_cache(file_name)
+    sources = ds.house_prices_sources(config['DATA_DIR'])
+    if old_rows is not None and old_sources == sources:
+        return old_rows, 0
+
+    rows = ghp.get_data(source_file=ghp.resolve_source_file(os.path.join(config['DATA_DIR'], ghp.SOURCE_FILE)), snapshot_dir=config['CACHE_DIR'])
+    old_prices = {(row['City'], row['State']): str(row['Price']) for row in old_rows or []}
+    new_prices = {(row['City'], row['State']): str(row['Price']) for row in rows}
+    changed = len(set(old_prices.items()) ^ set(new_prices.items()))
+    ds.write_house_prices_chache(file_name, rows, sources)
+    return rows, changed
+
+
+def diff_table(table, records):
+    '''
+    This function compares a table with the records it should now hold, city by city.
+
+    Parameters:
+    table (CityTable): the loaded table
+    records (list): list of dictionaries with the COLUMNS as keys
+
+    Returns:
+    deleted (list): positions of the cities that are gone
+    updated (dict): {position: record} for the cities that changed
+    inserted (list): records of the new cities
+    '''
+    current = table.to_records()
+    positions = {city_key(row): position for position, row in enumerate(current)}
+    updated, inserted = {}, []
+    for record in records:
+        parsed = {column: ct.plain_value(ct.parse_value(record.get(column), dtype)) for column, dtype in ct.COLUMNS.items()}
+        position = positions.pop(city_key(parsed), None)
+        if position is None:
+            inserted.append(parsed)
+        elif parsed != current[position]:
+            updated[position] = parsed
+    deleted = sorted(positions.values())
+    return deleted, updated, inserted
+
+
+def refresh_dataset(dataset, config, weather_source=None, crime_client=None):
+    '''
+    This function brings the loaded data up to date with the sources, see the notes at the top.
+
+    Parameters:
+    dataset (Dataset): the loaded data (it is not changed)
+    config (dict): the settings, see config.get_config()
+    weather_source (MeteostatSource): where to get the weather data from (optional)
+    crime_client (CrimeClient): the client to download the crime data with (optional)
+
+    Returns:
+    dataset (Dataset): the up to date data (the same dataset if nothing changed)
+    summary (dict): what changed in each source and in the table, and how long it took
+    '''
+    with _REFRESH_LOCK, lock_file(os.path.join(config['CACHE_DIR'], REFRESH_RUN_LOCK_FILE)), span('refresh'):
+        start = time.perf_counter()
+        cities_rows, city_changes = refresh_cities(config, weather_source)
+        crime_rows, changed_states = refresh_crime(config, crime_client)
+        price_rows, changed_prices = refresh_house_prices(config)
+
+        cities, match_stats = ds.join_sources(cities_rows, crime_rows, price_rows, config)
+        deleted, updated, inserted = diff_table(dataset.table, [city.__dict__ for city in cities])
+        summary = {
+            'cities': city_changes,
+            'crime states changed': len(changed_states),
+            'house prices changed': changed_prices,
+            'deleted': len(deleted),
+            'updated': len(updated),
+            'inserted': len(inserted),
+        }
+
+        checksum = snap.sources_checksum(ds.dataset_sources(config))
+        if deleted or updated or inserted:
+            table, position_map, changed = dataset.table.apply_changes(deleted, updated, inserted, snap.table_version(checksum))
+            index = dataset.index.apply_changes(table, position_map, changed)
+            dataset = ds.Dataset(table, index, match_stats)
+        # the caches may have changed even if the table did not, so the snapshot is written again in both cases
+        snap.write_snapshot(os.path.join(config['CACHE_DIR'], snap.SNAPSHOT_FILE), dataset.table, dataset.index,
+                            checksum, dataset.match_stats)
+
+        summary['seconds'] = round(time.perf_counter() - start, 3)
+        print('\nRefreshed the data: ' + str(len(deleted)) + ' cities deleted, ' + str(len(updated)) + ' updated, '
+              + str(len(inserted)) + ' added (' + str(summary['seconds']) + ' seconds).')
+        return dataset, summary
+
+
+def reload_snapshot(holder, config):
+    '''
+    This function swaps in the data of the snapshot file (written by the process that refreshes),
+    if it holds another version of the table than the loaded one.
+
+    Returns:
+    reloaded (bool): whether a new dataset was swapped in
+    '''
+    snapshot_file = os.path.join(config['CACHE_DIR'], snap.SNAPSHOT_FILE)
+    try:
+        header, _ = snap.read_header(snapshot_file)
+    except (OSError, ValueError):
+        return False
+    if header.get('table_version') == holder.get().table.version:
+        return False
+    table, index, header = snap.load_snapshot(snapshot_file)
+    if table is None:
+        return False
+    holder.reload(lambda: ds.Dataset(table, index, header['match_stats']))
+    print('\nLoaded the refreshed data of another process (table version ' + table.version + ').')
+    return True
+
+
+def start_background_refresh(holder, config, interval, weather_source=None, crime_client=None):
+    '''
+    This function keeps the data up to date on a background thread, every interval seconds, while the app keeps serving.
+    Only the process that holds the lock on REFRESH_LOCK_FILE refreshes the data from the sources; the thread of every
+    other process loads the snapshot that refresh writes (see the notes at the top).
+    Each new dataset is swapped into the holder (a dataset.DatasetHolder), through DatasetHolder.reload(),
+    so it is prepared like any other dataset first.
+    The thread only updates the data of the process it was started in (a forked process does not have it).
+
+    Returns:
+    thread (threading.Thread): the background thread (a daemon, so it never keeps the process alive)
+    '''
+    def refresh_forever():
+        # the lock on REFRESH_LOCK_FILE, once this process has it (it is never released while the process runs)
+        leader = None
+        while True:
+            time.sleep(interval)
+            try:
+                if leader is None:
+                    leader = lock_file(os.path.join(config['CACHE_DIR'], REFRESH_LOCK_FILE), blocking=False)
+                if leader is not None:
+                    holder.reload(lambda: refresh_dataset(holder.get(), config, weather_source, crime_client)[0])
+                else:
+                    reload_snapshot(holder, config)
+            except Exception as error:
+                # a failed refresh keeps the current data, and is tried again next time
+                print('\nThe data refresh failed: ' + repr(error))
+
+    thread = threading.Thread(target=refresh_forever, name='dataset-refresh', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,431 @@
+import base64
+import json
+import math
+import numpy as np
+
+import city_index as ci
+import search_functions as sf
+import similarity as sim
+import ranking as rk
+import price_trends as pt
+
+# Query parameters of the /api/search endpoint
+#   min_<attribute>, max_<attribute>   a range on any of the attributes in city_index.ATTRIBUTES (min inclusive, max exclusive)
+#                                      or, in the web app, on the price trends of price_trends.TRENDS
+#                                      e.g. min_price=250000&max_price=350000&max_summer_high=95&min_price_cagr=0.03
+#   bucket                             a bucket label of the search form (see search_functions.BUCKET_PRESETS), can be repeated
+#   sort                               attribute to order by, with a leading '-' for highest first (e.g. sort=-population)
+#   limit                              number of results per page (default DEFAULT_PAGE_SIZE, at most MAX_PAGE_SIZE)
+#   cursor                             the next_cursor of the previous page
+#   format                             'json' (default) for one page, or 'ndjson' to stream every result, one json object per line
+#
+# The /api/nearby endpoint takes the same ranges and buckets, and a location:
+#   near, state                        the name of a city in the data (and its state, if the name is ambiguous)
+#   lat, long                          or a latitude and longitude, in degrees
+#   radius                             only the cities within this many miles
+#   k                                  only the k closest cities (DEFAULT_PAGE_SIZE if there is no radius either)
+#   limit                              number of results to return (default DEFAULT_PAGE_SIZE, at most MAX_PAGE_SIZE;
+#                                      the count is of every city within the radius)
+# and returns the cities closest first, with their distance in miles.
+#
+# The /api/similar endpoint (and the /similar page) finds the cities most like one city:
+#   name, state                        the city (its state, if the name is ambiguous)
+#   k                                  how many cities (default similarity.DEFAULT_K, at most similarity.MAX_K)
+#   w_<feature>                        weight of a feature of similarity.FEATURES (default 1, 0 to ignore it)
+#                                      e.g. w_price=2&w_population=0
+#
+# The /api/rank endpoint takes the same ranges and buckets (which every result must match), and ranks the cities
+# by how well they fit (see ranking.py):
+#   w_<attribute>                      how much an attribute matters (0 to ignore it; every attribute counts 1 if no
+#                                      weight and no ideal value is given at all)
+#   ideal_<attribute>                  the ideal value, a number or 'min' / 'max' (default ranking.DEFAULT_IDEALS)
+#   soft_min_<attribute>, soft_max_<attribute>
+#                                      soft constraints: cities outside them are kept, but lose points
+#   penalty                            how many points being far outside a soft constraint costs (default ranking.SOFT_PENALTY)
+#   limit                              number of results (default DEFAULT_PAGE_SIZE, at most MAX_PAGE_SIZE)
+#                                      e.g. w_price=3&w_winter_low=2&ideal_winter_low=45&soft_max_crime_rate=0.02
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+KM_PER_MILE = 1.609344
+
+# the ideal value of every attribute that can be ranked on, when none is given (see ranking.py)
+IDEALS = dict(rk.DEFAULT_IDEALS, **pt.DEFAULT_IDEALS)
+
+
+class SearchError(ValueError):
+    '''
+    This class is raised for query parameters that cannot be understood (the endpoint answers with a 400 error).
+    '''
+    pass
+
+
+def parse_number(args, name):
+    '''
+    This function returns a query parameter as a number, or None if it is not given.
+    Infinity and NaN are not numbers a search can use (float() would accept 'inf' and 'nan').
+    '''
+    value = args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        raise SearchError(name + ' must be a number') from None
+    if not math.isfinite(number):
+        raise SearchError(name + ' must be a finite number')
+    return number
+
+
+def parse_search_args(args, attributes=ci.ATTRIBUTES):
+    '''
+    This function turns the query parameters of a request into arguments for CityIndex.query_positions().
+
+    Parameters:
+    args (MultiDict): the query parameters (request.args)
+    attributes: the attributes that can be searched on (the values of the index, e.g. with the price trends)
+
+    Returns:
+    ranges (dict): {attribute: (low, high)}
+    sort_by (str): attribute to order by, or None
+    descending (bool): order from highest to lowest
+    '''
+    try:
+        ranges = sf.presets_to_ranges(args.getlist('bucket'))
+    except ValueError as error:
+        raise SearchError(str(error)) from None
+
+    for attribute in attributes:
+        low = parse_number(args, 'min_' + attribute)
+        high = parse_number(args, 'max_' + attribute)
+        if low is not None or high is not None:
+            # an explicit range narrows down a bucket on the same attribute
+            bucket_low, bucket_high = ranges.get(attribute, (None, None))
+            if bucket_low is not None and (low is None or bucket_low > low):
+                low = bucket_low
+            if bucket_high is not None and (high is None or bucket_high < high):
+                high = bucket_high
+            ranges[attribute] = (low, high)
+
+    sort = args.get('sort') or None
+    descending = False
+    if sort is not None:
+        descending = sort.startswith('-')
+        sort = sort.lstrip('-')
+        if sort not in attributes:
+            raise SearchError('cannot sort by ' + sort)
+    return ranges, sort, descending
+
+
+def parse_limit(args):
+    '''
+    This function returns the page size asked for, within 1 and MAX_PAGE_SIZE.
+    '''
+    limit = parse_number(args, 'limit')
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+
+def normalized_query(args, attributes=ci.ATTRIBUTES):
+    '''
+    This function returns the parameters of a search in one canonical form (e.g. to use as a cache key),
+    so that searches that mean the same thing (parameters in another order, 250000 or 250000.0, ...) are the same.
+    '''
+    ranges, sort_by, descending = parse_search_args(args, attributes)
+    return {
+        'ranges': sorted([attribute, low, high] for attribute, (low, high) in ranges.items()),
+        'sort': sort_by,
+        'descending': descending,
+        'limit': parse_limit(args),
+        'cursor': args.get('cursor') or None,
+    }
+
+
+def result_dicts(index, positions):
+    '''
+    This function returns the cities at some positions as dictionaries, with the attributes the index has on top of
+    the columns of the table (e.g. the price trends), rounded.
+    '''
+    extra = [attribute for attribute in index.values if attribute not in ci.ATTRIBUTES]
+    results = []
+    for row in index.table.rows(positions):
+        result = row.to_dict()
+        for attribute in extra:
+            value = index.values[attribute][row.position]
+            result[attribute] = None if np.isnan(value) else round(float(value), 4)
+        results.append(result)
+    return results
+
+
+def find_city(table, name, state=None):
+    '''
+    This function returns the position of the city with a given name (and state), ignoring case.
+    When several cities have the name, the one with the largest population is picked.
+    '''
+    found = np.char.lower(table.column('name').astype(str)) == name.strip().lower()
+    if state:
+        found &= np.char.lower(table.column('state').astype(str)) == state.strip().lower()
+    matches = np.flatnonzero(found)
+    if len(matches) == 0:
+        raise SearchError('unknown city ' + name + (', ' + state if state else ''))
+    return int(matches[np.argmax(table.column('population')[matches])])
+
+
+def parse_location(args, table):
+    '''
+    This function returns the location a search by distance is around: a city of the table (near=...)
+    or a latitude and longitude (lat=...&long=...).
+
+    Returns:
+    lat (float): latitude in degrees
+    long (float): longitude in degrees
+    origin (dict): the location, as given back in the results
+    '''
+    if args.get('near'):
+        row = table[find_city(table, args.get('near'), args.get('state'))]
+        return row.latitude, row.longitude, {'name': row.name, 'state': row.state, 'latitude': row.latitude, 'longitude': row.longitude}
+    lat = parse_number(args, 'lat')
+    long = parse_number(args, 'long')
+    if lat is None or long is None:
+        raise SearchError('give either near=<city> or both lat and long')
+    if not -90 <= lat <= 90 or not -180 <= long <= 180:
+        raise SearchError('lat must be within -90 and 90, and long within -180 and 180')
+    return lat, long, {'latitude': lat, 'longitude': long}
+
+
+def parse_nearby_args(args):
+    '''
+    This function returns the radius (in miles) and the number of closest cities of a search by distance.
+    '''
+    radius = parse_number(args, 'radius')
+    if radius is not None and radius < 0:
+        raise SearchError('radius must not be negative')
+    k = parse_number(args, 'k')
+    if k is not None:
+        k = max(1, min(int(k), MAX_PAGE_SIZE))
+    elif radius is None:
+        k = DEFAULT_PAGE_SIZE
+    return radius, k
+
+
+def normalized_nearby_query(args, attributes=ci.ATTRIBUTES):
+    '''
+    This function returns the parameters of a search by distance in one canonical form (see normalized_query()).
+    '''
+    query = normalized_query(args, attributes)
+    radius, k = parse_nearby_args(args)
+    query.update({'near': (args.get('near') or '').strip().lower() or None, 'state': (args.get('state') or '').strip().lower() or None,
+                  'lat': parse_number(args, 'lat'), 'long': parse_number(args, 'long'), 'radius': radius, 'k': k})
+    return query
+
+
+def nearby(index, args):
+    '''
+    This function answers a search by distance: the cities closest to a location that match all the ranges.
+
+    Parameters:
+    index (CityIndex): the index over the cities
+    args (MultiDict): the query parameters (see the notes at the top)
+
+    Returns:
+    results (dict): the location, the number of cities found, and the closest ones (with their distance in miles)
+    '''
+    ranges, _, _ = parse_search_args(args, index.values)
+    radius, k = parse_nearby_args(args)
+    lat, long, origin = parse_location(args, index.table)
+    positions, distances = index.near_positions(lat, long, None if radius is None else radius * KM_PER_MILE, k, ranges)
+    # a radius alone can take in thousands of cities: only a page of them is returned, like /api/search
+    limit = parse_limit(args)
+    results = result_dicts(index, positions[:limit])
+    for result, distance in zip(results, distances[:limit]):
+        result['distance_miles'] = round(float(distance) / KM_PER_MILE, 2)
+    return {'origin': origin, 'count': int(len(positions)), 'results': results}
+
+
+def parse_similar_args(args):
+    '''
+    This function returns the number of cities and the feature weights of a similarity search.
+
+    Returns:
+    k (int): how many cities to find
+    weights (dict): {feature name: weight}, only for the features given
+    '''
+    k = parse_number(args, 'k')
+    k = sim.DEFAULT_K if k is None else max(1, min(int(k), sim.MAX_K))
+    weights = {}
+    for name in sim.FEATURES:
+        weight = parse_number(args, 'w_' + name)
+        if weight is not None:
+            if weight < 0:
+                raise SearchError('w_' + name + ' must not be negative')
+            weights[name] = weight
+    return k, weights
+
+
+def normalized_similar_query(args):
+    '''
+    This function returns the parameters of a similarity search in one canonical form (see normalized_query()).
+    '''
+    k, weights = parse_similar_args(args)
+    return {'name': (args.get('name') or '').strip().lower(), 'state': (args.get('state') or '').strip().lower() or None,
+            'k': k, 'weights': sorted([name, weight] for name, weight in weights.items() if weight != 1)}
+
+
+def similar(table, matrix, args):
+    '''
+    This function answers a similarity search: the cities most like one city.
+
+    Parameters:
+    table (CityTable): the table of cities
+    matrix (np.ndarray): the standardized matrix of the table (see similarity.SimilarityStore)
+    args (MultiDict): the query parameters (see the notes at the top)
+
+    Returns:
+    results (dict): the city, the weights used, and the most similar cities (with their distance, 0 being identical)
+    '''
+    if not args.get('name'):
+        raise SearchError('name is missing')
+    k, weights = parse_similar_args(args)
+    position = find_city(table, args.get('name'), args.get('state'))
+    positions, distances = sim.similar_positions(matrix, position, k, weights)
+    results = []
+    for row, distance in zip(table.rows(positions), distances):
+        result = row.to_dict()
+        result['distance'] = round(float(distance), 4)
+        results.append(result)
+    return {'city': table[position].to_dict(), 'weights': dict(zip(sim.FEATURES, sim.weight_vector(weights).tolist())),
+            'results': results}
+
+
+def parse_ranking_args(args, attributes=ci.ATTRIBUTES):
+    '''
+    This function returns the criteria, soft constraints and penalty of a ranked search.
+    Only the given attributes can be ranked on (the values of the index, e.g. with the price trends).
+
+    Returns:
+    criteria (dict): {attribute: (weight, ideal)}
+    soft (dict): {attribute: (low, high)}
+    penalty (float): cost of being far outside a soft constraint
+    '''
+    criteria = {}
+    for attribute in attributes:
+        weight = parse_number(args, 'w_' + attribute)
+        ideal = args.get('ideal_' + attribute) or None
+        if ideal is not None and ideal not in ('min', 'max'):
+            ideal = parse_number(args, 'ideal_' + attribute)
+        if weight is not None and weight < 0:
+            raise SearchError('w_' + attribute + ' must not be negative')
+        if weight is not None or ideal is not None:
+            criteria[attribute] = (1.0 if weight is None else weight, IDEALS.get(attribute, 'max') if ideal is None else ideal)
+    if not criteria:
+        criteria = {attribute: (1.0, ideal) for attribute, ideal in rk.DEFAULT_IDEALS.items()}
+
+    soft = {}
+    for attribute in attributes:
+        low = parse_number(args, 'soft_min_' + attribute)
+        high = parse_number(args, 'soft_max_' + attribute)
+        if low is not None or high is not None:
+            soft[attribute] = (low, high)
+    penalty = parse_number(args, 'penalty')
+    return criteria, soft, rk.SOFT_PENALTY if penalty is None else penalty
+
+
+def normalized_ranking_query(args, attributes=ci.ATTRIBUTES):
+    '''
+    This function returns the parameters of a ranked search in one canonical form (see normalized_query()).
+    '''
+    query = normalized_query(args, attributes)
+    criteria, soft, penalty = parse_ranking_args(args, attributes)
+    query.update({'criteria': sorted([attribute, weight, ideal] for attribute, (weight, ideal) in criteria.items()),
+                  'soft': sorted([attribute, low, high] for attribute, (low, high) in soft.items()), 'penalty': penalty})
+    return query
+
+
+def rank(index, stats, args, limit=None):
+    '''
+    This function answers a ranked search: the cities that match all the ranges, best score first.
+
+    Parameters:
+    index (CityIndex): the index over the cities
+    stats (dict): the attribute statistics of the ranking (see ranking.RankingStore)
+    args (MultiDict): the query parameters (see the notes at the top)
+    limit (int): number of results (from the limit parameter if not given)
+
+    Returns:
+    results (dict): the number of cities that match the ranges, and the best ones (with their score)
+    '''
+    ranges, _, _ = parse_search_args(args, index.values)
+    criteria, soft, penalty = parse_ranking_args(args, index.values)
+    positions, scores, count = rk.rank_positions(index, criteria, ranges, soft, limit or parse_limit(args), stats, penalty)
+    results = result_dicts(index, positions)
+    for result, score in zip(results, scores):
+        result['score'] = round(float(score), 4)
+    return {'count': int(count), 'results': results}
+
+
+def encode_cursor(version, offset):
+    '''
+    This function returns an opaque cursor that points at a position in the results of one table version.
+    '''
+    return base64.urlsafe_b64encode(json.dumps({'v': version, 'o': offset}).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, version):
+    '''
+    This function returns the position a cursor points at.
+    A cursor from another version of the table is refused, since the results it points into are gone.
+    '''
+    if not cursor:
+        return 0
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        offset = int(data['o'])
+    except (ValueError, KeyError, TypeError):
+        raise SearchError('invalid cursor') from None
+    if data.get('v') != version:
+        raise SearchError('the data has been updated since this cursor was made, please start the search again')
+    return max(offset, 0)
+
+
+def search_page(index, args):
+    '''
+    This function answers one page of a search.
+
+    Parameters:
+    index (CityIndex): the index over the cities
+    args (MultiDict): the query parameters
+
+    Returns:
+    page (dict): the total count, the results on this page, and the cursor of the next page (or None)
+    '''
+    ranges, sort_by, descending = parse_search_args(args, index.values)
+    limit = parse_limit(args)
+    offset = decode_cursor(args.get('cursor'), index.table.version)
+
+    # the count needs every match, but only the rows up to the end of this page need to be put in order (top-k)
+    count = len(index.query_positions(ranges))
+    page = index.query_positions(ranges, sort_by, descending, limit=offset + limit)[offset:]
+    next_offset = offset + len(page)
+    return {
+        'count': int(count),
+        'results': result_dicts(index, page),
+        'next_cursor': encode_cursor(index.table.version, next_offset) if next_offset < count else None,
+    }
+
+
+def search_stream(index, args, chunk_size=500):
+    '''
+    This function answers a search as newline-delimited json: one city per line, starting at the cursor (if any).
+    The lines are produced a chunk at a time, so large results are never held in memory as one big string.
+
+    Yields:
+    lines (str): a chunk of lines
+    '''
+    ranges, sort_by, descending = parse_search_args(args, index.values)
+    offset = decode_cursor(args.get('cursor'), index.table.version)
+    positions = index.query_positions(ranges, sort_by, descending)[offset:]
+    for start in range(0, len(positions), chunk_size):
+        results = result_dicts(index, positions[start:start + chunk_size])
+        yield ''.join(json.dumps(result) + '\n' for result in results)
@@ -1,8 +1,25 @@
 from pprint import pprint
 import csv
-import json
 # import pickle
 
+# The bucket labels used by the search form, as ranges over the CityIndex in city_index.py
+# each label is (attribute, lower bound (inclusive), upper bound (exclusive)), None meaning no bound
+BUCKET_PRESETS = {
+    'price below 200k': ('price', None, 200000),
+    'price 200-400k': ('price', 200000, 400000),
+    'price 400-600k': ('price', 400000, 600000),
+    'price above 600k': ('price', 600000, None),
+    'crime rare': ('crime_rate', None, 0.0165),
+    'crime medium': ('crime_rate', 0.0165, 0.025),
+    'crime frequent': ('crime_rate', 0.025, None),
+    'summer temp below 90': ('summer_high', None, 90),
+    'summer temp 90-100': ('summer_high', 90, 100),
+    'summer temp above 100': ('summer_high', 100, None),
+    'winter temp below 40': ('winter_low', None, 40),
+    'winter temp 40-50': ('winter_low', 40, 50),
+    'winter temp above 50': ('winter_low', 50, None),
+}
+
 def make_search_tree(search_tree):
     '''
     This function creates a nested dictionary that represents the search tree.
@@ -49,6 +66,42 @@ def make_search_tree(search_tree):
     print('\nSuccessfully created an empty search tree')
     return search_tree
 
+def presets_to_ranges(bucket_labels):
+    '''
+    This function turns a list of bucket labels (e.g. 'price 200-400k') into ranges for CityIndex.query().
+
+    Parameters:
+    bucket_labels (list): labels from BUCKET_PRESETS
+
+    Returns:
+    ranges (dict): {attribute: (low, high)}
+
+    Raises:
+    ValueError: if a label is not one of BUCKET_PRESETS
+    '''
+    ranges = {}
+    for label in bucket_labels:
+        if label not in BUCKET_PRESETS:
+            raise ValueError('unknown bucket ' + repr(label))
+        attribute, low, high = BUCKET_PRESETS[label]
+        ranges[attribute] = (low, high)
+    return ranges
+
+def search_buckets(city_index, bucket_labels, sort_by=None, descending=False, limit=None):
+    '''
+    This function returns the cities that fall in all the given buckets.
+    It gives the same results as walking the search tree, but works on the CityIndex,
+    so the buckets can be combined with other ranges, ordering and top-k.
+
+    Parameters:
+    city_index (CityIndex): the index over the cities
+    bucket_labels (list): labels from BUCKET_PRESETS, at most one per attribute
+
+    Returns:
+    search_results (list): list of CityRow views
+    '''
+    return city_index.query(presets_to_ranges(bucket_labels), sort_by=sort_by, descending=descending, limit=limit)
+
 def add_city_to_search_tree(city, search_tree):
     '''
     This function adds a city to the search tree.
@@ -140,17 +193,3 @@ def do_sanity_count_check(search_tree):
                 for winter_temp_bucket in summer_temp_bucket.values():
                     count += len(winter_temp_bucket)
     return f'Sanity check: total number of cities in the search tree is {count}'
-
-def write_tree_to_file(search_tree):
-    '''
-    This function writes the search tree to a json file.
-
-    Parameters:
-    search_tree (dict): a nested dictionary that represents the search tree
-
-    Returns:
-    None
-    '''
-    with open('search_tree.json', 'w', encoding='utf-8') as fp:
-        json.dump(search_tree, fp, indent=4, ensure_ascii=False)
-        # pickle.dump(search_tree, fp)  # attempt to write class objects to file
\ No newline at end of file
@@ -0,0 +1,110 @@
+import threading
+import numpy as np
+
+# Notes on the approach
+# "Cities like this one" are the cities closest to it in the space of their numeric attributes.
+# The attributes are on very different scales (prices in the hundreds of thousands, crime rates below 0.1),
+# so every attribute is standardized first (minus its mean, divided by its standard deviation) into one dense matrix,
+# with one row per city. Population is spread over several orders of magnitude, so its logarithm is used instead.
+# A query is then one vectorized pass over the matrix: the weighted squared distance of every city to the chosen one,
+# and np.argpartition to pick the k closest (only those k are sorted).
+# The matrix only depends on the table of cities, so it is computed once per table version and kept until the data changes.
+# The store holds the matrices of the current table and of the one before it, because a search that began before
+# a reload may still ask for the old table after the new one is in.
+
+# the attributes compared, with the CityTable column each one comes from and whether its logarithm is used
+FEATURES = {
+    'price': ('house_price', False),
+    'crime_rate': ('crime_rate', False),
+    'summer_high': ('summer_high_temp', False),
+    'winter_low': ('winter_low_temp', False),
+    'population': ('population', True),
+}
+
+DEFAULT_K = 10
+MAX_K = 100
+
+# how many versions of the table the store keeps
+KEEP_VERSIONS = 2
+
+
+def standardize(table):
+    '''
+    This function stacks the FEATURES of every city into one matrix, standardized column by column.
+    Missing values (NaN) are set to the mean of their column (0 after standardizing), so they do not count either way.
+
+    Parameters:
+    table (CityTable): the table of cities
+
+    Returns:
+    matrix (np.ndarray): an (n, number of FEATURES) matrix
+    '''
+    columns = []
+    for column, use_log in FEATURES.values():
+        values = table.column(column).astype(np.float64)
+        if use_log:
+            values = np.log10(np.maximum(values, 1))
+        columns.append(values)
+    matrix = np.column_stack(columns)
+    means = np.nanmean(matrix, axis=0)
+    stds = np.nanstd(matrix, axis=0)
+    # a column where every city has the same value does not tell the cities apart
+    stds[~(stds > 0)] = 1
+    matrix = (matrix - means) / stds
+    matrix[np.isnan(matrix)] = 0
+    return matrix
+
+
+def weight_vector(weights=None):
+    '''
+    This function returns the weight of every feature as a vector, in the order of FEATURES (1 for the ones not given).
+    '''
+    weights = weights or {}
+    return np.array([float(weights.get(name, 1)) for name in FEATURES], dtype=np.float64)
+
+
+def similar_positions(matrix, position, k=DEFAULT_K, weights=None):
+    '''
+    This function finds the k cities most like the city at a position.
+
+    Parameters:
+    matrix (np.ndarray): the standardized matrix, see standardize()
+    position (int): row position of the city in the table
+    k (int): how many cities to return
+    weights (dict): {feature name: weight}, a larger weight makes the feature count more (optional)
+
+    Returns:
+    positions (np.ndarray): row positions of the most similar cities, most similar first (without the city itself)
+    distances (np.ndarray): the weighted distance of each of them to the city
+    '''
+    squared = ((matrix - matrix[position]) ** 2) @ weight_vector(weights)
+    squared[position] = np.inf
+    k = min(k, len(squared) - 1)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    top = np.argpartition(squared, k - 1)[:k]
+    top = top[np.argsort(squared[top], kind='stable')]
+    return top, np.sqrt(squared[top])
+
+
+class SimilarityStore:
+    '''
+    This class keeps the standardized matrix for the last KEEP_VERSIONS versions of the table,
+    and computes it only for a version it does not have.
+    '''
+    def __init__(self):
+        # {table version: matrix}, oldest first
+        self.matrices = {}
+        self.lock = threading.Lock()
+
+    def get(self, table):
+        '''
+        This function returns the standardized matrix of a table (see standardize()).
+        '''
+        with self.lock:
+            matrix = self.matrices.get(table.version)
+            if matrix is None:
+                matrix = self.matrices[table.version] = standardize(table)
+                while len(self.matrices) > KEEP_VERSIONS:
+                    del self.matrices[next(iter(self.matrices))]
+            return matrix
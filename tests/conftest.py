@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+# the modules of the project are flat files in the folder above this one
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import city_index as ci
+import city_table as ct
+
+
+@pytest.fixture
+def index():
+    '''
+    A search index over four made-up cities.
+    '''
+    records = [
+        {'name': 'A', 'state': 'MI', 'latitude': 42.0, 'longitude': -83.0, 'population': 20000, 'house_price': 150000,
+         'crime_rate': 0.010, 'summer_high_temp': 85, 'winter_low_temp': 20},
+        {'name': 'B', 'state': 'OH', 'latitude': 40.0, 'longitude': -82.0, 'population': 50000, 'house_price': 250000,
+         'crime_rate': 0.020, 'summer_high_temp': 88, 'winter_low_temp': 25},
+        {'name': 'C', 'state': 'CA', 'latitude': 34.0, 'longitude': -118.0, 'population': 900000, 'house_price': 650000,
+         'crime_rate': 0.030, 'summer_high_temp': 95, 'winter_low_temp': 48},
+        {'name': 'D', 'state': 'TX', 'latitude': 30.0, 'longitude': -97.0, 'population': 300000, 'house_price': 350000,
+         'crime_rate': 0.025, 'summer_high_temp': 99, 'winter_low_temp': 42},
+    ]
+    return ci.CityIndex(ct.CityTable.from_records(records))
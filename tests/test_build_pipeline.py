@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+import time
+
+import pytest
+
+import build_pipeline as bp
+
+
+def test_topological_order_puts_dependencies_first():
+    stages = [bp.Stage('join', max, deps=('a', 'b')), bp.Stage('b', max, deps=('a',)), bp.Stage('a', max)]
+    assert [stage.name for stage in bp.topological_order(stages)] == ['a', 'b', 'join']
+
+
+def test_topological_order_rejects_cycles_and_unknown_stages():
+    with pytest.raises(ValueError, match='cycle'):
+        bp.topological_order([bp.Stage('a', max, deps=('b',)), bp.Stage('b', max, deps=('a',))])
+    with pytest.raises(ValueError, match='unknown'):
+        bp.topological_order([bp.Stage('a', max, deps=('missing',))])
+
+
+def test_critical_path():
+    stages = [bp.Stage('a', max), bp.Stage('b', max), bp.Stage('c', max, deps=('a', 'b'))]
+    assert bp.critical_path(stages, {'a': 1.0, 'b': 3.0, 'c': 0.5}) == (['b', 'c'], 3.5)
+
+
+def test_run_passes_outputs_along_and_runs_independent_stages_at_once():
+    def slow(value):
+        time.sleep(0.2)
+        return value
+
+    stages = [
+        bp.Stage('a', slow, args=(2,)),
+        bp.Stage('b', slow, args=(3,)),
+        bp.Stage('c', pow, deps=('a', 'b'), executor='process'),
+        bp.Stage('d', lambda c, offset: c + offset, deps=('c',), kwargs={'offset': 1}, executor='inline'),
+    ]
+    outputs, report = bp.BuildPipeline(stages, max_workers=4).run()
+    assert outputs['d'] == 9
+    assert report['critical_path'][-2:] == ['c', 'd']
+    # a and b ran side by side
+    assert report['stages']['b']['start'] < report['stages']['a']['start'] + 0.1
+
+
+def test_a_failed_build_resumes_from_the_checkpoints(tmp_path):
+    calls = []
+
+    def first():
+        calls.append('first')
+        return [1, 2, 3]
+
+    def second(values, fail):
+        calls.append('second')
+        if fail:
+            raise RuntimeError('the API is down')
+        return sum(values)
+
+    def stages(fail):
+        return [bp.Stage('first', first), bp.Stage('second', second, deps=('first',), kwargs={'fail': fail})]
+
+    checkpoint_dir = str(tmp_path / 'checkpoints')
+    with pytest.raises(RuntimeError):
+        bp.BuildPipeline(stages(True), checkpoint_dir, key='v1').run()
+    assert os.listdir(checkpoint_dir) == ['first.pkl']
+
+    outputs, report = bp.BuildPipeline(stages(False), checkpoint_dir, key='v1').run()
+    assert outputs['second'] == 6
+    assert report['resumed'] == ['first']
+    assert calls == ['first', 'second', 'second']
+    # the checkpoints are removed once the build has succeeded
+    assert os.listdir(checkpoint_dir) == []
+
+
+def test_checkpoints_of_other_sources_are_not_used(tmp_path):
+    checkpoint_dir = str(tmp_path)
+    with pytest.raises(ValueError):
+        bp.BuildPipeline([bp.Stage('a', int, args=('1',)), bp.Stage('b', int, args=('x',))], checkpoint_dir, key='v1').run()
+    assert os.listdir(checkpoint_dir) == ['a.pkl']
+
+    outputs, report = bp.BuildPipeline([bp.Stage('a', int, args=('2',))], checkpoint_dir, key='v2').run()
+    assert outputs['a'] == 2
+    assert report['resumed'] == []
+
+
+def test_a_failed_inline_stage_lets_the_running_stages_finish(tmp_path, caplog):
+    caplog.set_level(logging.INFO, logger='city_search.spans')
+
+    def slow():
+        time.sleep(0.3)
+        return 'slow'
+
+    def broken(value):
+        raise RuntimeError('bad join')
+
+    stages = [
+        bp.Stage('quick', int, args=('1',)),
+        bp.Stage('slow', slow),
+        bp.Stage('join', broken, deps=('quick',), executor='inline'),
+        bp.Stage('after', str, deps=('join', 'slow'), executor='inline'),
+    ]
+    checkpoint_dir = str(tmp_path)
+    with pytest.raises(RuntimeError, match='bad join'):
+        bp.BuildPipeline(stages, checkpoint_dir, key='v1').run()
+    # the stage still running when the inline stage failed was waited for and checkpointed
+    assert sorted(os.listdir(checkpoint_dir)) == ['quick.pkl', 'slow.pkl']
+    spans = [json.loads(record.getMessage()) for record in caplog.records]
+    assert {'span': 'join', 'status': 'error'}.items() <= [span for span in spans if span['span'] == 'join'][0].items()
+    assert not any(span['span'] == 'after' for span in spans)
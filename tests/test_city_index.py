@@ -0,0 +1,28 @@
+import numpy as np
+
+
+def test_range_positions_low_inclusive_high_exclusive(index):
+    assert sorted(index.range_positions('price', 250000, 650000)) == [1, 3]
+    assert sorted(index.range_positions('price', None, 250000)) == [0]
+    assert sorted(index.range_positions('price', 350000)) == [2, 3]
+
+
+def test_range_positions_leaves_out_nan_values(index):
+    # e.g. a price trend, unknown for the cities without a price history
+    index = index.with_attributes({'trend': np.array([0.1, np.nan, -0.2, np.nan])})
+    assert sorted(index.range_positions('trend', -5)) == [0, 2]
+    assert sorted(index.range_positions('trend')) == [0, 2]
+    assert list(index.range_positions('trend', None, 0)) == [2]
+
+
+def test_query_positions_never_matches_nan_values(index):
+    index = index.with_attributes({'trend': np.array([0.1, np.nan, -0.2, np.nan])})
+    # the price range is the smallest slice, so the trend range is checked on the cities it leaves
+    assert list(index.query_positions({'price': (200000, 400000), 'trend': (-5, None)})) == []
+    assert list(index.query_positions({'price': (None, 300000), 'trend': (None, None)})) == [0]
+
+
+def test_query_positions_combines_ranges_and_sorts(index):
+    positions = index.query_positions({'price': (200000, None), 'summer_high': (None, 100)}, sort_by='population', descending=True)
+    assert list(positions) == [2, 3, 1]
+    assert list(index.query_positions(sort_by='price', limit=2)) == [0, 1]
@@ -0,0 +1,40 @@
+import numpy as np
+
+import city_index as ci
+import city_table as ct
+import correlations as cr
+
+
+def make_table():
+    records = [
+        {'name': 'A', 'state': 'MI', 'population': 20000, 'house_price': 150000, 'crime_rate': 0.010,
+         'summer_high_temp': 85, 'winter_low_temp': 0},
+        {'name': 'B', 'state': 'OH', 'population': '', 'house_price': 250000, 'crime_rate': 0.020,
+         'summer_high_temp': '', 'winter_low_temp': None},
+        {'name': 'C', 'state': 'CA', 'population': 900000, 'house_price': 650000, 'crime_rate': 0.030,
+         'summer_high_temp': 95, 'winter_low_temp': 48},
+    ]
+    return ct.CityTable.from_records(records)
+
+
+def test_missing_numbers():
+    table = make_table()
+    # a missing decimal number is NaN (not 0, which is a real winter low), a missing whole number is 0
+    assert table.column('winter_low_temp')[0] == 0
+    assert np.isnan(table.column('winter_low_temp')[1])
+    assert np.isnan(table.column('summer_high_temp')[1])
+    assert table.column('population')[1] == 0
+    assert table[1].to_dict()['winter_low_temp'] is None
+    assert table[0].to_dict()['winter_low_temp'] == 0
+
+
+def test_missing_numbers_match_no_range():
+    index = ci.CityIndex(make_table())
+    assert sorted(index.query_positions({'winter_low': (None, 10)})) == [0]
+    assert sorted(index.query_positions({'winter_low': (None, None)})) == [0, 2]
+
+
+def test_correlations_leave_out_missing_numbers():
+    stats = cr.compute_correlations(make_table())
+    assert stats['price_sum_temp']['n'] == 2
+    assert stats['price_crime']['n'] == 3
@@ -0,0 +1,22 @@
+import city_table as ct
+import correlations as cr
+
+
+def make_table(price):
+    records = [{'name': name, 'state': 'MI', 'population': population, 'house_price': price * population,
+                'crime_rate': 0.01, 'summer_high_temp': 80 + i, 'winter_low_temp': 20 - i}
+               for i, (name, population) in enumerate([('A', 1000), ('B', 2000), ('C', 3000)])]
+    return ct.CityTable.from_records(records)
+
+
+def test_store_keeps_the_previous_version():
+    store = cr.CorrelationStore()
+    old, new = make_table(1), make_table(2)
+    old_stats, new_stats = store.get(old), store.get(new)
+    # a late request for the old table does not replace the new one
+    assert store.get(old) is old_stats
+    assert store.get(new) is new_stats
+    assert store.figure(old, 'price_population') is store.figure(old, 'price_population')
+    newest = make_table(3)
+    store.get(newest)
+    assert list(store.versions) == [new.version, newest.version]
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+import requests
+
+import get_crime_data as gcr
+import mock_crime_api as mca
+
+
+@pytest.fixture
+def mock_api(request):
+    servers = []
+
+    def start(**options):
+        server, base_url = mca.start_mock_server(**options)
+        servers.append(server)
+        return server, base_url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def test_fetch_all_retries_rate_limited_requests(mock_api):
+    server, base_url = mock_api(fail_every=2)
+    client = gcr.CrimeClient(base_url=base_url, api_key='test', max_workers=2, backoff=0, cache_dir=None)
+    results = client.fetch_all(['CA', 'MI', 'OH'])
+    assert results['MI'] == mca.fake_state_data('MI', gcr.FROM_YEAR, gcr.TO_YEAR)
+    assert sorted(results) == ['CA', 'MI', 'OH']
+    # every other request failed, and was tried again
+    assert server.request_count > 3
+
+
+def test_fetch_state_gives_up_after_the_last_retry(mock_api):
+    server, base_url = mock_api(fail_every=1, fail_status=503)
+    client = gcr.CrimeClient(base_url=base_url, api_key='test', max_retries=2, backoff=0, cache_dir=None)
+    with pytest.raises(requests.HTTPError):
+        client.fetch_state('CA')
+    assert server.request_count == 3
+
+
+def test_fetch_state_reads_the_cache_the_second_time(mock_api, tmp_path):
+    server, base_url = mock_api()
+    client = gcr.CrimeClient(base_url=base_url, api_key='test', backoff=0, cache_dir=str(tmp_path))
+    first = client.fetch_state('TX')
+    assert client.fetch_state('TX') == first
+    assert server.request_count == 1
+
+
+def test_get_data_leaves_the_list_of_states_as_it_was(mock_api):
+    _, base_url = mock_api()
+    states = gcr.load_states(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), gcr.STATES_FILE))[:3]
+    client = gcr.CrimeClient(base_url=base_url, api_key='test', backoff=0, cache_dir=None)
+    rows = gcr.get_data(client, states)
+    assert [row['state'] for row in rows] == [state['state'] for state in states]
+    assert all(row['crime rate'] > 0 for row in rows)
+    assert all('crime rate' not in state for state in states)
@@ -0,0 +1,19 @@
+import numpy as np
+
+import geo_index as gi
+import zipcode_index as zi
+
+
+def test_nearest_many_finds_the_closest_point():
+    index = gi.GeoIndex(np.array([42.28, 40.71, 34.05]), np.array([-83.74, -74.01, -118.24]))
+    indices, distances = index.nearest_many([42.0, 34.1], [-83.0, -118.0])
+    assert list(indices) == [0, 2]
+    assert np.all(distances < 100)
+
+
+def test_nearest_many_on_an_empty_index():
+    index = gi.GeoIndex(np.array([]), np.array([]))
+    indices, distances = index.nearest_many([42.0, 34.1], [-83.0, -118.0])
+    assert list(indices) == [-1, -1]
+    assert np.all(np.isinf(distances))
+    assert zi.build_zipcode_index([]).lookup_many([42.0], [-83.0]) == [None]
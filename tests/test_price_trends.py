@@ -0,0 +1,45 @@
+import os
+import shutil
+
+import city_index as ci
+import city_table as ct
+import get_house_prices as ghp
+import join_data as jd
+import price_trends as pt
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_prices(data_dir, growth):
+    months = ['2018-{:02d}'.format(month) for month in range(1, 13)] + ['2019-{:02d}'.format(month) for month in range(1, 13)]
+    with open(os.path.join(data_dir, ghp.SOURCE_FILE), 'w', encoding='utf-8') as file_obj:
+        file_obj.write('RegionName,StateName,' + ','.join(months) + '\n')
+        for city, price in [('A', 100000), ('B', 200000)]:
+            file_obj.write(city + ',Michigan,' + ','.join(str(int(price * growth ** i)) for i in range(len(months))) + '\n')
+
+
+def make_index(price):
+    records = [{'name': name, 'state': 'MI', 'population': 1000, 'house_price': price, 'crime_rate': 0.01}
+               for name in ('A', 'B', 'C')]
+    return ci.CityIndex(ct.CityTable.from_records(records))
+
+
+def test_trend_store(tmp_path):
+    shutil.copy(os.path.join(REPO_DIR, jd.STATES_FILE), tmp_path)
+    write_prices(tmp_path, 1.01)
+    store = pt.TrendStore(str(tmp_path), str(tmp_path))
+    old, new = make_index(1), make_index(2)
+    old_trends, new_trends = store.get(old), store.get(new)
+    assert store.get(old) is old_trends
+    assert store.get(new) is new_trends
+    assert new_trends.values['price_yoy'][0] > 0
+    months, prices = store.history(new, 1)
+    assert len(months) == 24 and prices[0] == 200000
+    assert store.history(new, 2)[1] is None
+
+    # a new price file is only picked up by check_source()
+    write_prices(tmp_path, 0.99)
+    os.utime(os.path.join(tmp_path, ghp.SOURCE_FILE), ns=(0, 0))
+    assert store.get(new) is new_trends
+    store.check_source()
+    assert store.get(new).values['price_yoy'][0] < 0
@@ -0,0 +1,22 @@
+import query_cache as qc
+
+
+def test_new_version_keeps_the_old_entries():
+    cache = qc.QueryCache()
+    assert cache.get_or_build('api', {'q': 1}, 'v1', lambda: 'old') == 'old'
+    assert cache.get_or_build('api', {'q': 1}, 'v2', lambda: 'new') == 'new'
+    # a search still running on the old version finds its answer, and the new one is not mixed up with it
+    assert cache.get_or_build('api', {'q': 1}, 'v1', lambda: 'rebuilt') == 'old'
+    assert cache.get_or_build('api', {'q': 1}, 'v2', lambda: 'rebuilt') == 'new'
+    stats = cache.stats()
+    assert (stats['entries'], stats['hits'], stats['misses']) == (2, 2, 2)
+    assert stats['invalidations'] == 3
+
+
+def test_local_backend_drops_the_least_recently_used():
+    backend = qc.LocalBackend(max_entries=2)
+    backend.set('a', '1')
+    backend.set('b', '2')
+    backend.get('a')
+    backend.set('c', '3')
+    assert (backend.get('a'), backend.get('b'), backend.get('c')) == ('1', None, '3')
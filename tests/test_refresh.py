@@ -0,0 +1,33 @@
+import os
+
+import city_index as ci
+import dataset as ds
+import index_snapshot as snap
+import refresh as rf
+
+
+def test_only_one_process_holds_the_refresh_lock(tmp_path):
+    file_name = os.path.join(tmp_path, rf.REFRESH_LOCK_FILE)
+    leader = rf.lock_file(file_name, blocking=False)
+    assert leader is not None
+    # every open of the file is a separate lock, like in another process
+    assert rf.lock_file(file_name, blocking=False) is None
+    leader.close()
+    follower = rf.lock_file(file_name, blocking=False)
+    assert follower is not None
+    follower.close()
+
+
+def test_reload_snapshot_loads_another_version(tmp_path, index):
+    config = {'CACHE_DIR': str(tmp_path)}
+    holder = ds.DatasetHolder(ds.Dataset(index.table, index))
+    assert not rf.reload_snapshot(holder, config)
+
+    table = index.table.take(slice(None))
+    table.version = snap.table_version('b' * 64)
+    snap.write_snapshot(os.path.join(tmp_path, snap.SNAPSHOT_FILE), table, ci.CityIndex(table), 'b' * 64)
+    assert rf.reload_snapshot(holder, config)
+    assert holder.get().table.version == table.version
+    assert len(holder.get()) == len(index.table)
+    # nothing new the next time
+    assert not rf.reload_snapshot(holder, config)
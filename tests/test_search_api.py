@@ -0,0 +1,62 @@
+import pytest
+from werkzeug.datastructures import MultiDict
+
+import search_api as sa
+import similarity as sim
+
+
+@pytest.mark.parametrize('value', ['inf', '-inf', 'nan', 'abc'])
+def test_parse_number_rejects_what_is_not_a_finite_number(value):
+    with pytest.raises(sa.SearchError):
+        sa.parse_number(MultiDict({'limit': value}), 'limit')
+
+
+def test_parse_number():
+    assert sa.parse_number(MultiDict({'min_price': '250000'}), 'min_price') == 250000.0
+    assert sa.parse_number(MultiDict({'min_price': ''}), 'min_price') is None
+    assert sa.parse_number(MultiDict(), 'min_price') is None
+
+
+def test_parse_limit_stays_within_the_page_sizes():
+    assert sa.parse_limit(MultiDict()) == sa.DEFAULT_PAGE_SIZE
+    assert sa.parse_limit(MultiDict({'limit': '0'})) == 1
+    assert sa.parse_limit(MultiDict({'limit': '1e9'})) == sa.MAX_PAGE_SIZE
+    with pytest.raises(sa.SearchError):
+        sa.parse_limit(MultiDict({'limit': 'inf'}))
+
+
+def test_parse_search_args_narrows_buckets_with_ranges():
+    args = MultiDict([('bucket', 'price 200-400k'), ('min_price', '300000'), ('max_summer_high', '95'), ('sort', '-population')])
+    ranges, sort_by, descending = sa.parse_search_args(args)
+    assert ranges == {'price': (300000.0, 400000), 'summer_high': (None, 95.0)}
+    assert (sort_by, descending) == ('population', True)
+
+
+def test_parse_search_args_errors():
+    with pytest.raises(sa.SearchError):
+        sa.parse_search_args(MultiDict({'bucket': 'bogus'}))
+    with pytest.raises(sa.SearchError):
+        sa.parse_search_args(MultiDict({'sort': 'name'}))
+
+
+def test_parse_nearby_args():
+    assert sa.parse_nearby_args(MultiDict()) == (None, sa.DEFAULT_PAGE_SIZE)
+    assert sa.parse_nearby_args(MultiDict({'radius': '100'})) == (100.0, None)
+    assert sa.parse_nearby_args(MultiDict({'k': '5000'})) == (None, sa.MAX_PAGE_SIZE)
+    for args in ({'radius': '-1'}, {'radius': 'nan'}, {'k': 'inf'}):
+        with pytest.raises(sa.SearchError):
+            sa.parse_nearby_args(MultiDict(args))
+
+
+def test_parse_similar_args():
+    assert sa.parse_similar_args(MultiDict()) == (sim.DEFAULT_K, {})
+    assert sa.parse_similar_args(MultiDict({'k': '1000', 'w_price': '2'})) == (sim.MAX_K, {'price': 2.0})
+    for args in ({'k': 'nan'}, {'w_price': '-1'}):
+        with pytest.raises(sa.SearchError):
+            sa.parse_similar_args(MultiDict(args))
+
+
+def test_nearby_with_a_radius_returns_one_page(index):
+    results = sa.nearby(index, MultiDict({'near': 'a', 'radius': '5000', 'limit': '2'}))
+    assert results['count'] == 4
+    assert [result['name'] for result in results['results']] == ['A', 'B']
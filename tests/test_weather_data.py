@@ -0,0 +1,57 @@
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+import weather_data as wd
+
+START = datetime(2018, 1, 1)
+END = datetime(2022, 12, 31)
+
+
+class FakeSource:
+    '''
+    A stand-in for MeteostatSource: the station of a city is picked from its latitude, and every station has the
+    same made-up monthly temperatures. It counts how often it is asked for the data of each station.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.monthly_calls = []
+
+    def nearby_station(self, lat, long):
+        # no station in the far north
+        return None if lat > 60 else 'S' + str(int(lat) // 10)
+
+    def monthly(self, station_id, start, end):
+        with self.lock:
+            self.monthly_calls.append(station_id)
+        months = pd.date_range(start, end, freq='MS')
+        return pd.DataFrame({'tmax': [30.0 if month.month in (7, 8) else 10.0 for month in months],
+                             'tmin': [-5.0 if month.month in (12, 1) else 5.0 for month in months]}, index=months)
+
+
+CITIES = [{'latitude': lat, 'longitude': -80.0} for lat in (41.0, 42.5, 43.9, 33.0, 70.0)]
+
+
+def test_fetch_weather_fetches_every_station_once(tmp_path):
+    source = FakeSource()
+    city_stations, station_data = wd.fetch_weather(CITIES, START, END, source=source, max_workers=4, cache_dir=str(tmp_path))
+    assert city_stations == ['S4', 'S4', 'S4', 'S3', None]
+    assert sorted(source.monthly_calls) == ['S3', 'S4']
+    assert sorted(station_data) == ['S3', 'S4']
+
+    params = wd.seasonal_params(wd.to_long_format(station_data))
+    assert params.loc['S4', 'summer_high_temp'] == 86
+    assert params.loc['S4', 'winter_low_temp'] == 23
+
+
+def test_fetch_weather_reads_the_station_cache_the_second_time(tmp_path):
+    first = FakeSource()
+    _, first_data = wd.fetch_weather(CITIES, START, END, source=first, cache_dir=str(tmp_path))
+    second = FakeSource()
+    _, second_data = wd.fetch_weather(CITIES, START, END, source=second, cache_dir=str(tmp_path))
+    assert second.monthly_calls == []
+    for station_id, data_m in first_data.items():
+        pd.testing.assert_frame_equal(second_data[station_id], data_m, check_freq=False, check_names=False)
+    # no temporary files are left behind
+    assert sorted(path.suffix for path in tmp_path.iterdir()) == ['.csv', '.csv']
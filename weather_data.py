@@ -0,0 +1,212 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+
+import cache_store as cs
+
+# Notes on the approach
+# Many cities (especially suburbs of the same metro area) end up with the same closest weather station.
+# So we first map every city to a station, and then fetch the monthly data only once per station.
+# The monthly data of each station is saved in a local cache folder, keyed by station and date range,
+# so that a re-run with a different minimum population only fetches the stations it has not seen before.
+# pandas (and meteostat) are only imported by the functions that need them, so that importing this module
+# (which the web app does, through dataset.py) stays cheap when the data is already cached.
+
+CACHE_DIR = 'weather_cache'
+
+# how many requests to the weather source can be in flight at the same time
+DEFAULT_WORKERS = 8
+
+# only consider weather stations within this distance of the city (in meters)
+STATION_RADIUS = 35000
+
+
+class MeteostatSource:
+    '''
+    This class is the default weather data source, backed by the Python Meteostat library.
+    Any object with the same two methods (nearby_station and monthly) can be used in its place,
+    for instance a local stand-in that reads from files.
+    '''
+    def __init__(self, radius=STATION_RADIUS):
+        import meteostat
+        self.meteostat = meteostat
+        self.radius = radius
+
+    def nearby_station(self, lat, long):
+        '''
+        This function returns the id of the weather station closest to a location, or None if there is none nearby.
+        '''
+        stations = self.meteostat.Stations().nearby(float(lat), float(long), self.radius).fetch(1)
+        if stations.empty:
+            return None
+        return str(stations.index[0])
+
+    def monthly(self, station_id, start, end):
+        '''
+        This function returns the monthly weather data of a station as a dataframe indexed by month.
+        '''
+        return self.meteostat.Monthly(station_id, start, end).fetch()
+
+
+def cache_file_name(station_id, start, end, cache_dir=CACHE_DIR):
+    '''
+    This function returns the name of the cache file for a station and date range.
+    '''
+    return os.path.join(cache_dir, f'{station_id}_{start:%Y%m%d}_{end:%Y%m%d}.csv')
+
+
+def read_station_cache(station_id, start, end, cache_dir=CACHE_DIR):
+    '''
+    This function returns the cached monthly data of a station, or None if it has not been fetched before.
+    '''
+    file_name = cache_file_name(station_id, start, end, cache_dir)
+    if not os.path.exists(file_name):
+        return None
+    import pandas as pd
+    return pd.read_csv(file_name, index_col='time', parse_dates=['time'])
+
+
+def write_station_cache(station_id, start, end, data_m, cache_dir=CACHE_DIR):
+    '''
+    This function writes the monthly data of a station to the cache.
+    The data is written through cache_store.atomic_write(), so a half-written file is never read back.
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    data_m = data_m.copy()
+    data_m.index.name = 'time'
+    cs.atomic_write(cache_file_name(station_id, start, end, cache_dir), data_m.to_csv)
+
+
+def fetch_station_monthly(source, station_id, start, end, cache_dir=CACHE_DIR):
+    '''
+    This function returns the monthly data of a station, from the cache if possible, or from the source.
+
+    Parameters:
+    source (MeteostatSource): where to get the data from on a cache miss
+    station_id (str): id of the weather station
+    start (datetime): first day of the date range
+    end (datetime): last day of the date range
+    cache_dir (str): the cache folder
+
+    Returns:
+    data_m (DataFrame): monthly weather data of the station
+    '''
+    data_m = read_station_cache(station_id, start, end, cache_dir)
+    if data_m is None:
+        data_m = source.monthly(station_id, start, end)
+        # empty results are cached too, so that stations without data are not asked again
+        write_station_cache(station_id, start, end, data_m, cache_dir)
+    return data_m
+
+
+def fetch_weather(cities_list, start, end, source=None, max_workers=DEFAULT_WORKERS, cache_dir=CACHE_DIR):
+    '''
+    This function gets the monthly weather data for a list of cities.
+    Cities are mapped to their closest weather station, and every station is only fetched once.
+    Both steps run on a thread pool of at most max_workers threads.
+
+    Parameters:
+    cities_list (list): list of city dictionaries with 'latitude' and 'longitude'
+    start (datetime): first day of the date range
+    end (datetime): last day of the date range
+    source (MeteostatSource): the weather data source (defaults to the Meteostat library)
+    max_workers (int): maximum number of concurrent requests to the source
+    cache_dir (str): the cache folder
+
+    Returns:
+    city_stations (list): the station id of every city (None if no station is nearby)
+    station_data (dict): monthly weather dataframe for every station id
+    '''
+    if source is None:
+        source = MeteostatSource()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        # map every city to its closest station
+        city_stations = list(pool.map(lambda city: source.nearby_station(city['latitude'], city['longitude']), cities_list))
+        stations = sorted({s for s in city_stations if s is not None})
+        print('   ...' + str(len(cities_list)) + ' cities map to ' + str(len(stations)) + ' distinct weather stations')
+
+        # fetch the monthly data once per station
+        station_data = {}
+        futures = {pool.submit(fetch_station_monthly, source, s, start, end, cache_dir): s for s in stations}
+        progress_counter = 0
+        for future in as_completed(futures):
+            station_data[futures[future]] = future.result()
+
+            # show progress in steps of ~25%
+            progress_counter += 1
+            if abs((progress_counter*100/len(stations))%25 - 25) <0.8:
+                print('   ...' + str(round(progress_counter/len(stations),2) * 100) + '% done')
+
+    return city_stations, station_data
+
+
+# SEASONAL AGGREGATION
+# Each season is (column of the monthly data to average, months in the season, in order).
+# A season that wraps around the new year (like December + January) is counted in the year it starts in.
+SEASONS = {
+    'summer_high_temp': ('tmax', (7, 8)),
+    'winter_low_temp': ('tmin', (12, 1)),
+}
+
+# the seasons (by starting year) that are averaged together
+SEASON_YEARS = (2018, 2021)
+
+
+def to_long_format(station_data):
+    '''
+    This function stacks the monthly dataframes of many stations into one long-format dataframe.
+
+    Parameters:
+    station_data (dict): monthly weather dataframe (indexed by month) for every station id
+
+    Returns:
+    long_df (DataFrame): one row per station and month, with a 'station' and a 'time' column
+    '''
+    import pandas as pd
+    frames = [data_m.rename_axis('time').reset_index().assign(station=station_id)
+              for station_id, data_m in station_data.items() if data_m is not None and not data_m.empty]
+    if not frames:
+        return pd.DataFrame(columns=['station', 'time'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def seasonal_params(long_df, seasons=SEASONS, years=SEASON_YEARS):
+    '''
+    This function calculates the seasonal averages (by default the summer high and winter low temperatures)
+    of every station in one grouped pass. Months are picked by their date, not by their position,
+    so missing months are simply left out of the average. Missing values (NaN) are ignored as well.
+
+    Parameters:
+    long_df (DataFrame): monthly data of all stations, see to_long_format()
+    seasons (dict): {output name: (column, months)} for every season to calculate
+    years (tuple): first and last season year to include
+
+    Returns:
+    params (DataFrame): one row per station, one column (in degrees fahrenheit, rounded) per season
+    '''
+    import pandas as pd
+    times = pd.to_datetime(long_df['time'])
+    month = times.dt.month.to_numpy()
+    year = times.dt.year.to_numpy()
+
+    selected = []
+    for name, (column, months) in seasons.items():
+        if column not in long_df.columns:
+            continue
+        # months earlier in the calendar than the first month of the season belong to the previous season year
+        season_year = year - (month < months[0])
+        mask = np.isin(month, months) & (season_year >= years[0]) & (season_year <= years[1])
+        selected.append(pd.DataFrame({'station': long_df['station'].to_numpy()[mask], 'season': name,
+                                      'value': long_df[column].to_numpy(dtype=np.float64)[mask]}))
+
+    stations = pd.Index(long_df['station'].unique(), name='station')
+    if not selected:
+        return pd.DataFrame(index=stations, columns=list(seasons), dtype=np.float64)
+
+    # mean() skips NaN values, just like numpy.nanmean
+    params = pd.concat(selected, ignore_index=True).groupby(['station', 'season'])['value'].mean().unstack('season')
+    params = params.reindex(index=stations, columns=list(seasons))
+
+    # convert to fahrenheit
+    return (params * 9/5 + 32).round(2)
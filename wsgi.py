@@ -0,0 +1,19 @@
+import gc
+
+import hardikm_final_proj_v1 as proj
+
+# WSGI entry point of the city search tool, e.g.
+#     gunicorn --preload --workers 4 wsgi:app
+#
+# With --preload the data is loaded once, here, in the master process, before the workers are forked.
+# The workers then share the loaded data (copy-on-write) instead of each loading it again.
+# With CITY_SEARCH_REFRESH_INTERVAL set, every worker starts a refresh thread on its first request
+# (the master process, which never answers requests, does not refresh). Only the worker that takes the lock on
+# refresh.lock in the cache folder refreshes the data from the sources and writes the snapshot; the other workers load
+# that snapshot when it changes, so the sources are called once and every worker serves the same table version.
+# Settings come from the CITY_SEARCH_* environment variables (see config.py).
+app = proj.create_app()
+
+# move everything loaded so far out of the garbage collector's reach, so that its bookkeeping
+# does not write to (and so copy) the shared memory pages in every worker
+gc.freeze()
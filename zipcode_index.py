@@ -0,0 +1,176 @@
+import os
+import threading
+import zipfile
+import numpy as np
+
+import cache_store as cs
+import geo_index as gi
+
+# The prebuilt index is written to this file the first time it is built,
+# so that later runs can load it straight from disk instead of reading all ~42k zipcodes again.
+INDEX_FILE = 'zipcode_index.npz'
+
+# bump this whenever the layout of the saved file changes
+INDEX_VERSION = 2
+
+# the indexes for this process, built (or loaded) once on first use: {file name: index} for the ones built from
+# the Python Zipcodes library, and the last (zipcodes_list, index) built from a list that was passed in
+_ZIPCODE_INDEXES = {}
+_LIST_INDEX = None
+_LOCK = threading.Lock()
+
+
+def library_source():
+    '''
+    This function describes what an index built from the Python Zipcodes library is built from (its version),
+    so that a saved index is built again when the library is upgraded.
+    '''
+    return 'zipcodes ' + cs.package_version('zipcodes')
+
+
+class ZipcodeIndex:
+    '''
+    This class wraps a GeoIndex over the coordinates of every US zipcode,
+    together with the county, state and zipcode of each point.
+    '''
+    def __init__(self, geo, counties, states, zip_codes):
+        self.geo = geo
+        self.counties = counties
+        self.states = states
+        self.zip_codes = zip_codes
+
+    def __len__(self):
+        return len(self.zip_codes)
+
+    def lookup(self, lat, long, max_distance_km=None):
+        '''
+        This function returns the county, state and zipcode closest to a given latitude and longitude.
+
+        Parameters:
+        lat (float): latitude of the location
+        long (float): longitude of the location
+        max_distance_km (float): if the closest zipcode is further away than this, return None (optional)
+
+        Returns:
+        (county, state, zipcode) (tuple): details of the closest zipcode, or None
+        '''
+        index, distance = self.geo.nearest(float(lat), float(long))
+        if index is None or (max_distance_km is not None and distance > max_distance_km):
+            return None
+        return str(self.counties[index]), str(self.states[index]), str(self.zip_codes[index])
+
+    def lookup_many(self, lats, longs, max_distance_km=None):
+        '''
+        This function returns the closest county, state and zipcode for a whole batch of locations.
+
+        Parameters:
+        lats (list): latitudes of the locations
+        longs (list): longitudes of the locations
+        max_distance_km (float): see lookup()
+
+        Returns:
+        results (list): a (county, state, zipcode) tuple, or None (too far, or no zipcodes at all), for every location
+        '''
+        indices, distances = self.geo.nearest_many(lats, longs)
+        results = []
+        for index, distance in zip(indices, distances):
+            if index < 0 or (max_distance_km is not None and distance > max_distance_km):
+                results.append(None)
+            else:
+                results.append((str(self.counties[index]), str(self.states[index]), str(self.zip_codes[index])))
+        return results
+
+    def save(self, file_name=INDEX_FILE, source=''):
+        '''
+        This function writes the index to a .npz file (through a temporary file, see cache_store.atomic_write()).
+
+        Parameters:
+        file_name (str): path of the .npz file
+        source (str): what the index was built from (see library_source())
+        '''
+        cs.atomic_write(file_name, lambda file_obj: np.savez(file_obj, version=np.array(INDEX_VERSION), source=np.array(source),
+                                                             counties=self.counties, states=self.states,
+                                                             zip_codes=self.zip_codes, **self.geo.to_arrays()), mode='wb')
+
+
+def build_zipcode_index(zipcodes_list):
+    '''
+    This function builds a ZipcodeIndex from a list of zipcode dictionaries (as returned by the Python Zipcodes library).
+    The coordinates are converted to floats once here, and never again.
+
+    Parameters:
+    zipcodes_list (list): list of zipcode dictionaries
+
+    Returns:
+    index (ZipcodeIndex): the spatial index over the zipcodes
+    '''
+    # some zipcodes (PO boxes, military) have no coordinates
+    usable = [z for z in zipcodes_list if z['lat'] not in (None, '') and z['long'] not in (None, '')]
+    lats = np.array([float(z['lat']) for z in usable], dtype=np.float64)
+    longs = np.array([float(z['long']) for z in usable], dtype=np.float64)
+    counties = np.array([z['county'] or '' for z in usable], dtype=str)
+    states = np.array([z['state'] or '' for z in usable], dtype=str)
+    zip_codes = np.array([z['zip_code'] for z in usable], dtype=str)
+    return ZipcodeIndex(gi.GeoIndex(lats, longs), counties, states, zip_codes)
+
+
+def load_zipcode_index(file_name=INDEX_FILE, source=None):
+    '''
+    This function loads a ZipcodeIndex written by ZipcodeIndex.save().
+
+    Parameters:
+    file_name (str): path to the .npz file
+    source (str): what the index should have been built from (not checked if None)
+
+    Returns:
+    index (ZipcodeIndex): the index, or None if the file is missing, unreadable,
+    or was written by a different version or from a different source
+    '''
+    if not os.path.exists(file_name):
+        return None
+    try:
+        with np.load(file_name, allow_pickle=False) as arrays:
+            if int(arrays['version']) != INDEX_VERSION:
+                return None
+            if source is not None and str(arrays['source']) != source:
+                return None
+            arrays = {k: arrays[k] for k in arrays.files}
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        # e.g. a file cut short by an older version that did not write it atomically
+        return None
+    return ZipcodeIndex(gi.GeoIndex.from_arrays(arrays), arrays['counties'], arrays['states'], arrays['zip_codes'])
+
+
+def get_zipcode_index(zipcodes_list=None, file_name=INDEX_FILE):
+    '''
+    This function returns the zipcode index for this process.
+    If zipcodes_list is given, the index is built from it (once per list). Otherwise it is loaded from file_name
+    if the file was built from the installed version of the Python Zipcodes library, or built from the library
+    and saved for next time.
+
+    Parameters:
+    zipcodes_list (list): list of zipcode dictionaries to build from (optional)
+    file_name (str): path of the prebuilt index
+
+    Returns:
+    index (ZipcodeIndex): the spatial index over the zipcodes
+    '''
+    global _LIST_INDEX
+    with _LOCK:
+        if zipcodes_list is not None:
+            # a list is not saved: the file is only for the library data
+            if _LIST_INDEX is None or _LIST_INDEX[0] is not zipcodes_list:
+                _LIST_INDEX = (zipcodes_list, build_zipcode_index(zipcodes_list))
+            return _LIST_INDEX[1]
+
+        if file_name in _ZIPCODE_INDEXES:
+            return _ZIPCODE_INDEXES[file_name]
+        source = library_source()
+        index = load_zipcode_index(file_name, source)
+        if index is None:
+            import zipcodes
+            index = build_zipcode_index(zipcodes.filter_by(country="US"))
+            index.save(file_name, source)
+            print('Built a spatial index over ' + str(len(index)) + ' zipcodes and saved it to ' + file_name + '.')
+        _ZIPCODE_INDEXES[file_name] = index
+        return index